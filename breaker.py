@@ -0,0 +1,90 @@
+import logging
+import threading
+import time
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+BREAKER_STATE = metrics.registry.gauge(
+    'bot_breaker_open', 'Предохранитель разомкнут: 1 — да, 0 — нет',
+    ('name',)
+)
+BREAKER_CALLS = metrics.registry.counter(
+    'bot_breaker_calls_total',
+    'Запросы через предохранитель: пропущенные, пробные и отклонённые',
+    ('name', 'result')
+)
+
+
+class CircuitBreaker:
+    """Предохранитель для запросов к одному сервису.
+
+    closed — запросы идут как обычно. После failure_threshold
+    неудач подряд предохранитель размыкается (open), и запросы
+    отклоняются без обращения к сервису. Через recovery_timeout
+    секунд пропускается один пробный запрос (half_open): успех
+    замыкает предохранитель, неудача снова размыкает его на
+    recovery_timeout. Так во время сбоя к сервису уходит один
+    запрос за интервал, сколько бы пользователей его ни ждали.
+    """
+
+    def __init__(self, name, failure_threshold=5, recovery_timeout=60,
+                 clock=time.monotonic):
+        """Инициализация переменных."""
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+        BREAKER_STATE.set(0, name=name)
+
+    def allow(self):
+        """Можно ли отправить запрос сейчас."""
+        with self._lock:
+            if self.state == CLOSED:
+                BREAKER_CALLS.inc(name=self.name, result='passed')
+                return True
+            if self.state == OPEN and (
+                self.clock() - self.opened_at >= self.recovery_timeout
+            ):
+                # пробный запрос один: пока он идёт, остальные ждут
+                self.state = HALF_OPEN
+                BREAKER_CALLS.inc(name=self.name, result='probe')
+                logger.info('Предохранитель %s: пробный запрос', self.name)
+                return True
+            BREAKER_CALLS.inc(name=self.name, result='rejected')
+            return False
+
+    def record_success(self):
+        """Запрос прошёл: сервис работает."""
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info('Предохранитель %s замкнут', self.name)
+                BREAKER_STATE.set(0, name=self.name)
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        """Запрос не прошёл из-за сбоя сервиса."""
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or (
+                self.state == CLOSED
+                and self.failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.opened_at = self.clock()
+                BREAKER_STATE.set(1, name=self.name)
+                logger.warning(
+                    'Предохранитель %s разомкнут после %s неудач подряд',
+                    self.name, self.failures
+                )
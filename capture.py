@@ -0,0 +1,163 @@
+import argparse
+from collections import Counter
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from logconfig import RedactSecretsFilter
+
+
+logger = logging.getLogger(__name__)
+
+
+class CaptureRecorder:
+    """Запись обменов с api в файл захвата.
+
+    Файл только дописывается: одна компактная json-строка на запрос
+    с параметрами, временем, кодом ответа и телом. Токены вырезаются
+    из тела и текста ошибки, заголовки не пишутся вовсе. Писать можно
+    из нескольких потоков.
+    """
+
+    def __init__(self, path, secrets=()):
+        """Инициализация переменных."""
+        self.path = path
+        self._redactor = RedactSecretsFilter(secrets)
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def record(self, tenant, params, started, duration, status=None,
+               body='', error=None):
+        """Дописываем обмен; status None — ответа не было, см. error."""
+        line = json.dumps({
+            'ts': round(started, 3),
+            'ms': round(duration * 1000, 1),
+            'tenant': tenant,
+            'params': params,
+            'status': status,
+            'body': self._redactor.redact(body),
+            'error': error and self._redactor.redact(error),
+        }, ensure_ascii=False, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        """Закрываем файл захвата."""
+        with self._lock:
+            self._file.close()
+
+
+def read_capture(path):
+    """Обмены из файла захвата по порядку записи.
+
+    Недописанная строка в конце файла (процесс остановили во время
+    записи) пропускается.
+    """
+    with open(path, encoding='utf-8') as capture:
+        for number, line in enumerate(capture, 1):
+            try:
+                yield json.loads(line)
+            except ValueError:
+                logger.warning('Пропускаем битую строку %s захвата', number)
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def replay(exchanges, handle, speed=0, clock=time.monotonic,
+           sleep=time.sleep):
+    """Прогоняем обмены через handle(exchange).
+
+    speed 0 — как можно быстрее, иначе паузы между обменами как при
+    записи, ускоренные в speed раз. Ошибки handle считаются по типам
+    и не останавливают прогон. Возвращаем отчёт для сравнения прогонов.
+    """
+    errors = Counter()
+    timings = []
+    first_recorded = None
+    started = clock()
+    for exchange in exchanges:
+        if speed and first_recorded is None:
+            first_recorded = exchange['ts']
+        if speed:
+            delay = (exchange['ts'] - first_recorded) / speed - (
+                clock() - started
+            )
+            if delay > 0:
+                sleep(delay)
+        handled = clock()
+        try:
+            handle(exchange)
+        except Exception as error:
+            errors[type(error).__name__] += 1
+        timings.append(clock() - handled)
+    elapsed = clock() - started
+    return {
+        'exchanges': len(timings),
+        'errors': dict(errors),
+        'elapsed': round(elapsed, 3),
+        'exchanges_per_second': (
+            round(len(timings) / elapsed, 1) if elapsed else None
+        ),
+        'handle_p50_ms': _ms(_percentile(timings, 50)),
+        'handle_p95_ms': _ms(_percentile(timings, 95)),
+        'handle_max_ms': _ms(max(timings, default=None)),
+    }
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def parse_args(argv=None):
+    """Разбираем аргументы командной строки."""
+    parser = argparse.ArgumentParser(
+        description='Прогон записанных api-ответов через разбор, '
+                    'сравнение и отправку (заглушку)'
+    )
+    parser.add_argument('capture', help='файл захвата (CAPTURE_PATH)')
+    parser.add_argument(
+        '--speed', type=float, default=0,
+        help='ускорение относительно записи; 0 — как можно быстрее'
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Прогоняем захват на пустом состоянии и печатаем отчёт в json."""
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='replay-') as workdir:
+        # homework читает настройки из окружения при импорте
+        os.environ.update({
+            'STATE_DB_PATH': os.path.join(workdir, 'state.sqlite3'),
+            'SPOOL_PATH': os.path.join(workdir, 'outbox.spool'),
+            'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+            # прогон не должен дописывать захват, в том числе из .env
+            'CAPTURE_PATH': '',
+        })
+        import homework
+
+        sent = []
+        report = replay(
+            read_capture(args.capture),
+            lambda exchange: homework.replay_exchange(
+                exchange, lambda chat_id, text: sent.append(chat_id)
+            ),
+            speed=args.speed
+        )
+        report['messages'] = len(sent)
+        homework.state_store.close()
+        homework.cursor_store.close()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import json
+import logging
+import time
+
+import metrics
+from outbox import normalize_chat_id
+
+
+logger = logging.getLogger(__name__)
+
+POLL_LAG = metrics.registry.histogram(
+    'bot_poll_lag_seconds',
+    'Задержка фактического опроса относительно запланированного'
+)
+WHEEL_QUEUE = metrics.registry.gauge(
+    'bot_wheel_queue_depth',
+    'Подписки в колесе таймеров и в очереди на запуск опроса', ('queue',)
+)
+WHEEL_LAG = metrics.registry.gauge(
+    'bot_wheel_lag_seconds',
+    'Сколько ждёт запуска самый старый опрос, срок которого подошёл'
+)
+
+
+def token_digest(practicum_token):
+    """Отпечаток токена, по которому его можно хранить и логировать."""
+    return hashlib.sha256(str(practicum_token).encode()).hexdigest()[:16]
+
+
+class Tenant:
+    """Подписчик: чат в Telegram, который получает уведомления токена."""
+
+    def __init__(self, practicum_token, chat_id):
+        """Инициализация переменных."""
+        self.practicum_token = practicum_token
+        self.chat_id = normalize_chat_id(chat_id)
+
+    @property
+    def key(self):
+        """Ключ подписчика, в котором нет токена в открытом виде."""
+        return f'{self.chat_id}:{token_digest(self.practicum_token)}'
+
+    def __repr__(self):
+        return f'Tenant({self.key})'
+
+
+class Subscription:
+    """Токен Практикума и чаты, которые получают его уведомления.
+
+    Опрашивается токен: один запрос к api и один курсор from_date
+    на все чаты подписки.
+    """
+
+    def __init__(self, practicum_token):
+        """Инициализация переменных."""
+        self.practicum_token = practicum_token
+        self.current_timestamp = int(time.time())
+        self.key = token_digest(practicum_token)
+        # str(chat_id) -> Tenant
+        self._tenants = {}
+
+    @property
+    def headers(self):
+        """Заголовки api-запроса к Практикуму."""
+        return {'Authorization': f'OAuth {self.practicum_token}'}
+
+    def subscribe(self, chat_id):
+        """Подписываем чат; повторная подписка ничего не меняет."""
+        return self._tenants.setdefault(
+            str(chat_id), Tenant(self.practicum_token, chat_id)
+        )
+
+    def unsubscribe(self, chat_id):
+        """Отписываем чат."""
+        return self._tenants.pop(str(chat_id), None)
+
+    @property
+    def chat_ids(self):
+        """Чаты подписки."""
+        return [tenant.chat_id for tenant in self._tenants.values()]
+
+    def __iter__(self):
+        return iter(list(self._tenants.values()))
+
+    def __len__(self):
+        return len(self._tenants)
+
+    def __contains__(self, chat_id):
+        return str(chat_id) in self._tenants
+
+    def __repr__(self):
+        return f'Subscription({self.key}, chats={len(self)})'
+
+
+class TenantRegistry:
+    """Подписки, которые опрашивает один процесс.
+
+    Итерация идёт по подпискам: каждый токен опрашивается один раз,
+    сколько бы чатов на него ни было подписано.
+    """
+
+    def __init__(self):
+        """Инициализация переменных."""
+        self._subscriptions = {}
+
+    def add(self, practicum_token, chat_id):
+        """Подписываем чат на токен и возвращаем подписчика.
+
+        Повторное добавление ничего не меняет.
+        """
+        subscription = self._subscriptions.get(token_digest(practicum_token))
+        if subscription is None:
+            subscription = Subscription(practicum_token)
+            self._subscriptions[subscription.key] = subscription
+        return subscription.subscribe(chat_id)
+
+    def remove(self, key):
+        """Удаляем подписку по ключу или подписчика по ключу подписчика."""
+        if key in self._subscriptions:
+            return self._subscriptions.pop(key)
+        chat_id, _, subscription_key = key.rpartition(':')
+        subscription = self._subscriptions.get(subscription_key)
+        if subscription is None:
+            return None
+        tenant = subscription.unsubscribe(chat_id)
+        if not subscription:
+            del self._subscriptions[subscription_key]
+        return tenant
+
+    def get(self, key):
+        """Получаем подписку по ключу."""
+        return self._subscriptions.get(key)
+
+    def for_chat(self, chat_id):
+        """Подписки, уведомления которых приходят в чат chat_id."""
+        return [
+            subscription for subscription in self._subscriptions.values()
+            if chat_id in subscription
+        ]
+
+    def tenants(self):
+        """Все подписчики всех подписок."""
+        return [
+            tenant for subscription in self._subscriptions.values()
+            for tenant in subscription
+        ]
+
+    def load(self, path):
+        """Загружаем подписки из json-файла.
+
+        Файл содержит список объектов с ключом practicum_token
+        и ключом chat_id или списком chat_ids.
+        """
+        with open(path, encoding='utf-8') as file:
+            records = json.load(file)
+
+        for record in records:
+            chat_ids = record.get('chat_ids') or [record['chat_id']]
+            for chat_id in chat_ids:
+                self.add(record['practicum_token'], chat_id)
+
+        logger.info('Загрузили %s подписок из %s', len(records), path)
+
+    def __iter__(self):
+        return iter(list(self._subscriptions.values()))
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def __contains__(self, key):
+        return key in self._subscriptions
+
+
+class PollingEngine:
+    """Опрашиваем все подписки реестра из одного event loop.
+
+    Для каждой подписки работает своя задача, которая вызывает
+    handler(subscription) раз в interval секунд, а если задан scheduler —
+    через scheduler.next_delay(subscription.key, результат_handler).
+    Одновременно выполняется не больше concurrency обработчиков: этим
+    же числом ограничен пул потоков, в котором выполняются блокирующие
+    запросы.
+
+    С колесом таймеров wheel (TimingWheel) вместо задачи на подписку
+    работает одна задача-диспетчер: она раз в тик забирает из колеса
+    подписки, которым пора опрашиваться, и запускает не больше
+    max_rate опросов в секунду, остальные ждут следующих тиков.
+    Так опросы идут ровным потоком, даже если сроки совпали.
+    """
+
+    def __init__(self, registry, handler, interval, concurrency=100,
+                 sync_interval=30, scheduler=None, wheel=None,
+                 max_rate=None):
+        """Инициализация переменных."""
+        self.registry = registry
+        self.handler = handler
+        self.interval = interval
+        self.concurrency = concurrency
+        self.sync_interval = sync_interval
+        self.scheduler = scheduler
+        self.wheel = wheel
+        self.max_rate = max_rate
+        # с колесом — только идущие опросы, без него — задачи подписок
+        self._tasks = {}
+        # подписки, которые опрашивает колесо: ключ -> подписка
+        self._members = {}
+        # сработавшие таймеры, которые ждут своей очереди на запуск
+        self._backlog = deque()
+        # ключи, обработчик которых выполняется прямо сейчас
+        self._polling = set()
+        self._semaphore = None
+        self._stopping = asyncio.Event()
+
+    async def run(self):
+        """Запускаем опрос и следим за составом реестра.
+
+        После stop() новые опросы не начинаются, а run() завершается,
+        как только закончатся уже идущие.
+        """
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix='poll'
+        ))
+        dispatcher = None
+        if self.wheel is not None:
+            dispatcher = asyncio.create_task(self._dispatch())
+
+        try:
+            while not self._stopping.is_set():
+                self._sync_tasks()
+                if self.scheduler is not None:
+                    logger.debug('Планировщик: %s', self.scheduler.stats())
+                if self.wheel is not None:
+                    logger.debug('Колесо таймеров: %s', self.stats())
+                try:
+                    await asyncio.wait_for(
+                        self._stopping.wait(), self.sync_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        finally:
+            if dispatcher is not None:
+                dispatcher.cancel()
+                await asyncio.gather(dispatcher, return_exceptions=True)
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+            self._tasks.clear()
+
+    async def run_once(self):
+        """Один проход: каждая подписка реестра опрашивается один раз.
+
+        Возвращаем результаты обработчика в порядке реестра.
+        """
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(
+            max_workers=self.concurrency,
+            thread_name_prefix='poll'
+        ))
+        subscriptions = list(self.registry)
+        outcomes = await asyncio.gather(
+            *(self.poll_once(subscription) for subscription in subscriptions)
+        )
+        logger.info('Опросили %s подписок за один проход', len(outcomes))
+        return outcomes
+
+    def stop(self):
+        """Останавливаем опрос, не обрывая уже идущие опросы.
+
+        Задачи, которые ждут своей очереди, отменяются сразу.
+        """
+        self._stopping.set()
+        for key, task in self._tasks.items():
+            if key not in self._polling:
+                task.cancel()
+        logger.info(
+            'Останавливаем опрос, дожидаемся %s текущих', len(self._polling)
+        )
+
+    def _sync_tasks(self):
+        """Запускаем задачи для новых пользователей и снимаем удалённые."""
+        if self.wheel is not None:
+            return self._sync_wheel()
+
+        for key in list(self._tasks):
+            if key not in self.registry:
+                self._tasks.pop(key).cancel()
+                if self.scheduler is not None:
+                    self.scheduler.forget(key)
+
+        new_tenants = [
+            tenant for tenant in self.registry if tenant.key not in self._tasks
+        ]
+        # разносим первые запросы по интервалу,
+        # чтобы пользователи не опрашивались одной пачкой
+        for index, tenant in enumerate(new_tenants):
+            delay = self.interval * index / len(new_tenants)
+            self._tasks[tenant.key] = asyncio.create_task(
+                self._poll_forever(tenant, delay)
+            )
+
+        if new_tenants:
+            logger.info(
+                'Запустили опрос %s пользователей, всего %s',
+                len(new_tenants), len(self._tasks)
+            )
+
+    def _sync_wheel(self):
+        """Заводим таймеры новым подпискам и снимаем удалённые."""
+        for key in list(self._members):
+            if key not in self.registry:
+                del self._members[key]
+                self.wheel.cancel(key)
+                task = self._tasks.pop(key, None)
+                if task is not None:
+                    task.cancel()
+                if self.scheduler is not None:
+                    self.scheduler.forget(key)
+
+        new_subscriptions = [
+            subscription for subscription in self.registry
+            if subscription.key not in self._members
+        ]
+        # первые опросы разносим по интервалу, как и без колеса
+        for index, subscription in enumerate(new_subscriptions):
+            self._members[subscription.key] = subscription
+            self.wheel.schedule(
+                subscription.key,
+                self.interval * index / len(new_subscriptions),
+                subscription
+            )
+
+        if new_subscriptions:
+            logger.info(
+                'Добавили в колесо %s подписок, всего %s',
+                len(new_subscriptions), len(self._members)
+            )
+
+    async def _dispatch(self):
+        """Раз в тик запускаем опросы, срок которых подошёл."""
+        tick = self.wheel.tick
+        # запас запусков не копится дольше тика, иначе после
+        # простоя все накопленные опросы ушли бы одной пачкой
+        burst = max(self.max_rate * tick, 1) if self.max_rate else None
+        budget = 0.0
+        while not self._stopping.is_set():
+            await asyncio.sleep(tick)
+            if self._stopping.is_set():
+                # stop() пришёл во время сна: новых опросов не начинаем
+                break
+            # время колеса и event loop совпадают: оба monotonic
+            self._backlog.extend(self.wheel.advance())
+            if burst is None:
+                budget = len(self._backlog)
+            else:
+                budget = min(budget + self.max_rate * tick, burst)
+            while self._backlog and budget >= 1:
+                key, due, subscription = self._backlog.popleft()
+                if self._members.get(key) is not subscription:
+                    continue
+                budget -= 1
+                self._tasks[key] = asyncio.create_task(
+                    self._poll_due(subscription, due)
+                )
+            stats = self.stats()
+            WHEEL_QUEUE.set(stats['scheduled'], queue='wheel')
+            WHEEL_QUEUE.set(stats['backlog'], queue='backlog')
+            WHEEL_LAG.set(stats['lag'])
+
+    async def _poll_due(self, subscription, due):
+        """Опрашиваем подписку и заводим ей следующий таймер."""
+        try:
+            outcome = await self.poll_once(subscription, due)
+        finally:
+            self._tasks.pop(subscription.key, None)
+        if self._stopping.is_set() or (
+            self._members.get(subscription.key) is not subscription
+        ):
+            return
+        self.wheel.schedule(
+            subscription.key,
+            self.next_delay(subscription, outcome),
+            subscription
+        )
+
+    def stats(self):
+        """Глубина очередей колеса и задержка самого старого опроса."""
+        lag = 0.0
+        if self._backlog:
+            lag = max(self.wheel.clock() - self._backlog[0][1], 0)
+        return {
+            'scheduled': len(self.wheel) if self.wheel is not None else 0,
+            'backlog': len(self._backlog),
+            'running': len(self._tasks),
+            'lag': lag,
+        }
+
+    async def _poll_forever(self, tenant, delay):
+        """Цикл опроса одного пользователя."""
+        loop = asyncio.get_running_loop()
+        due = loop.time() + delay
+        await asyncio.sleep(delay)
+
+        while True:
+            outcome = await self.poll_once(tenant, due)
+            if self._stopping.is_set():
+                return
+            delay = self.next_delay(tenant, outcome)
+            due = loop.time() + delay
+            await asyncio.sleep(delay)
+
+    async def poll_once(self, tenant, due=None):
+        """Один вызов обработчика с учётом ограничения конкурентности.
+
+        due — запланированное время опроса по часам event loop,
+        по нему считается задержка опроса.
+        Возвращаем результат обработчика или None, если он упал.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self._semaphore:
+            if due is not None:
+                POLL_LAG.observe(
+                    max(asyncio.get_running_loop().time() - due, 0)
+                )
+            self._polling.add(tenant.key)
+            try:
+                return await self.handler(tenant)
+            except Exception:
+                logger.error(
+                    'Ошибка при опросе пользователя %s', tenant.key,
+                    exc_info=True
+                )
+                return None
+            finally:
+                self._polling.discard(tenant.key)
+
+    def next_delay(self, tenant, outcome):
+        """Пауза до следующего опроса пользователя."""
+        if self.scheduler is None:
+            return self.interval
+        return self.scheduler.next_delay(tenant.key, outcome)
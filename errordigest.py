@@ -0,0 +1,101 @@
+import time
+
+import metrics
+
+
+ERROR_DIGEST = metrics.registry.counter(
+    'bot_error_digest_total',
+    'Ошибки, собранные в сводки, и закрытые окна сводок', ('result',)
+)
+
+
+def _clock_time(timestamp):
+    return time.strftime('%H:%M:%S', time.localtime(timestamp))
+
+
+class ErrorWindow:
+    """Ошибки одного ключа, накопленные с момента opened."""
+
+    def __init__(self, opened, recipients):
+        """Инициализация переменных."""
+        self.opened = opened
+        self.recipients = recipients
+        # текст ошибки -> [сколько раз, первый раз, последний раз]
+        self.errors = {}
+
+    def add(self, message, now):
+        """Учитываем ещё одну ошибку."""
+        seen = self.errors.get(message)
+        if seen is None:
+            self.errors[message] = [1, now, now]
+        else:
+            seen[0] += 1
+            seen[2] = now
+
+    @property
+    def signature(self):
+        """Набор текстов ошибок без счётчиков и времени."""
+        return '\n'.join(sorted(self.errors))
+
+    def format(self):
+        """Текст сводки для пользователя."""
+        lines = [f'Ошибки при проверке статусов: {self.count}']
+        for message, (count, first, last) in self.errors.items():
+            if count == 1:
+                lines.append(f'• {message} — в {_clock_time(first)}')
+            else:
+                lines.append(
+                    f'• {message} — {count} раз, '
+                    f'с {_clock_time(first)} до {_clock_time(last)}'
+                )
+        return '\n'.join(lines)
+
+    @property
+    def count(self):
+        """Всего ошибок в окне."""
+        return sum(seen[0] for seen in self.errors.values())
+
+
+class ErrorDigest:
+    """Сводки ошибок по ключам вместо сообщения на каждую ошибку.
+
+    Первая ошибка ключа открывает окно на window секунд, все ошибки
+    за окно копятся в нём, а take() отдаёт окно, только когда оно
+    закрылось. Так на ключ уходит не больше одной сводки за window
+    секунд, сколько бы разных ошибок ни было.
+    """
+
+    def __init__(self, window, clock=time.time):
+        """Инициализация переменных."""
+        self.window = window
+        self.clock = clock
+        self._windows = {}
+
+    def add(self, key, message, recipients):
+        """Записываем ошибку ключа; recipients — кому отправить сводку."""
+        now = self.clock()
+        error_window = self._windows.get(key)
+        if error_window is None:
+            error_window = self._windows[key] = ErrorWindow(now, recipients)
+        error_window.recipients = recipients
+        error_window.add(message, now)
+        ERROR_DIGEST.inc(result='collected')
+
+    def take(self, key):
+        """Закрывшееся окно ключа или None; окно удаляется."""
+        error_window = self._windows.get(key)
+        if error_window is None or (
+            self.clock() - error_window.opened < self.window
+        ):
+            return None
+        ERROR_DIGEST.inc(result='closed')
+        return self._windows.pop(key)
+
+    def take_all(self):
+        """Все окна, в том числе не закрывшиеся; для остановки бота."""
+        windows, self._windows = list(self._windows.values()), {}
+        ERROR_DIGEST.inc(len(windows), result='closed')
+        return windows
+
+    def __len__(self):
+        return len(self._windows)
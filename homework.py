@@ -1,47 +1,174 @@
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import json
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import re
+import signal
 import sys
 import time
 
+from breaker import CircuitBreaker
+from capture import CaptureRecorder
+from engine import PollingEngine, Tenant, TenantRegistry, token_digest
+from errordigest import ErrorDigest
 from exceptions import GetApiAnswerError, ParseStatusError
+from logconfig import setup_logging
+import metrics
+from outbox import DryRunOutbox, OutboundQueue
+from profiling import CycleProfiler
+from spool import MessageSpool
+from statuscache import StatusCache
+from scheduler import AdaptiveScheduler, PollOutcome
+from sharding import LeaseStore, ShardCoordinator, ShardView
+from storage import CursorStore, StateStore, remove_snapshot, snapshot
+from timingwheel import TimingWheel
+from transport import HttpTransport, ResponseCache
 from dotenv import load_dotenv
 import requests
-import telegram
 
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
-cons_handler = logging.StreamHandler()
-cons_handler.setLevel(logging.DEBUG)
 
-file_handler = RotatingFileHandler(
-    __file__ + ".log",
-    mode="w",
-    maxBytes=(1024 * 100),
-    backupCount=1
+load_dotenv()
+
+PRACTICUM_TOKEN = os.getenv('PRACTICUM_TOKEN')
+TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
+TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+TENANTS_FILE = os.getenv('TENANTS_FILE')
+# пусто — стандартный адрес Bot API
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL') or None
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').upper()
+# шардирование подписок между процессами: аренды в общем sqlite-файле
+SHARD_DB_PATH = os.getenv('SHARD_DB_PATH') or None
+WORKER_ID = os.getenv('WORKER_ID') or None
+# начало имён файлов процесса по умолчанию (лог, журнал отправки,
+# отчёты профилировщика): у каждого воркера шардирования они свои
+WORKER_FILES = __file__
+if SHARD_DB_PATH and WORKER_ID:
+    WORKER_FILES += '.' + re.sub(r'[^\w.-]', '_', WORKER_ID)
+
+# запись логов в консоль и файл идёт в фоновом потоке,
+# токены вырезаются из сообщений перед записью
+setup_logging(
+    LOG_LEVEL,
+    log_file=WORKER_FILES + ".log",
+    secrets=(PRACTICUM_TOKEN, TELEGRAM_TOKEN)
 )
 
-file_handler.setLevel(logging.DEBUG)
+POLL_CONCURRENCY = int(os.getenv('POLL_CONCURRENCY', 100))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 10))
+TELEGRAM_CHAT_RATE = float(os.getenv('TELEGRAM_CHAT_RATE', 1))
+TELEGRAM_GLOBAL_RATE = float(os.getenv('TELEGRAM_GLOBAL_RATE', 30))
+TELEGRAM_SEND_CONCURRENCY = int(os.getenv('TELEGRAM_SEND_CONCURRENCY', 10))
+# пустое значение из .env — тоже значение по умолчанию: sqlite3 с путём ''
+# открывает временную базу, и состояние теряется при перезапуске
+STATE_DB_PATH = os.getenv('STATE_DB_PATH') or __file__ + '.sqlite3'
+SPOOL_PATH = os.getenv('SPOOL_PATH') or WORKER_FILES + '.spool'
+SPOOL_RETRY_INTERVAL = float(os.getenv('SPOOL_RETRY_INTERVAL', 60))
+SPOOL_BATCH_SIZE = int(os.getenv('SPOOL_BATCH_SIZE', 100))
+STATE_BATCH_SIZE = int(os.getenv('STATE_BATCH_SIZE', 100))
+STATE_FLUSH_INTERVAL = float(os.getenv('STATE_FLUSH_INTERVAL', 5))
+# сколько секунд даём на остановку после SIGTERM; Heroku ждёт 30
+SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', 20))
+# колесо таймеров вместо задачи на каждую подписку: для десятков тысяч
+# подписок; POLL_RATE — не больше стольких опросов в секунду (0 — без
+# ограничения), WHEEL_TICK — шаг колеса в секундах
+TIMING_WHEEL = os.getenv('TIMING_WHEEL', '0') == '1'
+WHEEL_TICK = float(os.getenv('WHEEL_TICK', 0.1))
+POLL_RATE = float(os.getenv('POLL_RATE', 0))
+LEASE_TTL = float(os.getenv('LEASE_TTL', 90))
+# предохранитель api Практикума: неудач подряд до размыкания
+# и пауза в секундах до пробного запроса
+BREAKER_FAILURES = int(os.getenv('BREAKER_FAILURES', 5))
+BREAKER_RECOVERY = float(os.getenv('BREAKER_RECOVERY', 60))
+# дублирующие запросы к api, если ответ дольше перцентиля HEDGE_PERCENTILE
+HEDGE_REQUESTS = os.getenv('HEDGE_REQUESTS', '0') == '1'
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 95))
+HEDGE_RATIO = float(os.getenv('HEDGE_RATIO', 0.1))
+# файл, в который дописываются все обмены с api Практикума
+CAPTURE_PATH = os.getenv('CAPTURE_PATH')
+# выборочное профилирование циклов опроса; SIGUSR2 переключает на лету
+PROFILE = os.getenv('PROFILE', '0') == '1'
+PROFILE_PATH = os.getenv('PROFILE_PATH') or WORKER_FILES + '.profile'
+PROFILE_EVERY = int(os.getenv('PROFILE_EVERY', 100))
+PROFILE_MIN_INTERVAL = float(os.getenv('PROFILE_MIN_INTERVAL', 60))
+PROFILE_TENANT = os.getenv('PROFILE_TENANT') or None
+PROFILE_REPORT_EVERY = int(os.getenv('PROFILE_REPORT_EVERY', 10))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 5))
+METRICS_PORT = os.getenv('METRICS_PORT')
+METRICS_SNAPSHOT_PATH = os.getenv('METRICS_SNAPSHOT_PATH')
+METRICS_SNAPSHOT_INTERVAL = float(os.getenv('METRICS_SNAPSHOT_INTERVAL', 60))
 
-formatter = logging.Formatter(
-    '%(asctime)s, %(levelname)s, %(funcName)s, '
-    '%(lineno)s, %(message)s, %(name)s'
+# общий пул keep-alive соединений для Практикума и Telegram
+transport = HttpTransport(
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    pool_maxsize=POLL_CONCURRENCY,
+    hedge_ratio=HEDGE_RATIO
 )
 
-file_handler.setFormatter(formatter)
-cons_handler.setFormatter(formatter)
+# один предохранитель на api Практикума для всех пользователей
+api_breaker = CircuitBreaker(
+    'practicum_api',
+    failure_threshold=BREAKER_FAILURES,
+    recovery_timeout=BREAKER_RECOVERY
+)
 
-logger.addHandler(file_handler)
-logger.addHandler(cons_handler)
+# обмены с api для прогона через capture.py; токены вырезаются
+api_capture = CaptureRecorder(
+    CAPTURE_PATH, secrets=(PRACTICUM_TOKEN, TELEGRAM_TOKEN)
+) if CAPTURE_PATH else None
 
+profiler = CycleProfiler(
+    PROFILE_PATH,
+    every=PROFILE_EVERY,
+    min_interval=PROFILE_MIN_INTERVAL,
+    tenant=PROFILE_TENANT,
+    report_every=PROFILE_REPORT_EVERY,
+    keep=PROFILE_KEEP,
+    enabled=PROFILE
+)
 
-load_dotenv()
+# курсоры from_date и статусы работ переживают перезапуск процесса
+cursor_store = CursorStore(STATE_DB_PATH)
+state_store = StateStore(
+    STATE_DB_PATH,
+    batch_size=STATE_BATCH_SIZE,
+    flush_interval=STATE_FLUSH_INTERVAL
+)
 
-PRACTICUM_TOKEN = os.getenv('PRACTICUM_TOKEN')
-TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN')
-TELEGRAM_CHAT_ID = os.getenv('TELEGRAM_CHAT_ID')
+# рассылка одного сообщения по нескольким чатам из синхронного кода
+broadcast_pool = ThreadPoolExecutor(
+    max_workers=TELEGRAM_SEND_CONCURRENCY, thread_name_prefix='broadcast'
+)
+
+# под этим ключом хранится текст последней ошибки пользователя
+ERROR_STATE_KEY = ''
+# под этим ключом — набор ошибок последней сводки; отдельно от текстов
+# ошибок, чтобы сводка и ошибка не подавляли друг друга
+DIGEST_STATE_KEY = '#digest'
+# вид сообщения сводки: очередь отправки не склеивает её со статусами
+DIGEST_KIND = 'error_digest'
+
+# current_date меняется в каждом ответе, поэтому в дайджест не входит
+CURRENT_DATE = re.compile(rb'"current_date"\s*:\s*(\d+)')
+response_cache = ResponseCache(ignore=CURRENT_DATE)
+
+NOTIFICATIONS = metrics.registry.counter(
+    'bot_notifications_total',
+    'Сообщения после сравнения с прошлым состоянием',
+    ('kind', 'result')
+)
+FAST_PATH = metrics.registry.counter(
+    'bot_api_fast_path_total',
+    'Api-ответы, совпавшие с прошлыми и не дошедшие до разбора',
+    ('result',)
+)
 
 
 def check_tokens():
@@ -62,12 +189,51 @@ def check_tokens():
         logger.debug("Все env-переменные на месте")
         return True
     elif none_env_vars_list:
-        logger.critical(f"Отсутствует env-переменные {none_env_vars_list}")
+        logger.critical("Отсутствует env-переменные %s", none_env_vars_list)
+        return False
+
+
+def check_env(tenants_file=None, resident=False):
+    """Проверяем переменные окружения перед запуском.
+
+    С файлом подписок обязателен только TELEGRAM_TOKEN: подписка
+    из PRACTICUM_TOKEN и TELEGRAM_CHAT_ID тогда необязательна.
+    Постоянному процессу с шардированием нужен свой WORKER_ID: по нему
+    у воркера свои журнал отправки, лог и отчёты профилировщика.
+    """
+    if resident and SHARD_DB_PATH and WORKER_ID is None:
+        logger.critical(
+            "С SHARD_DB_PATH нужен WORKER_ID, свой у каждого процесса"
+        )
+        return False
+    if not tenants_file:
+        return check_tokens()
+    if TELEGRAM_TOKEN is None:
+        logger.critical("Отсутствует env-переменная TELEGRAM_TOKEN")
         return False
+    return True
 
 
-RETRY_TIME = (10 * 60)
-ENDPOINT = 'https://practicum.yandex.ru/api/user_api/homework_statuses/'
+RETRY_TIME = int(os.getenv('RETRY_TIME', 10 * 60))
+REVIEWING_RETRY_TIME = int(os.getenv('REVIEWING_RETRY_TIME', 2 * 60))
+MAX_RETRY_TIME = int(os.getenv('MAX_RETRY_TIME', 60 * 60))
+IDLE_AFTER = int(os.getenv('IDLE_AFTER', 24 * 60 * 60))
+BACKOFF_FACTOR = float(os.getenv('BACKOFF_FACTOR', 2))
+RETRY_JITTER = float(os.getenv('RETRY_JITTER', 0.1))
+# ответы на /status и /history; опросы продлевают кэш, поэтому по
+# умолчанию он не устаревает, пока пользователь опрашивается
+STATUS_CACHE_TTL = float(os.getenv('STATUS_CACHE_TTL', 2 * MAX_RETRY_TIME))
+# getUpdates может слушать только один процесс, поэтому
+# с шардированием команды по умолчанию выключены
+TELEGRAM_COMMANDS = (
+    os.getenv('TELEGRAM_COMMANDS') or ('0' if SHARD_DB_PATH else '1')
+) == '1'
+# ошибки опроса копятся столько секунд и уходят одной сводкой
+ERROR_DIGEST_WINDOW = float(os.getenv('ERROR_DIGEST_WINDOW', 10 * 60))
+ENDPOINT = os.getenv(
+    'PRACTICUM_ENDPOINT',
+    'https://practicum.yandex.ru/api/user_api/homework_statuses/'
+)
 HEADERS = {'Authorization': f'OAuth {PRACTICUM_TOKEN}'}
 
 HOMEWORK_STATUSES = {
@@ -76,40 +242,196 @@ HOMEWORK_STATUSES = {
     'rejected': 'Работа проверена: у ревьюера есть замечания.'
 }
 
+# from_date для запроса всех работ пользователя
+FULL_HISTORY_FROM_DATE = 1
+HISTORY_LIMIT = 20
+
+status_cache = StatusCache(STATUS_CACHE_TTL)
+error_digest = ErrorDigest(ERROR_DIGEST_WINDOW)
+# ошибки, которые собираются в сводку; остальные отправляются сразу
+DIGEST_ERRORS = (GetApiAnswerError, ParseStatusError, KeyError, IndexError)
+# идущие циклы опроса: устаревший /status ждёт опрос своего токена
+# вместо отдельного запроса всей истории
+polls_in_flight = {}
+
+
+def chat_targets(chat_ids):
+    """Чаты из TELEGRAM_CHAT_ID: один id или несколько через запятую."""
+    if chat_ids is None:
+        return []
+    return [
+        chat_id.strip() for chat_id in str(chat_ids).split(',')
+        if chat_id.strip()
+    ]
+
 
 def send_message(bot, message):
-    """Функция отправки сообщений."""
+    """Функция отправки сообщений во все чаты TELEGRAM_CHAT_ID."""
+    return broadcast_message(bot, chat_targets(TELEGRAM_CHAT_ID), message)
+
+
+def broadcast_message(bot, chat_ids, message):
+    """Отправляем сообщение во все чаты одновременно.
+
+    Отправки идут в пуле из TELEGRAM_SEND_CONCURRENCY потоков, поэтому
+    рассылка по списку чатов длится примерно как самая долгая отправка.
+    Возвращаем {chat_id: True/False} — дошло ли сообщение в чат.
+    """
+    import telegram
+
+    futures = {
+        chat_id: broadcast_pool.submit(
+            send_chat_message, bot, chat_id, message
+        )
+        for chat_id in chat_ids
+    }
+    results = {}
+    for chat_id, future in futures.items():
+        try:
+            results[chat_id] = future.result()
+        except telegram.TelegramError:
+            logger.error(
+                "Не смогли отправить сообщение в %s", chat_id,
+                exc_info=True
+            )
+            results[chat_id] = False
+    return results
+
+
+@metrics.timed('send_message')
+def send_chat_message(bot, chat_id, message):
+    """Отправляем сообщение в указанный чат.
+
+    True — сообщение отправлено, False — Telegram отказал окончательно
+    (неверный запрос, бот заблокирован). RetryAfter и сетевые ошибки
+    пробрасываются: такое сообщение стоит отправить позже.
+    """
+    import telegram
+
     try:
-        bot.send_message(TELEGRAM_CHAT_ID, message)
+        bot.send_message(chat_id, message)
         logger.info('Отправили сообщение')
-    except telegram.TelegramError:
+        return True
+    except telegram.TelegramError as error:
+        # BadRequest в python-telegram-bot — наследник NetworkError
+        transient = isinstance(
+            error, (telegram.error.RetryAfter, telegram.error.NetworkError)
+        ) and not isinstance(error, telegram.error.BadRequest)
+        if transient:
+            raise
         logger.error(
             "Не смогли отправить сообщение",
             exc_info=True
         )
+        return False
+
+
+async def send_message_async(bot, chat_id, message):
+    """Асинхронная версия send_message: отправка уходит в пул потоков."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, send_chat_message, bot, chat_id, message
+    )
 
 
 def get_api_answer(current_timestamp):
     """Получаем api-ответ от сервера Yandex."""
+    return request_api_answer(current_timestamp, HEADERS)
+
+
+def send_api_request(params, headers):
+    """Запрос к api через общий предохранитель.
+
+    Пока предохранитель разомкнут, запрос не отправляется.
+    С HEDGE_REQUESTS медленный запрос дублируется.
+    С CAPTURE_PATH обмен записывается в файл захвата.
+    """
+    if not api_breaker.allow():
+        raise GetApiAnswerError(
+            'Api Практикума недоступен, ждём восстановления'
+        )
+
+    started, start_counter = time.time(), time.perf_counter()
+    try:
+        if HEDGE_REQUESTS:
+            response = transport.hedged_get(
+                ENDPOINT,
+                percentile=HEDGE_PERCENTILE,
+                params=params,
+                headers=headers,
+            )
+        else:
+            response = transport.get(
+                ENDPOINT,
+                params=params,
+                headers=headers,
+            )
+    except BaseException as error:
+        # пробный запрос не должен оставить предохранитель полуоткрытым
+        api_breaker.record_failure()
+        capture_exchange(
+            headers, params, started, time.perf_counter() - start_counter,
+            error=error
+        )
+        raise
+
+    capture_exchange(
+        headers, params, started, time.perf_counter() - start_counter,
+        response=response
+    )
+    # 5xx — сбой сервиса; 4xx касаются одного токена
+    if response.status_code >= 500:
+        api_breaker.record_failure()
+    else:
+        api_breaker.record_success()
+    return response
+
+
+def capture_exchange(headers, params, started, duration, response=None,
+                     error=None):
+    """Записываем обмен с api, если включён захват.
+
+    Вместо токена пишется его отпечаток, заголовки не пишутся.
+    """
+    if api_capture is None:
+        return
+    token = headers.get('Authorization', '').removeprefix('OAuth ')
+    if response is None:
+        api_capture.record(
+            token_digest(token), params, started, duration,
+            error=f'{type(error).__name__}: {error}'
+        )
+    else:
+        api_capture.record(
+            token_digest(token), params, started, duration,
+            status=response.status_code,
+            body=response.content.decode('utf-8', 'replace')
+        )
+
+
+@metrics.timed('get_api_answer')
+def request_api_answer(current_timestamp, headers, cache_key=None):
+    """Получаем api-ответ с заголовками конкретного пользователя.
+
+    С cache_key ответ, совпавший с прошлым ответом этого ключа,
+    не декодируется: возвращается NotModified.
+    Пока предохранитель api разомкнут, запрос не отправляется.
+    """
     timestamp = current_timestamp or int(time.time())
     params = {'from_date': timestamp}
+    if cache_key is not None:
+        headers = {**headers, **response_cache.conditional_headers(cache_key)}
 
     try:
         logger.debug(
-            f'Отправляем api-запрос: '
-            f'ENDPOINT = {ENDPOINT}, '
-            f'params = {params}, '
-            f'HEADERS = {HEADERS}'
+            'Отправляем api-запрос: ENDPOINT = %s, params = %s, HEADERS = %s',
+            ENDPOINT, params, headers
         )
 
-        response = requests.get(
-            ENDPOINT,
-            params=params,
-            headers=HEADERS,
-        )
+        response = send_api_request(params, headers)
     except requests.exceptions.RequestException as error:
         logger.error(
-            (f'{error}: не получили api-ответ'),
+            '%s: не получили api-ответ', error,
             exc_info=True
         )
 
@@ -118,7 +440,14 @@ def get_api_answer(current_timestamp):
     mistake_message = (f'Проблемы соединения с сервером.'
                        f' Ошибка {response.status_code}')
 
+    if cache_key is not None and response.status_code in (
+        requests.codes.ok, requests.codes.not_modified
+    ) and response_cache.check(cache_key, response):
+        FAST_PATH.inc(result='hit')
+        return NotModified(response)
     if response.status_code == requests.codes.ok:
+        if cache_key is not None:
+            FAST_PATH.inc(result='miss')
         return response.json()
     elif response.status_code != requests.codes.ok:
         logger.error(
@@ -128,6 +457,25 @@ def get_api_answer(current_timestamp):
         raise GetApiAnswerError(mistake_message)
 
 
+async def get_api_answer_async(current_timestamp, headers, cache_key=None):
+    """Асинхронная версия get_api_answer: запрос уходит в пул потоков."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, request_api_answer, current_timestamp, headers, cache_key
+    )
+
+
+class NotModified:
+    """Api-ответ, совпавший с прошлым ответом пользователя."""
+
+    def __init__(self, response):
+        """Инициализация переменных."""
+        # курсор сдвигается и без разбора тела
+        match = CURRENT_DATE.search(response.content)
+        self.current_date = int(match.group(1)) if match else None
+
+
+@metrics.timed('check_response')
 def check_response(response):
     """Проверка api-ответа на валидность."""
     # проверка, вернулся ли в ответе dict
@@ -140,89 +488,762 @@ def check_response(response):
     except KeyError:
         logger.error('dict KeyError')
         raise KeyError('dict KeyError')
-    # пытаемся получить доступ к последней домашней работе
-    try:
-        HW_list[0]
-    except IndexError:
-        logger.warning('Домашняя работа не найдена')
-        raise IndexError('Домашняя работа не найдена')
-    # если всё успешно, возвращаем api-ответ
-    else:
-        return HW_list
+    # проверка, вернулся ли под ключом homeworks список
+    if not isinstance(HW_list, list):
+        raise TypeError('homeworks is not list')
+    # пустой список — с момента курсора статусы не менялись
+    if not HW_list:
+        logger.debug('Новых статусов домашних работ нет')
+    return HW_list
 
 
+@metrics.timed('parse_status')
 def parse_status(homework):
     """Получаем данные о статусе домашней работы."""
     homework_name = homework['homework_name']
     homework_status = homework['status']
-    verdict = HOMEWORK_STATUSES[homework_status]
 
     if homework_status in HOMEWORK_STATUSES:
+        verdict = HOMEWORK_STATUSES[homework_status]
         return f'Изменился статус проверки работы "{homework_name}". {verdict}'
     else:
-        logger.error(Exception)
+        logger.error('Неизвестный статус %s работы %s',
+                     homework_status, homework_name)
         raise ParseStatusError(
             f"Не могу получить статус домашней работы: '{homework_name}'."
         )
 
 
 class CompareMessages:
-    """Сравниваем сообщения."""
+    """Сравниваем сообщения.
 
-    old_message = None
+    Статус работы сравнивается с последним сохранённым статусом этой
+    же работы пользователя, текст ошибки — с последней ошибкой под
+    ключом error_key.
+    """
 
-    def __init__(self, message):
+    def __init__(self, message, tenant_key, homework=None,
+                 error_key=ERROR_STATE_KEY):
         """Инициализация переменных."""
         self.message = message
+        self.tenant_key = tenant_key
+        self.homework = homework
+        self.error_key = error_key
+        self.old_state = None
 
+    @metrics.timed('comparing')
     def comparing(self):
         """Сравниваем старое и новое сообщения между собой."""
-        logger.debug(f'Предыдущее сообщение {CompareMessages.old_message}')
-        logger.debug(f'Текущее сообщение {self.message}')
+        if self.homework is None:
+            homework_id = self.error_key
+            new_state = (self.message, None)
+        else:
+            homework_id = str(
+                self.homework.get('id', self.homework['homework_name'])
+            )
+            new_state = (
+                self.homework['status'], self.homework.get('date_updated')
+            )
+
+        old_state = self.old_state = state_store.get(
+            self.tenant_key, homework_id
+        )
+        logger.debug('Предыдущее состояние %s', old_state)
+        logger.debug('Текущее сообщение %s', self.message)
 
-        if CompareMessages.old_message != self.message:
+        kind = 'error' if self.homework is None else 'status'
+        if old_state != new_state:
             logger.info('Старое сообщение отличается от текущего сообщения')
-            CompareMessages.old_message = self.message
+            state_store.put(self.tenant_key, homework_id, *new_state)
+            NOTIFICATIONS.inc(kind=kind, result='notified')
             return True
-        elif CompareMessages.old_message == self.message:
+        elif old_state == new_state:
             logger.info('Старое сообщение не отличается от текущего сообщения')
+            NOTIFICATIONS.inc(kind=kind, result='suppressed')
             return False
 
 
-def main():
-    """Основная логика работы бота."""
-    logger.info("Запускаем бота")
-    current_timestamp = int(time.time())
-    bot = telegram.Bot(token=TELEGRAM_TOKEN)
+class StatusTransition:
+    """Изменение статуса одной домашней работы.
+
+    recipients — подписчики, для которых этот статус новый.
+    """
+
+    def __init__(self, homework, message, recipients):
+        """Инициализация переменных."""
+        self.homework = homework
+        self.status = homework['status']
+        self.message = message
+        self.recipients = recipients
+
+
+def _date_updated(homework):
+    return homework.get('date_updated') or ''
 
-    if check_tokens() is False:
-        logger.critical("Программа остановлена")
-        sys.exit(1)
 
-    while True:
+def iter_by_date(homeworks):
+    """Обходим работы по возрастанию date_updated.
 
+    Api отдаёт работы от новых к старым, поэтому обычно хватает
+    обратного обхода без копирования списка. Порядок проверяется
+    за один проход, сортируется только перемешанный список.
+    """
+    ascending = descending = True
+    for index in range(1, len(homeworks)):
+        previous = _date_updated(homeworks[index - 1])
+        current = _date_updated(homeworks[index])
+        ascending = ascending and previous <= current
+        descending = descending and previous >= current
+        if not (ascending or descending):
+            logger.debug('Работы в api-ответе не упорядочены по дате')
+            return iter(sorted(homeworks, key=_date_updated))
+
+    if descending:
+        return reversed(homeworks)
+    return iter(homeworks)
+
+
+def diff_homeworks(tenants, homeworks, on_error=None):
+    """Выдаём StatusTransition для каждой работы, статус которой изменился.
+
+    Статус сравнивается с состоянием каждого подписчика из tenants,
+    сообщение собирается один раз на работу. События идут по
+    возрастанию date_updated, состояние работы запоминается в момент
+    выдачи события. Работа, которую не удалось разобрать, пропускается
+    и передаётся в on_error(homework, error), остальные обрабатываются.
+    """
+    for homework in iter_by_date(homeworks):
         try:
-            new_hw = check_response(get_api_answer(current_timestamp))
-            logger.info(
-                "Функции get_api_answer и check_response сработали успешно"
+            message = parse_status(homework)
+        except (ParseStatusError, KeyError) as error:
+            logger.error('Пропускаем работу из api-ответа: %s', error)
+            if on_error is not None:
+                on_error(homework, error)
+            continue
+        recipients = [
+            tenant for tenant in tenants
+            if CompareMessages(message, tenant.key, homework).comparing()
+        ]
+        if recipients:
+            yield StatusTransition(homework, message, recipients)
+
+
+def replay_exchange(exchange, send):
+    """Прогоняем записанный обмен с api через разбор и сравнение.
+
+    Изменения статусов передаются в send(chat_id, message) вместо
+    send_message. Чат у каждого записанного токена свой, его id —
+    отпечаток токена. Ответ 304 пропускается, как в опросе.
+    """
+    status = exchange['status']
+    if status == requests.codes.not_modified:
+        return
+    if status != requests.codes.ok:
+        raise GetApiAnswerError(
+            exchange['error']
+            or f'Проблемы соединения с сервером. Ошибка {status}'
+        )
+    tenant = Tenant(exchange['tenant'], exchange['tenant'])
+    homeworks = check_response(json.loads(exchange['body']))
+    for transition in diff_homeworks([tenant], homeworks):
+        send(tenant.chat_id, transition.message)
+
+
+def restore_cursors(registry):
+    """Восстанавливаем курсоры from_date подписок из хранилища.
+
+    Раньше курсор хранился для каждого чата отдельно: если курсора
+    подписки ещё нет, берём самый ранний из курсоров её чатов.
+    """
+    for subscription in registry:
+        from_date = cursor_store.get(subscription.key)
+        if from_date is None:
+            from_date = min((
+                cursor for cursor in (
+                    cursor_store.get(tenant.key) for tenant in subscription
+                ) if cursor is not None
+            ), default=None)
+        if from_date is not None:
+            subscription.current_timestamp = from_date
+
+
+def advance_cursor(subscription, current_date):
+    """Сдвигаем курсор подписки на current_date из api-ответа."""
+    if isinstance(current_date, int) and (
+        current_date > subscription.current_timestamp
+    ):
+        cursor_store.advance(subscription.key, current_date)
+        subscription.current_timestamp = current_date
+
+
+def acquire_subscriptions(registry, keys):
+    """Подписки перешли к этому процессу: читаем их курсоры из базы."""
+    restore_cursors([
+        registry.get(key) for key in keys if key in registry
+    ])
+
+
+def release_subscriptions(registry, keys):
+    """Подписки уходят к другому процессу.
+
+    Записываем их состояние в базу и забываем кэши, чтобы при
+    возвращении подписки не сравнивать с устаревшими данными.
+    """
+    for key in keys:
+        status_cache.forget(key)
+        response_cache.forget(key)
+        subscription = registry.get(key)
+        if subscription is not None:
+            state_store.evict(tenant.key for tenant in subscription)
+
+
+async def poll_subscription(outbox, subscription):
+    """Один цикл опроса для одного токена.
+
+    Ответ api один на всю подписку, а сравнение с прошлым
+    состоянием и отправка идут для каждого чата отдельно.
+    Сообщения ставятся в очередь отправки outbox и не ждут Telegram.
+    Ошибки DIGEST_ERRORS копятся в error_digest и уходят сводкой,
+    когда закроется окно подписки.
+    Возвращаем PollOutcome для планировщика опросов.
+    """
+    outcome = PollOutcome()
+    try:
+        response = await get_api_answer_async(
+            subscription.current_timestamp, subscription.headers,
+            subscription.key
+        )
+        if isinstance(response, NotModified):
+            # ответ не изменился: разбирать и сравнивать нечего
+            status_cache.update(subscription.key, ())
+            forget_errors(subscription)
+            advance_cursor(subscription, response.current_date)
+            return outcome
+        new_hw = check_response(response)
+        logger.info(
+            "Функции get_api_answer и check_response сработали успешно"
+        )
+        status_cache.update(subscription.key, new_hw)
+        tenants = list(subscription)
+
+        def report_homework(homework, error):
+            error_digest.add(subscription.key, f'{error}', tenants)
+
+        # каждое изменение статуса рассылается разом во все чаты,
+        # для которых оно новое; известные статусы diff_homeworks пропускает,
+        # неразобранные работы уходят в сводку ошибок
+        for transition in diff_homeworks(tenants, new_hw, report_homework):
+            outcome.changed = True
+            outcome.status = transition.status
+            outbox.broadcast(
+                [tenant.chat_id for tenant in transition.recipients],
+                transition.message
             )
-            message = parse_status(new_hw[0])
-            logger.info("Функция parse_status сработала успешно")
+        forget_errors(tenants)
+        logger.info("Функция parse_status сработала успешно")
+
+    except DIGEST_ERRORS as error:
+        outcome.error = isinstance(error, GetApiAnswerError)
+        logger.info('Ошибка опроса %s попала в сводку: %s',
+                    subscription.key, error)
+        error_digest.add(subscription.key, f'{error}', list(subscription))
+
+    except Exception as error:
+        notify_error(outbox, list(subscription), f'{error}')
+
+    else:
+        # курсор сдвигается только после обработки успешного ответа,
+        # иначе следующий опрос повторит тот же интервал
+        response_cache.confirm(subscription.key)
+        advance_cursor(subscription, response.get('current_date'))
+
+    finally:
+        send_error_digest(outbox, error_digest.take(subscription.key))
+    return outcome
+
+
+def notify_error(outbox, tenants, message):
+    """Отправляем текст ошибки в чаты, где он ещё не был последним."""
+    # сравниваем полученные сообщения между собой
+    # если сообщение содержит новую инфо — отправляем его в чат
+    # если нет — логгируем
+    recipients = [
+        tenant.chat_id for tenant in tenants
+        if CompareMessages(message, tenant.key).comparing() is True
+    ]
+    if recipients:
+        outbox.broadcast(recipients, message)
+
+
+def forget_errors(tenants):
+    """После успешного опроса прошлые ошибки снова могут быть отправлены."""
+    for tenant in tenants:
+        state_store.discard(tenant.key, ERROR_STATE_KEY)
+        state_store.discard(tenant.key, DIGEST_STATE_KEY)
+
+
+def send_error_digest(outbox, error_window):
+    """Отправляем сводку ошибок, если окно закрылось.
+
+    Сводка с теми же ошибками, что и прошлая, повторно не уходит,
+    пока между ними не было успешного опроса. В очереди отправки
+    сводка не склеивается с уведомлениями о статусах.
+    """
+    if error_window is None:
+        return
+    recipients = [
+        tenant.chat_id for tenant in error_window.recipients
+        if CompareMessages(
+            error_window.signature, tenant.key, error_key=DIGEST_STATE_KEY
+        ).comparing()
+    ]
+    if recipients:
+        outbox.broadcast(recipients, error_window.format(), DIGEST_KIND)
+
+
+async def flush_error_digests(outbox):
+    """Отправляем все накопленные сводки, не дожидаясь конца окон."""
+    for error_window in error_digest.take_all():
+        send_error_digest(outbox, error_window)
+
+
+async def poll_profiled(poll, subscription):
+    """Опрос подписки, который профилировщик может снять выборкой."""
+    return await profiler.run(subscription.key, poll, subscription)
+
+
+async def poll_owned(coordinator, poll, subscription):
+    """Опрашиваем подписку, только пока держим её аренду."""
+    if not coordinator.holds(subscription.key):
+        return PollOutcome()
+    return await poll(subscription)
+
+
+async def poll_tracked(poll, subscription):
+    """Опрашиваем подписку и отмечаем, что её опрос идёт."""
+    finished = polls_in_flight[subscription.key] = asyncio.Event()
+    try:
+        return await poll(subscription)
+    finally:
+        del polls_in_flight[subscription.key]
+        finished.set()
+
+
+async def fetch_homeworks(subscription):
+    """Все работы токена для кэша статусов.
+
+    Если опрос токена уже идёт, ждём его: он продлит устаревшую
+    запись кэша, и запрос всей истории не нужен.
+    """
+    polling = polls_in_flight.get(subscription.key)
+    if polling is not None:
+        await polling.wait()
+        homeworks = status_cache.fresh(subscription.key)
+        if homeworks is not None:
+            return homeworks
+    response = await get_api_answer_async(
+        FULL_HISTORY_FROM_DATE, subscription.headers
+    )
+    return check_response(response)
+
+
+def format_status(homeworks):
+    """Ответ на /status: статус последней работы."""
+    if not homeworks:
+        return 'Работ на проверке пока нет.'
+    return parse_status(max(homeworks, key=_date_updated))
 
-        except GetApiAnswerError as error:
-            message = (f'{error}')
 
+def format_history(homeworks):
+    """Ответ на /history: последние работы от новых к старым."""
+    if not homeworks:
+        return 'Работ на проверке пока нет.'
+    latest = sorted(homeworks, key=_date_updated, reverse=True)
+    return '\n'.join(
+        f'{_date_updated(homework)[:10]} {homework["homework_name"]}: '
+        f'{HOMEWORK_STATUSES.get(homework["status"], homework["status"])}'
+        for homework in latest[:HISTORY_LIMIT]
+    )
+
+
+COMMANDS = {
+    'status': format_status,
+    'history': format_history,
+}
+
+
+async def answer_command(registry, outbox, chat_id, command):
+    """Отвечаем на команду из кэша статусов.
+
+    Api запрашивается, только если кэш пользователя устарел,
+    и одним запросом на все одновременные команды.
+    """
+    subscriptions = registry.for_chat(chat_id)
+    if not subscriptions:
+        outbox.put(chat_id, 'Этот чат не подписан на уведомления.')
+        return
+    for subscription in subscriptions:
+        try:
+            homeworks = await status_cache.get(
+                subscription.key,
+                functools.partial(fetch_homeworks, subscription)
+            )
+            message = COMMANDS[command](homeworks)
         except Exception as error:
-            message = (f'{error}')
+            logger.error('Не смогли ответить на /%s: %s', command, error)
+            message = 'Не удалось получить статус, попробуйте позже.'
+        outbox.put(chat_id, message)
+
+
+def build_updater(bot, registry, outbox):
+    """Создаём Updater, который отвечает на /status и /history."""
+    # telegram.ext с планировщиком задач импортируется долго,
+    # поэтому только когда команды действительно нужны
+    from telegram.ext import CommandHandler, Updater
+
+    updater = Updater(bot=bot, workers=1)
+
+    def on_command(update, context):
+        # у отредактированных сообщений update.message пустой
+        message = update.effective_message
+        command = message.text.split()[0][1:].split('@')[0].lower()
+        # обработчик работает в потоке Updater,
+        # а ответ собирается в event loop бота
+        asyncio.run_coroutine_threadsafe(
+            answer_command(
+                registry, outbox, update.effective_chat.id, command
+            ),
+            context.bot_data['loop']
+        )
+
+    updater.dispatcher.add_handler(CommandHandler(list(COMMANDS), on_command))
+    return updater
+
+
+async def serve(engine, outbox, updater=None, stopping=None,
+                coordinator=None):
+    """Запускаем опрос, очередь отправки, приём команд и аренды подписок.
+
+    Работаем до SIGTERM или SIGINT (или до stopping.set()),
+    после чего останавливаемся через drain().
+    """
+    loop = asyncio.get_running_loop()
+    stopping = stopping or asyncio.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, stopping.set)
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Windows или не главный поток: остаётся только stopping
+            pass
+
+    if updater is not None:
+        updater.dispatcher.bot_data['loop'] = loop
+        updater.start_polling(drop_pending_updates=True)
+    engine_task = asyncio.create_task(engine.run())
+    outbox_task = asyncio.create_task(outbox.run())
+    stop_task = asyncio.create_task(stopping.wait())
+    tasks = [engine_task, outbox_task, stop_task]
+    if coordinator is not None:
+        lease_task = asyncio.create_task(coordinator.run())
+        tasks.append(lease_task)
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        logger.info('Останавливаем бота')
+        if coordinator is not None:
+            lease_task.cancel()
+        await drain(
+            engine, outbox, updater, engine_task, SHUTDOWN_TIMEOUT,
+            coordinator
+        )
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.remove_signal_handler(signum)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+
+
+async def drain(engine, outbox, updater, engine_task, timeout,
+                coordinator=None):
+    """Останавливаемся без потерь, но не дольше timeout секунд.
+
+    Новые опросы не начинаются, идущие доделываются, очередь
+    отправки разбирается до конца. Что не успело уйти в Telegram,
+    остаётся в журнале и будет отправлено после перезапуска.
+    Аренды подписок отдаются сразу, если опросы успели закончиться,
+    иначе другие процессы возьмут их после истечения.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    stopping_updater = None
+    if updater is not None:
+        # updater.stop() ждёт конца long polling getUpdates
+        stopping_updater = loop.run_in_executor(None, updater.stop)
+
+    engine.stop()
+    steps = [
+        ('опросы', engine_task),
+        ('сводки ошибок', flush_error_digests(outbox)),
+        ('отправка', outbox.join()),
+    ]
+    if stopping_updater is not None:
+        steps.append(('приём команд', stopping_updater))
+    for name, step in steps:
+        try:
+            await asyncio.wait_for(
+                asyncio.shield(step), max(deadline - loop.time(), 0)
+            )
+        except asyncio.TimeoutError:
+            logger.warning('Не дождались остановки: %s', name)
+    if len(outbox):
+        logger.warning(
+            'Не успели отправить %s сообщений, они остались в журнале',
+            len(outbox)
+        )
+    if coordinator is not None and engine_task.done():
+        await loop.run_in_executor(None, coordinator.leave)
+
+
+async def serve_once(engine, outbox):
+    """Один проход опроса для запуска из cron.
+
+    Ждём, пока очередь отправки разберётся, но не дольше
+    SHUTDOWN_TIMEOUT секунд; неотправленное остаётся в журнале
+    до следующего запуска.
+    """
+    outbox_task = asyncio.create_task(outbox.run())
+    try:
+        await engine.run_once()
+        # окно сводки не переживает запуск, поэтому отправляем сразу
+        await flush_error_digests(outbox)
+        try:
+            await asyncio.wait_for(outbox.join(), SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(
+                'Не успели отправить %s сообщений, они остались в журнале',
+                len(outbox)
+            )
+    finally:
+        outbox_task.cancel()
+        await asyncio.gather(outbox_task, return_exceptions=True)
+
+
+def build_bot():
+    """Создаём бота, который ходит в Telegram через общий транспорт."""
+    import telegram
+
+    return telegram.Bot(
+        token=TELEGRAM_TOKEN,
+        base_url=TELEGRAM_BASE_URL,
+        request=transport.telegram_request(TELEGRAM_SEND_CONCURRENCY)
+    )
+
+
+def build_outbox(bot):
+    """Создаём очередь отправки с журналом неотправленных сообщений."""
+    return OutboundQueue(
+        functools.partial(send_message_async, bot),
+        chat_rate=TELEGRAM_CHAT_RATE,
+        global_rate=TELEGRAM_GLOBAL_RATE,
+        concurrency=TELEGRAM_SEND_CONCURRENCY,
+        spool=MessageSpool(SPOOL_PATH),
+        spool_retry_interval=SPOOL_RETRY_INTERVAL,
+        spool_batch_size=SPOOL_BATCH_SIZE
+    )
+
+
+def build_coordinator(registry):
+    """Создаём координатор аренд, если шардирование включено."""
+    if not SHARD_DB_PATH:
+        return None
+    return ShardCoordinator(
+        LeaseStore(SHARD_DB_PATH),
+        registry,
+        worker_id=WORKER_ID,
+        lease_ttl=LEASE_TTL,
+        on_acquire=functools.partial(acquire_subscriptions, registry),
+        on_release=functools.partial(release_subscriptions, registry)
+    )
+
+
+def build_engine(registry, outbox, coordinator=None):
+    """Создаём движок опроса с адаптивным планировщиком.
+
+    С координатором движок опрашивает только подписки,
+    аренду которых держит этот процесс.
+    """
+    handler = functools.partial(
+        poll_profiled, functools.partial(
+            poll_tracked, functools.partial(poll_subscription, outbox)
+        )
+    )
+    if coordinator is not None:
+        registry = ShardView(registry, coordinator)
+        handler = functools.partial(poll_owned, coordinator, handler)
+    return PollingEngine(
+        registry,
+        handler,
+        RETRY_TIME,
+        POLL_CONCURRENCY,
+        wheel=TimingWheel(WHEEL_TICK) if TIMING_WHEEL else None,
+        max_rate=POLL_RATE or None,
+        scheduler=AdaptiveScheduler(
+            base_interval=RETRY_TIME,
+            reviewing_interval=REVIEWING_RETRY_TIME,
+            max_interval=MAX_RETRY_TIME,
+            idle_after=IDLE_AFTER,
+            backoff_factor=BACKOFF_FACTOR,
+            jitter=RETRY_JITTER
+        )
+    )
 
-        finally:
-            # сравниваем полученные сообщения между собой
-            # если сообщение содержит новую инфо — отправляем его пользователю
-            # если нет — логгируем
-            if CompareMessages(message).comparing() is True:
-                send_message(bot, message)
 
-            time.sleep(RETRY_TIME)
+def shutdown(engine, outbox, coordinator=None):
+    """Пишем итоговую статистику и закрываем ресурсы.
+
+    Закрытие хранилища состояний записывает накопленные изменения.
+    """
+    logger.info('Статистика запросов: %s', transport.stats.summary())
+    logger.info('Статистика планировщика: %s', engine.scheduler.stats())
+    logger.info(
+        'Отправлено сообщений: %s, склеено: %s',
+        outbox.sent, outbox.coalesced
+    )
+    transport.close()
+    cursor_store.close()
+    state_store.close()
+    if outbox.spool is not None:
+        outbox.spool.close()
+    if coordinator is not None:
+        coordinator.store.close()
+    if api_capture is not None:
+        api_capture.close()
+    profiler.flush()
+
+
+def parse_args(argv=None):
+    """Разбираем аргументы командной строки."""
+    parser = argparse.ArgumentParser(
+        description='Бот, который присылает статусы домашних работ.'
+    )
+    parser.add_argument(
+        '--once', action='store_true',
+        help='опросить все подписки один раз и выйти'
+    )
+    parser.add_argument(
+        '--tenants', metavar='FILE', default=TENANTS_FILE,
+        help='json-файл с подписками (по умолчанию TENANTS_FILE); '
+             'один проход по ним — вместе с --once'
+    )
+    parser.add_argument(
+        '--dry-run', action='store_true',
+        help='не отправлять сообщения и не сохранять курсоры и статусы'
+    )
+    return parser.parse_args(argv)
+
+
+def use_snapshot_stores():
+    """Подменяем хранилища копией базы, которая удалится после запуска."""
+    global cursor_store, state_store
+
+    path = snapshot(STATE_DB_PATH)
+    cursor_store = CursorStore(path)
+    state_store = StateStore(
+        path,
+        batch_size=STATE_BATCH_SIZE,
+        flush_interval=STATE_FLUSH_INTERVAL
+    )
+    return path
+
+
+def install_profiler_signal():
+    """SIGUSR2 включает и выключает профилирование циклов."""
+    if hasattr(signal, 'SIGUSR2'):
+        try:
+            signal.signal(signal.SIGUSR2, profiler.toggle)
+        except ValueError:
+            # сигналы можно ставить только из главного потока
+            pass
+
+
+def build_registry(tenants_file=None):
+    """Подписки из переменных окружения и файла подписок с курсорами.
+
+    Подписка из окружения добавляется, только если заданы и
+    PRACTICUM_TOKEN, и TELEGRAM_CHAT_ID.
+    """
+    registry = TenantRegistry()
+    if PRACTICUM_TOKEN:
+        for chat_id in chat_targets(TELEGRAM_CHAT_ID):
+            registry.add(PRACTICUM_TOKEN, chat_id)
+    if tenants_file:
+        registry.load(tenants_file)
+    restore_cursors(registry)
+    return registry
+
+
+def start_metrics(http=True):
+    """Запускаем отдачу метрик, если она настроена."""
+    if METRICS_PORT and http:
+        metrics.start_http_server(int(METRICS_PORT))
+    if METRICS_SNAPSHOT_PATH:
+        metrics.start_snapshot_writer(
+            METRICS_SNAPSHOT_PATH, METRICS_SNAPSHOT_INTERVAL
+        )
+
+
+def main(argv=None):
+    """Основная логика работы бота.
+
+    --once опрашивает подписки один раз и выходит, --dry-run
+    ничего не отправляет и не сохраняет. В обоих режимах нет
+    приёма команд и шардирования: они нужны только постоянному
+    процессу.
+    """
+    args = parse_args(argv)
+    logger.info("Запускаем бота")
+
+    resident = not (args.once or args.dry_run)
+    if check_env(args.tenants, resident) is False:
+        logger.critical("Программа остановлена")
+        sys.exit(1)
+
+    snapshot_path = None
+    if args.dry_run:
+        # сравниваем с сохранённым состоянием, но пишем в его копию,
+        # чтобы настоящий запуск увидел те же изменения
+        snapshot_path = use_snapshot_stores()
+    registry = build_registry(args.tenants)
+    start_metrics(http=not args.once)
+    install_profiler_signal()
+
+    if args.dry_run:
+        outbox = DryRunOutbox()
+    else:
+        bot = build_bot()
+        outbox = build_outbox(bot)
+    coordinator = build_coordinator(registry) if resident else None
+    if coordinator is not None:
+        # первые аренды берём до старта, чтобы сразу начать опрос
+        coordinator.refresh()
+    engine = build_engine(registry, outbox, coordinator)
+    updater = None
+    if resident and TELEGRAM_COMMANDS:
+        updater = build_updater(bot, registry, outbox)
+    try:
+        if args.once:
+            asyncio.run(serve_once(engine, outbox))
+        else:
+            asyncio.run(
+                serve(engine, outbox, updater, coordinator=coordinator)
+            )
+    finally:
+        shutdown(engine, outbox, coordinator)
+        if snapshot_path is not None:
+            remove_snapshot(snapshot_path)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,337 @@
+import argparse
+import asyncio
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+
+# статусы работы сменяют друг друга по кругу
+STATUS_CYCLE = ('reviewing', 'rejected', 'reviewing', 'approved')
+SIM_TELEGRAM_TOKEN = '123456:SIMULATED'
+
+
+class FaultProfile:
+    """Задержка и доля ошибок фальшивого сервера."""
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0):
+        """Инициализация переменных."""
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+    def delay(self):
+        """Ждём, сколько положено по профилю."""
+        pause = self.latency + random.uniform(0, self.jitter)
+        if pause > 0:
+            time.sleep(pause)
+
+    def fail(self):
+        """Пора ли ответить ошибкой."""
+        return random.random() < self.error_rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, code, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server:
+    """Фальшивый сервер в фоновом потоке."""
+
+    handler = _Handler
+
+    def start(self):
+        """Запускаем сервер на свободном порту."""
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler)
+        self.httpd.daemon_threads = True
+        self.httpd.sim = self
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    @property
+    def url(self):
+        """Адрес сервера."""
+        return f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def stop(self):
+        """Останавливаем сервер."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _PracticumHandler(_Handler):
+
+    def do_GET(self):
+        sim = self.server.sim
+        sim.requests += 1
+        sim.faults.delay()
+        token = self.headers.get('Authorization', '').replace('OAuth ', '')
+        if token not in sim.phases:
+            self.reply(401, {'code': 'not_authenticated'})
+            return
+        if sim.faults.fail():
+            sim.errors += 1
+            self.reply(500, {'code': 'internal_error'})
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        from_date = int(query.get('from_date', ['0'])[0])
+        self.reply(200, sim.answer(token, from_date, time.time()))
+
+
+class FakePracticum(_Server):
+    """Фальшивый api homework_statuses.
+
+    У каждого пользователя одна работа, статус которой меняется раз в
+    change_interval секунд со своим случайным сдвигом.
+    """
+
+    handler = _PracticumHandler
+
+    def __init__(self, tokens, change_interval, faults):
+        """Инициализация переменных."""
+        self.change_interval = change_interval
+        self.faults = faults
+        self.started = time.time()
+        self.phases = {
+            token: random.uniform(0, change_interval) for token in tokens
+        }
+        self.requests = 0
+        self.errors = 0
+
+    def changes(self, token, until):
+        """Смены статуса [(время, статус)] до момента until."""
+        first = self.started + self.phases[token]
+        result = []
+        step = 0
+        while first + step * self.change_interval <= until:
+            result.append((
+                first + step * self.change_interval,
+                STATUS_CYCLE[step % len(STATUS_CYCLE)]
+            ))
+            step += 1
+        return result
+
+    def answer(self, token, from_date, now):
+        """Тело ответа api для пользователя."""
+        changes = self.changes(token, now)
+        homeworks = []
+        if changes and changes[-1][0] >= from_date:
+            changed_at, status = changes[-1]
+            homeworks.append({
+                'id': 1,
+                'status': status,
+                'homework_name': f'{token}_project.zip',
+                'reviewer_comment': 'Симуляция',
+                'date_updated': time.strftime(
+                    '%Y-%m-%dT%H:%M:%SZ', time.gmtime(changed_at)
+                ),
+                'lesson_name': 'Нагрузочный тест',
+            })
+        return {'homeworks': homeworks, 'current_date': int(now)}
+
+
+class _TelegramHandler(_Handler):
+
+    def do_POST(self):
+        sim = self.server.sim
+        sim.requests += 1
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length) or b'{}')
+        sim.faults.delay()
+        if not self.path.endswith('/sendMessage'):
+            self.reply(404, {'ok': False, 'description': 'Not Found'})
+            return
+        if sim.faults.fail():
+            sim.errors += 1
+            self.reply(500, {'ok': False, 'description': 'Internal Error'})
+            return
+
+        chat_id = int(data['chat_id'])
+        sim.received.append((chat_id, data['text'], time.time()))
+        self.reply(200, {'ok': True, 'result': {
+            'message_id': len(sim.received),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': data['text'],
+        }})
+
+
+class FakeTelegram(_Server):
+    """Фальшивый Telegram Bot API, который запоминает сообщения."""
+
+    handler = _TelegramHandler
+
+    def __init__(self, faults):
+        """Инициализация переменных."""
+        self.faults = faults
+        self.received = []
+        self.requests = 0
+        self.errors = 0
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * q / 100), len(values) - 1)]
+
+
+def notification_latencies(practicum, telegram_api, tokens, verdicts, until):
+    """Задержки от смены статуса до получения сообщения и число пропусков.
+
+    Смена считается доставленной первым сообщением в чат пользователя,
+    которое пришло после неё и содержит вердикт нового статуса.
+    """
+    received = {}
+    for chat_id, text, received_at in telegram_api.received:
+        received.setdefault(chat_id, []).append((received_at, text))
+
+    latencies = []
+    missed = 0
+    for chat_id, token in enumerate(tokens):
+        messages = received.get(chat_id, [])
+        for changed_at, status in practicum.changes(token, until):
+            delivered = next(
+                (received_at for received_at, text in messages
+                 if received_at >= changed_at and verdicts[status] in text),
+                None
+            )
+            if delivered is None:
+                missed += 1
+            else:
+                latencies.append(delivered - changed_at)
+    return latencies, missed
+
+
+def simulate(tenants, duration, poll_interval, change_interval,
+             api_faults, telegram_faults, workdir):
+    """Гоняем настоящий конвейер опроса против фальшивых серверов."""
+    tokens = [f'sim-{index}' for index in range(tenants)]
+    practicum = FakePracticum(tokens, change_interval, api_faults).start()
+    telegram_api = FakeTelegram(telegram_faults).start()
+
+    # homework читает настройки из окружения при импорте
+    os.environ.update({
+        'PRACTICUM_ENDPOINT': practicum.url + '/api/user_api/'
+                                              'homework_statuses/',
+        'TELEGRAM_BASE_URL': telegram_api.url + '/bot',
+        'TELEGRAM_TOKEN': SIM_TELEGRAM_TOKEN,
+        'STATE_DB_PATH': os.path.join(workdir, 'state.sqlite3'),
+        'SPOOL_PATH': os.path.join(workdir, 'outbox.spool'),
+        'RETRY_TIME': str(poll_interval),
+        'REVIEWING_RETRY_TIME': str(poll_interval),
+        'MAX_RETRY_TIME': str(poll_interval * 4),
+        'SPOOL_RETRY_INTERVAL': str(max(poll_interval, 1)),
+        'LOG_LEVEL': os.getenv('LOG_LEVEL', 'WARNING'),
+        # фальшивый Telegram не отдаёт getUpdates
+        'TELEGRAM_COMMANDS': '0',
+    })
+    import homework
+    from engine import TenantRegistry
+
+    registry = TenantRegistry()
+    for chat_id, token in enumerate(tokens):
+        registry.add(token, chat_id)
+    outbox = homework.build_outbox(homework.build_bot())
+    engine = homework.build_engine(registry, outbox)
+
+    async def run_for_duration():
+        stopping = asyncio.Event()
+        asyncio.get_running_loop().call_later(duration, stopping.set)
+        await homework.serve(engine, outbox, stopping=stopping)
+
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    started = time.time()
+    asyncio.run(run_for_duration())
+    finished = time.time()
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    homework.shutdown(engine, outbox)
+    practicum.stop()
+    telegram_api.stop()
+
+    # смены статуса в последний интервал опроса ещё не могли дойти
+    latencies, missed = notification_latencies(
+        practicum, telegram_api, tokens, homework.HOMEWORK_STATUSES,
+        until=finished - poll_interval * 2
+    )
+    elapsed = finished - started
+    cpu = (usage_after.ru_utime - usage_before.ru_utime
+           + usage_after.ru_stime - usage_before.ru_stime)
+    return {
+        'tenants': tenants,
+        'duration': round(elapsed, 2),
+        'api_requests': practicum.requests,
+        'api_requests_per_second': round(practicum.requests / elapsed, 2),
+        'api_errors_injected': practicum.errors,
+        'telegram_requests': telegram_api.requests,
+        'telegram_errors_injected': telegram_api.errors,
+        'notifications_delivered': len(telegram_api.received),
+        'notifications_missed': missed,
+        'notification_latency_p50': _percentile(latencies, 50),
+        'notification_latency_p95': _percentile(latencies, 95),
+        'notification_latency_max': max(latencies, default=None),
+        'cpu_seconds': round(cpu, 2),
+        'cpu_utilisation': round(cpu / elapsed, 3),
+        'max_rss_mb': round(usage_after.ru_maxrss / 1024, 1),
+        'threads': threading.active_count(),
+    }
+
+
+def parse_args(argv=None):
+    """Разбираем аргументы командной строки."""
+    parser = argparse.ArgumentParser(
+        description='Нагрузочная симуляция бота против фальшивых '
+                    'серверов Практикума и Telegram'
+    )
+    parser.add_argument('--tenants', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--poll-interval', type=int, default=5)
+    parser.add_argument('--change-interval', type=float, default=30)
+    parser.add_argument('--api-latency', type=float, default=0.05)
+    parser.add_argument('--api-jitter', type=float, default=0.05)
+    parser.add_argument('--api-error-rate', type=float, default=0.0)
+    parser.add_argument('--telegram-latency', type=float, default=0.05)
+    parser.add_argument('--telegram-jitter', type=float, default=0.05)
+    parser.add_argument('--telegram-error-rate', type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Запускаем симуляцию и печатаем отчёт в json."""
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix='loadsim-') as workdir:
+        report = simulate(
+            tenants=args.tenants,
+            duration=args.duration,
+            poll_interval=args.poll_interval,
+            change_interval=args.change_interval,
+            api_faults=FaultProfile(
+                args.api_latency, args.api_jitter, args.api_error_rate
+            ),
+            telegram_faults=FaultProfile(
+                args.telegram_latency, args.telegram_jitter,
+                args.telegram_error_rate
+            ),
+            workdir=workdir
+        )
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
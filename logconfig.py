@@ -0,0 +1,123 @@
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import queue
+import re
+import signal
+
+
+FORMAT = (
+    '%(asctime)s, %(levelname)s, %(funcName)s, '
+    '%(lineno)s, %(message)s, %(name)s'
+)
+
+# библиотеки слишком подробно пишут на DEBUG
+QUIET_LOGGERS = ('urllib3', 'telegram', 'apscheduler')
+
+SECRET_PATTERNS = (
+    # заголовок Authorization с токеном Практикума
+    (re.compile(r'OAuth\s+[^\s\'",}]+'), 'OAuth ***'),
+    # токен бота в адресах Bot API
+    (re.compile(r'bot\d+:[\w-]+'), 'bot***'),
+)
+
+_state = {'listener': None, 'level': logging.INFO}
+_exception_formatter = logging.Formatter()
+
+
+class RedactSecretsFilter(logging.Filter):
+    """Вырезаем токены из сообщений перед записью.
+
+    Фильтр висит на обработчиках, поэтому сообщение форматируется
+    в фоновом потоке и только если запись прошла по уровню.
+    """
+
+    def __init__(self, secrets=()):
+        """Инициализация переменных."""
+        super().__init__()
+        self.secrets = [secret for secret in secrets if secret]
+
+    def filter(self, record):
+        record.msg, record.args = self.redact(record.getMessage()), None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.redact(
+                _exception_formatter.formatException(record.exc_info)
+            )
+        return True
+
+    def redact(self, text):
+        """Заменяем токены в тексте на ***."""
+        for secret in self.secrets:
+            text = text.replace(secret, '***')
+        for pattern, replacement in SECRET_PATTERNS:
+            text = pattern.sub(replacement, text)
+        return text
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler, который не форматирует запись в вызывающем потоке."""
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level='INFO', log_file=None, secrets=()):
+    """Переводим логирование на очередь с фоновым потоком записи.
+
+    Вызывающий код только кладёт запись в очередь; форматирование,
+    вырезание токенов и запись в консоль и файл выполняет
+    QueueListener в своём потоке.
+    """
+    if _state['listener'] is not None:
+        return
+
+    redact = RedactSecretsFilter(secrets)
+    formatter = logging.Formatter(FORMAT)
+    handlers = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(RotatingFileHandler(
+            log_file,
+            mode='w',
+            maxBytes=(1024 * 100),
+            backupCount=1
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        handler.addFilter(redact)
+
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    atexit.register(listener.stop)
+    _state['listener'] = listener
+
+    logging.getLogger().addHandler(LazyQueueHandler(log_queue))
+    set_log_level(level)
+    _state['level'] = logging.getLogger().level
+
+    if hasattr(signal, 'SIGUSR1'):
+        try:
+            signal.signal(signal.SIGUSR1, toggle_debug)
+        except ValueError:
+            # сигналы можно ставить только из главного потока
+            pass
+
+
+def set_log_level(level):
+    """Меняем уровень логирования на лету."""
+    root = logging.getLogger()
+    root.setLevel(level)
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(max(root.level, logging.INFO))
+
+
+def toggle_debug(signum=None, frame=None):
+    """SIGUSR1: переключаемся между DEBUG и настроенным уровнем."""
+    if logging.getLogger().level == logging.DEBUG:
+        set_log_level(_state['level'])
+    else:
+        set_log_level(logging.DEBUG)
+    logging.getLogger(__name__).warning(
+        'Уровень логирования: %s',
+        logging.getLevelName(logging.getLogger().level)
+    )
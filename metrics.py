@@ -0,0 +1,278 @@
+from bisect import bisect_left
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+def _escape(value):
+    return (str(value).replace('\\', r'\\')
+            .replace('"', r'\"').replace('\n', r'\n'))
+
+
+def _render_labels(labelnames, key, extra=()):
+    pairs = list(zip(labelnames, key)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        f'{name}="{_escape(value)}"' for name, value in pairs
+    ) + '}'
+
+
+class _Metric:
+    """Общая часть метрик: имя, описание и значения по меткам."""
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        """Инициализация переменных."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def render(self):
+        """Метрика в текстовом формате Prometheus."""
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_render_labels(self.labelnames, key)} {value}']
+
+
+class Counter(_Metric):
+    """Счётчик, который только растёт."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        """Увеличиваем счётчик."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        """Текущее значение счётчика."""
+        return self._values.get(self._key(labels), 0)
+
+    def snapshot(self):
+        """Значения по меткам для файла-снимка."""
+        with self._lock:
+            return {'|'.join(map(str, key)): value
+                    for key, value in self._values.items()}
+
+
+class Gauge(Counter):
+    """Значение, которое может и расти, и уменьшаться."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        """Устанавливаем значение."""
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=LATENCY_BUCKETS):
+        """Инициализация переменных."""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        """Добавляем наблюдение."""
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0
+                ]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, **labels):
+        """Число наблюдений."""
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def snapshot(self):
+        """Сумма и число наблюдений по меткам для файла-снимка."""
+        with self._lock:
+            return {
+                '|'.join(map(str, key)): {'sum': state[1], 'count': state[2]}
+                for key, state in self._values.items()
+            }
+
+    def _render_value(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        for bound, bucket_count in zip(bounds, counts):
+            cumulative += bucket_count
+            labels = _render_labels(self.labelnames, key, [('le', bound)])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _render_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {total}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Набор метрик процесса."""
+
+    def __init__(self):
+        """Инициализация переменных."""
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labelnames=()):
+        """Счётчик с таким именем; создаётся при первом обращении."""
+        return self._get(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        """Gauge с таким именем; создаётся при первом обращении."""
+        return self._get(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(),
+                  buckets=LATENCY_BUCKETS):
+        """Гистограмма с таким именем; создаётся при первом обращении."""
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Histogram(
+                    name, documentation, labelnames, buckets
+                )
+            return self._metrics[name]
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """Все метрики в виде словаря."""
+        return {
+            name: metric.snapshot()
+            for name, metric in list(self._metrics.items())
+        }
+
+    def _get(self, cls, name, documentation, labelnames):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, documentation, labelnames)
+            return self._metrics[name]
+
+
+registry = MetricsRegistry()
+
+CALL_SECONDS = registry.histogram(
+    'bot_call_seconds', 'Время выполнения функций бота', ('func',)
+)
+CALL_ERRORS = registry.counter(
+    'bot_errors_total', 'Исключения функций бота по классам', ('func', 'error')
+)
+
+
+def timed(func_name):
+    """Декоратор: время вызова в CALL_SECONDS, исключения в CALL_ERRORS."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception as error:
+                CALL_ERRORS.inc(func=func_name, error=type(error).__name__)
+                raise
+            finally:
+                CALL_SECONDS.observe(
+                    time.perf_counter() - started, func=func_name
+                )
+        return wrapper
+    return decorator
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_http_server(port, host='127.0.0.1', metrics_registry=registry):
+    """Отдаём метрики по адресу http://host:port/metrics из фонового потока."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.registry = metrics_registry
+    threading.Thread(
+        target=server.serve_forever, name='metrics', daemon=True
+    ).start()
+    logger.info('Метрики доступны на http://%s:%s/metrics', host, port)
+    return server
+
+
+def write_snapshot(path, metrics_registry=registry):
+    """Атомарно записываем снимок метрик в json-файл."""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(
+            {'time': time.time(), 'metrics': metrics_registry.snapshot()},
+            file, ensure_ascii=False
+        )
+    os.replace(tmp_path, path)
+
+
+def start_snapshot_writer(path, interval, metrics_registry=registry):
+    """Раз в interval секунд пишем снимок метрик из фонового потока."""
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            try:
+                write_snapshot(path, metrics_registry)
+            except OSError:
+                logger.error('Не смогли записать снимок метрик', exc_info=True)
+
+    threading.Thread(target=loop, name='metrics-snapshot', daemon=True).start()
+    return stop
@@ -0,0 +1,404 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# ограничение Telegram на длину одного сообщения
+MESSAGE_LIMIT = 4096
+SEPARATOR = '\n\n'
+
+OUTBOX_MESSAGES = metrics.registry.counter(
+    'bot_outbox_messages_total', 'Исходы отправки сообщений', ('result',)
+)
+BROADCAST_TARGETS = metrics.registry.counter(
+    'bot_broadcast_targets_total',
+    'Исходы рассылки по чатам: доставлено или нет', ('result',)
+)
+
+
+def normalize_chat_id(chat_id):
+    """Id чата одного типа: числовой — int, @username канала — str.
+
+    Из TELEGRAM_CHAT_ID id приходят строками, а из Telegram — числами;
+    без приведения у одного чата были бы две очереди и два ведра.
+    """
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return chat_id
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity."""
+
+    def __init__(self, rate, capacity=1, clock=time.monotonic):
+        """Инициализация переменных."""
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+        self.blocked_until = 0.0
+
+    def delay(self):
+        """Через сколько секунд будет доступен токен; 0 — уже доступен."""
+        now = self._refill()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        """Забираем токен; вызывать, когда delay() вернул 0."""
+        self._refill()
+        self.tokens -= 1
+
+    def block(self, seconds):
+        """Не выдаём токены seconds секунд (ответ Telegram RetryAfter)."""
+        self.blocked_until = max(self.blocked_until, self.clock() + seconds)
+        self.tokens = 0
+
+    @property
+    def full(self):
+        """Ведро полное, его можно выбросить и создать заново."""
+        return self._refill() >= self.blocked_until and (
+            self.tokens >= self.capacity
+        )
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+        return now
+
+
+class OutboundQueue:
+    """Очередь исходящих сообщений Telegram.
+
+    Ограничивает частоту отправки в каждый чат и общую частоту бота,
+    а накопившиеся для одного чата сообщения склеивает в одно.
+    Склеиваются только сообщения одного вида kind: например, сводка
+    ошибок не попадает в одно сообщение с уведомлением о статусе.
+    send — корутина send(chat_id, text): True — сообщение отправлено,
+    False — Telegram отказал окончательно; RetryAfter и остальные
+    исключения считаются временной недоступностью.
+
+    Если задан spool (MessageSpool), каждое сообщение сначала
+    записывается в журнал и подтверждается в нём после доставки.
+    Не доставленные из-за недоступности Telegram сообщения остаются в
+    журнале, и раз в spool_retry_interval секунд фоновая задача
+    возвращает в очередь до spool_batch_size из них.
+    """
+
+    def __init__(self, send, chat_rate=1, global_rate=30, concurrency=10,
+                 spool=None, spool_retry_interval=60, spool_batch_size=100,
+                 clock=time.monotonic):
+        """Инициализация переменных."""
+        self.send = send
+        self.spool = spool
+        self.spool_retry_interval = spool_retry_interval
+        self.spool_batch_size = spool_batch_size
+        self.chat_rate = chat_rate
+        self.concurrency = concurrency
+        self.clock = clock
+        self.global_bucket = TokenBucket(
+            global_rate, capacity=global_rate, clock=clock
+        )
+        self._chat_buckets = {}
+        # chat_id -> [(text, future, spool_id, kind)] в порядке поступления
+        self._pending = {}
+        # id сообщений журнала, которые сейчас в очереди или в пути
+        self._queued_ids = set()
+        # (время готовности, порядковый номер, chat_id)
+        self._heap = []
+        self._scheduled = set()
+        self._in_flight = set()
+        self._counter = itertools.count()
+        self._wakeup = None
+        self._idle = None
+        self._slots = None
+        self.sent = 0
+        self.coalesced = 0
+
+    def put(self, chat_id, text, kind=None):
+        """Ставим сообщение вида kind в очередь.
+
+        Возвращаем future, которое получит True после доставки
+        и False, если сообщение отправить не удалось.
+        """
+        self._start()
+        chat_id = normalize_chat_id(chat_id)
+        spool_id = None
+        if self.spool is not None:
+            spool_id = self.spool.append(chat_id, text, kind)
+        return self._enqueue(chat_id, text, spool_id, kind)
+
+    def broadcast(self, chat_ids, text, kind=None):
+        """Ставим одно сообщение в очередь нескольких чатов.
+
+        Чаты отправляются независимо и параллельно, в пределах
+        concurrency и общего ограничения частоты. В журнал рассылка
+        пишется разом, одним fsync на все чаты. Возвращаем future,
+        которое получит {chat_id: True/False} после всех отправок.
+        """
+        self._start()
+        chat_ids = [normalize_chat_id(chat_id) for chat_id in chat_ids]
+        spool_ids = [None] * len(chat_ids)
+        if self.spool is not None and chat_ids:
+            spool_ids = self.spool.extend(chat_ids, text, kind)
+        futures = {
+            chat_id: self._enqueue(chat_id, text, spool_id, kind)
+            for chat_id, spool_id in zip(chat_ids, spool_ids)
+        }
+        return asyncio.ensure_future(self._collect(futures))
+
+    async def _collect(self, futures):
+        results = dict(zip(futures, await asyncio.gather(*futures.values())))
+        failed = [chat_id for chat_id, sent in results.items() if not sent]
+        BROADCAST_TARGETS.inc(len(results) - len(failed), result='delivered')
+        if failed:
+            BROADCAST_TARGETS.inc(len(failed), result='failed')
+            logger.warning(
+                'Сообщение не дошло в %s из %s чатов: %s',
+                len(failed), len(results), failed
+            )
+        return results
+
+    async def run(self):
+        """Разбираем очередь, пока задачу не отменят."""
+        self._start()
+        drainer = None
+        if self.spool is not None:
+            drainer = asyncio.create_task(self._drain_spool())
+        try:
+            await self._dispatch()
+        finally:
+            if drainer is not None:
+                drainer.cancel()
+
+    async def _dispatch(self):
+        while True:
+            if not self._heap:
+                await self._wait(None)
+                continue
+
+            ready_at, _, chat_id = self._heap[0]
+            wait = max(ready_at - self.clock(), self.global_bucket.delay())
+            if wait > 0:
+                await self._wait(wait)
+                continue
+
+            heapq.heappop(self._heap)
+            self._scheduled.discard(chat_id)
+            bucket = self._bucket(chat_id)
+            if bucket.delay() > 0:
+                self._schedule(chat_id)
+                continue
+
+            await self._slots.acquire()
+            bucket.consume()
+            self.global_bucket.consume()
+            batch = self._take_batch(chat_id)
+            self._in_flight.add(chat_id)
+            asyncio.create_task(self._deliver(chat_id, batch))
+
+    async def join(self):
+        """Ждём, пока очередь не опустеет."""
+        self._start()
+        await self._idle.wait()
+
+    def __len__(self):
+        return sum(len(batch) for batch in self._pending.values())
+
+    def _enqueue(self, chat_id, text, spool_id, kind=None):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(chat_id, []).append(
+            (text, future, spool_id, kind)
+        )
+        if spool_id is not None:
+            self._queued_ids.add(spool_id)
+        self._schedule(chat_id)
+        self._idle.clear()
+        return future
+
+    async def _drain_spool(self):
+        """Возвращаем в очередь сообщения журнала, не доставленные ранее."""
+        while True:
+            batch = [
+                record for record in self.spool.pending()
+                if record[0] not in self._queued_ids
+            ][:self.spool_batch_size]
+            for spool_id, chat_id, text in batch:
+                self._enqueue(
+                    normalize_chat_id(chat_id), text, spool_id,
+                    self.spool.kind(spool_id)
+                )
+            if batch:
+                logger.info(
+                    'Повторно отправляем %s сообщений из журнала', len(batch)
+                )
+            if self.spool.needs_compaction:
+                self.spool.compact()
+            await asyncio.sleep(self.spool_retry_interval)
+
+    def _start(self):
+        # примитивы asyncio создаются внутри работающего event loop
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+            self._idle = asyncio.Event()
+            self._idle.set()
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def _wait(self, timeout):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def _bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(
+                self.chat_rate, clock=self.clock
+            )
+        return bucket
+
+    def _schedule(self, chat_id):
+        if chat_id in self._scheduled or chat_id in self._in_flight:
+            return
+        if chat_id not in self._pending:
+            return
+        ready_at = self.clock() + self._bucket(chat_id).delay()
+        heapq.heappush(
+            self._heap, (ready_at, next(self._counter), chat_id)
+        )
+        self._scheduled.add(chat_id)
+        self._wakeup.set()
+
+    def _take_batch(self, chat_id):
+        """Забираем сообщения чата одного вида, которые влезают в одно."""
+        pending = self._pending[chat_id]
+        size = len(pending[0][0])
+        count = 1
+        while count < len(pending) and pending[count][3] == pending[0][3]:
+            size += len(SEPARATOR) + len(pending[count][0])
+            if size > MESSAGE_LIMIT:
+                break
+            count += 1
+
+        batch, rest = pending[:count], pending[count:]
+        if rest:
+            self._pending[chat_id] = rest
+        else:
+            del self._pending[chat_id]
+        return batch
+
+    async def _deliver(self, chat_id, batch):
+        # к первой отправке бот уже создан и telegram импортирован
+        from telegram.error import RetryAfter
+
+        text = SEPARATOR.join(text for text, _, _, _ in batch)
+        try:
+            delivered = await self.send(chat_id, text)
+        except RetryAfter as error:
+            logger.warning(
+                'Telegram просит подождать %s секунд перед отправкой в %s',
+                error.retry_after, chat_id
+            )
+            OUTBOX_MESSAGES.inc(result='retry_after')
+            self._bucket(chat_id).block(error.retry_after)
+            self._pending[chat_id] = batch + self._pending.get(chat_id, [])
+        except Exception:
+            # сообщения остаются в журнале и вернутся в очередь позже
+            logger.error(
+                'Не смогли отправить сообщение в %s', chat_id, exc_info=True
+            )
+            OUTBOX_MESSAGES.inc(result='unavailable')
+            self._finish(batch, False, acknowledge=False)
+        else:
+            if delivered:
+                self.sent += 1
+                self.coalesced += len(batch) - 1
+            OUTBOX_MESSAGES.inc(result='sent' if delivered else 'rejected')
+            self._finish(batch, bool(delivered), acknowledge=True)
+        finally:
+            self._in_flight.discard(chat_id)
+            self._slots.release()
+            self._schedule(chat_id)
+            self._forget_idle_buckets()
+            if not self._pending and not self._in_flight:
+                self._idle.set()
+
+    def _finish(self, batch, result, acknowledge):
+        spool_ids = [
+            spool_id for _, _, spool_id, _ in batch if spool_id is not None
+        ]
+        self._queued_ids.difference_update(spool_ids)
+        if acknowledge and self.spool is not None:
+            self.spool.ack(spool_ids)
+        for _, future, _, _ in batch:
+            if not future.done():
+                future.set_result(result)
+
+    def _forget_idle_buckets(self):
+        # полное ведро ничем не отличается от нового,
+        # поэтому вёдра без очереди не копятся в памяти
+        if len(self._chat_buckets) <= len(self._pending) * 2 + 100:
+            return
+        for chat_id in list(self._chat_buckets):
+            if (chat_id not in self._pending
+                    and chat_id not in self._in_flight
+                    and self._chat_buckets[chat_id].full):
+                del self._chat_buckets[chat_id]
+
+
+class DryRunOutbox:
+    """Очередь отправки для --dry-run: сообщения только пишутся в лог."""
+
+    def __init__(self):
+        """Инициализация переменных."""
+        self.sent = 0
+        self.coalesced = 0
+        self.spool = None
+
+    def put(self, chat_id, text, kind=None):
+        """Пишем сообщение в лог вместо отправки; future сразу готов."""
+        logger.info('Сообщение для %s (не отправлено): %s', chat_id, text)
+        self.sent += 1
+        OUTBOX_MESSAGES.inc(result='dry_run')
+        return self._done(True)
+
+    def broadcast(self, chat_ids, text, kind=None):
+        """Пишем сообщение для каждого чата; future сразу готов."""
+        for chat_id in chat_ids:
+            self.put(chat_id, text)
+        return self._done({chat_id: True for chat_id in chat_ids})
+
+    @staticmethod
+    def _done(result):
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(result)
+        return future
+
+    async def run(self):
+        """Отправлять нечего: ждём отмены, как настоящая очередь.
+
+        serve() считает завершение очереди сигналом остановки.
+        """
+        await asyncio.Event().wait()
+
+    async def join(self):
+        """Очередь всегда пуста."""
+
+    def __len__(self):
+        return 0
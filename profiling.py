@@ -0,0 +1,189 @@
+from collections import Counter
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_SAMPLES = metrics.registry.counter(
+    'bot_profile_samples_total',
+    'Циклы опроса, снятые профилировщиком, и записанные отчёты',
+    ('result',)
+)
+
+# выделения памяти самого профилировщика в отчёт не попадают
+_OWN_FRAMES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+class CycleProfiler:
+    """Выборочное профилирование циклов опроса.
+
+    Снимается каждый every-й цикл (или каждый every-й цикл подписки
+    tenant), но не чаще раза в min_interval секунд, и одновременно
+    не больше одного цикла, поэтому профилировщик можно держать
+    включённым. Цикл идёт под cProfile и tracemalloc; горячие функции
+    и выделения памяти, дожившие до конца цикла, копятся и каждые
+    report_every выборок пишутся в отчёт path. Старые отчёты хранятся
+    как path.1 … path.<keep - 1>.
+
+    cProfile видит весь поток событийного цикла, поэтому в выборку
+    попадает и работа других подписок, шедшая одновременно.
+    """
+
+    def __init__(self, path, every=100, min_interval=60, tenant=None,
+                 report_every=10, keep=5, top=30, enabled=False,
+                 clock=time.monotonic):
+        """Инициализация переменных."""
+        self.path = path
+        self.every = max(int(every), 1)
+        self.min_interval = min_interval
+        # пустая строка из .env — все подписки
+        self.tenant = tenant or None
+        self.report_every = report_every
+        self.keep = keep
+        self.top = top
+        self.enabled = enabled
+        self.clock = clock
+        self._cycles = 0
+        self._last_sample = None
+        self._active = False
+        self._reset()
+
+    def _reset(self):
+        self.samples = 0
+        self.profiled = 0.0
+        self._stats = None
+        # файл:строка -> [байт, выделений]
+        self._allocations = {}
+
+    def toggle(self, signum=None, frame=None):
+        """SIGUSR2: включаем или выключаем профилирование."""
+        self.enabled = not self.enabled
+        logger.warning(
+            'Профилирование циклов %s',
+            'включено' if self.enabled else 'выключено'
+        )
+
+    def should_sample(self, key):
+        """Снимать ли этот цикл подписки key."""
+        if not self.enabled or self._active:
+            return False
+        if self.tenant is not None and key != self.tenant:
+            return False
+        self._cycles += 1
+        if self._cycles % self.every:
+            return False
+        return self._last_sample is None or (
+            self.clock() - self._last_sample >= self.min_interval
+        )
+
+    async def run(self, key, func, *args):
+        """Выполняем цикл func(*args), при выборке — под профилировщиком."""
+        if not self.enabled and self.samples:
+            # выключили сигналом: пишем то, что успели собрать
+            self.flush()
+        sample = self.should_sample(key) and self._begin()
+        if not sample:
+            return await func(*args)
+        started = self.clock()
+        try:
+            return await func(*args)
+        finally:
+            self._end(*sample, started)
+
+    def _begin(self):
+        # tracemalloc, запущенный не нами, не трогаем и не сбрасываем
+        tracing = not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # в потоке уже работает другой профилировщик
+            if tracing:
+                tracemalloc.stop()
+            return None
+        self._active = True
+        return profile, tracing
+
+    def _end(self, profile, tracing, started):
+        profile.disable()
+        if tracing:
+            snapshot = tracemalloc.take_snapshot().filter_traces(_OWN_FRAMES)
+            tracemalloc.stop()
+            for stat in snapshot.statistics('lineno'):
+                seen = self._allocations.setdefault(
+                    str(stat.traceback[0]), [0, 0]
+                )
+                seen[0] += stat.size
+                seen[1] += stat.count
+        if self._stats is None:
+            self._stats = pstats.Stats(profile)
+        else:
+            self._stats.add(profile)
+        self._last_sample = self.clock()
+        self.profiled += self._last_sample - started
+        self.samples += 1
+        self._active = False
+        PROFILE_SAMPLES.inc(result='sampled')
+        if self.samples >= self.report_every:
+            self.flush()
+
+    def flush(self):
+        """Пишем отчёт по накопленным выборкам и начинаем новый."""
+        if not self.samples:
+            return
+        report = self.format()
+        self._reset()
+        try:
+            self._rotate()
+            with open(self.path, 'w', encoding='utf-8') as output:
+                output.write(report)
+        except OSError:
+            logger.error('Не смогли записать отчёт профилировщика',
+                         exc_info=True)
+            return
+        PROFILE_SAMPLES.inc(result='reported')
+        logger.info('Отчёт профилировщика записан в %s', self.path)
+
+    def _rotate(self):
+        for index in range(self.keep - 1, 0, -1):
+            source = self.path if index == 1 else f'{self.path}.{index - 1}'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{index}')
+
+    def format(self):
+        """Текст отчёта: горячие функции и выделения памяти."""
+        hotspots = io.StringIO()
+        self._stats.stream = hotspots
+        self._stats.sort_stats('cumulative').print_stats(self.top)
+        top = Counter({
+            line: size for line, (size, _) in self._allocations.items()
+        }).most_common(self.top)
+        lines = [
+            f'Выборок: {self.samples}, '
+            f'под профилировщиком: {self.profiled:.3f} с',
+            time.strftime('Записан: %Y-%m-%d %H:%M:%S'),
+            '',
+            '== Горячие функции ==',
+            hotspots.getvalue().strip(),
+            '',
+            '== Память, выделенная за циклы и не освобождённая ==',
+        ]
+        lines.extend(
+            f'{size / 1024:10.1f} КиБ {self._allocations[line][1]:8} '
+            f'выделений  {line}'
+            for line, size in top
+        )
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,83 @@
+from enum import IntEnum
+import sys
+
+
+class Status(IntEnum):
+    """Статусы проверки, которые знает бот."""
+
+    REVIEWING = 1
+    REJECTED = 2
+    APPROVED = 3
+
+    def __str__(self):
+        return self.name.lower()
+
+
+STATUSES = {str(status): status for status in Status}
+
+
+def parse_status_value(value):
+    """Status для известного статуса, иначе интернированная строка."""
+    status = STATUSES.get(value)
+    if status is not None:
+        return status
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class HomeworkRecord:
+    """Компактная запись о домашней работе.
+
+    Из api-ответа хранятся только поля, которые нужны боту; статус —
+    элемент Status, одна копия на процесс. Чтение через record['status']
+    и record.get() работает как у исходного dict, поэтому запись можно
+    передавать в функции, написанные для api-ответа.
+    """
+
+    __slots__ = ('id', 'homework_name', 'status', 'date_updated')
+
+    def __init__(self, homework_id, homework_name, status,
+                 date_updated=None):
+        """Инициализация переменных."""
+        self.id = homework_id
+        self.homework_name = homework_name
+        self.status = parse_status_value(status)
+        self.date_updated = date_updated
+
+    @classmethod
+    def from_api(cls, homework):
+        """Запись из элемента homeworks api-ответа."""
+        if isinstance(homework, cls):
+            return homework
+        return cls(
+            homework.get('id'),
+            homework.get('homework_name'),
+            homework.get('status'),
+            homework.get('date_updated')
+        )
+
+    def get(self, key, default=None):
+        """Значение поля как в api-ответе; default, если его нет."""
+        if key not in self.__slots__:
+            return default
+        value = getattr(self, key)
+        if value is None:
+            return default
+        return str(value) if key == 'status' else value
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __eq__(self, other):
+        if not isinstance(other, HomeworkRecord):
+            return NotImplemented
+        return all(
+            getattr(self, field) == getattr(other, field)
+            for field in self.__slots__
+        )
+
+    def __repr__(self):
+        return (f'HomeworkRecord({self.id!r}, {self.homework_name!r}, '
+                f'{self.get("status")!r}, {self.date_updated!r})')
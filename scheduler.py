@@ -0,0 +1,120 @@
+import logging
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+class PollOutcome:
+    """Итог одного опроса пользователя для планировщика."""
+
+    def __init__(self, error=False, status=None, changed=False):
+        """Инициализация переменных.
+
+        error — api Практикума не ответило (GetApiAnswerError),
+        status — статус последней работы из ответа или None,
+        changed — в ответе были изменения.
+        """
+        self.error = error
+        self.status = status
+        self.changed = changed
+
+
+class _TenantSchedule:
+    """То, что планировщик помнит об одном пользователе."""
+
+    def __init__(self, now):
+        """Инициализация переменных."""
+        self.status = None
+        self.errors = 0
+        self.last_change = now
+
+
+class AdaptiveScheduler:
+    """Выбираем время следующего опроса по состоянию пользователя.
+
+    - пока последняя работа на проверке, опрашиваем раз в
+      reviewing_interval;
+    - после ошибок api интервал растёт как
+      base_interval * backoff_factor ** число_ошибок_подряд;
+    - если изменений нет дольше idle_after, интервал так же растёт
+      с каждым следующим периодом idle_after;
+    - интервал не превышает max_interval и сдвигается на случайную
+      долю jitter, чтобы воркеры не опрашивали api одновременно.
+    """
+
+    def __init__(self, base_interval=600, reviewing_interval=120,
+                 max_interval=3600, idle_after=24 * 60 * 60,
+                 backoff_factor=2, jitter=0.1, clock=time.monotonic):
+        """Инициализация переменных."""
+        self.base_interval = base_interval
+        self.reviewing_interval = reviewing_interval
+        self.max_interval = max_interval
+        self.idle_after = idle_after
+        self.backoff_factor = backoff_factor
+        self.jitter = jitter
+        self.clock = clock
+        self._tenants = {}
+        self._lock = threading.Lock()
+        self._polls = 0
+        self._scheduled_time = 0.0
+
+    def next_delay(self, tenant_key, outcome):
+        """Через сколько секунд опросить пользователя снова.
+
+        outcome=None означает, что опрос упал с ошибкой.
+        """
+        now = self.clock()
+        with self._lock:
+            schedule = self._tenants.get(tenant_key)
+            if schedule is None:
+                schedule = self._tenants[tenant_key] = _TenantSchedule(now)
+            self._update(schedule, outcome, now)
+            delay = self._delay(schedule, now)
+            self._polls += 1
+            self._scheduled_time += delay
+        return delay
+
+    def forget(self, tenant_key):
+        """Забываем пользователя, которого больше не опрашиваем."""
+        with self._lock:
+            self._tenants.pop(tenant_key, None)
+
+    def stats(self):
+        """Сколько запросов сэкономлено по сравнению с base_interval."""
+        with self._lock:
+            fixed_requests = self._scheduled_time / self.base_interval
+            return {
+                'polls': self._polls,
+                'fixed_interval_polls': round(fixed_requests),
+                'saved': round(fixed_requests - self._polls),
+            }
+
+    def _update(self, schedule, outcome, now):
+        if outcome is None or outcome.error:
+            schedule.errors += 1
+            return
+
+        schedule.errors = 0
+        if outcome.status is not None:
+            schedule.status = outcome.status
+        if outcome.changed:
+            schedule.last_change = now
+
+    def _delay(self, schedule, now):
+        if schedule.errors:
+            delay = self._backoff(schedule.errors)
+        elif schedule.status == 'reviewing':
+            delay = self.reviewing_interval
+        else:
+            idle = now - schedule.last_change
+            delay = self._backoff(max(int(idle // self.idle_after), 0))
+
+        delay = min(delay, self.max_interval)
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _backoff(self, steps):
+        # степень ограничена, чтобы не переполнять float
+        return self.base_interval * self.backoff_factor ** min(steps, 32)
@@ -0,0 +1,297 @@
+import asyncio
+from bisect import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+
+import metrics
+from storage import SqliteStore
+
+
+logger = logging.getLogger(__name__)
+
+SHARD_LEASES = metrics.registry.gauge(
+    'bot_shard_leases', 'Подписки, которые держит этот процесс'
+)
+SHARD_WORKERS = metrics.registry.gauge(
+    'bot_shard_workers', 'Живые процессы в кольце шардирования'
+)
+
+
+def default_worker_id():
+    """Имя процесса: хост и pid."""
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class HashRing:
+    """Кольцо консистентного хеширования с виртуальными узлами.
+
+    При добавлении или удалении узла меняют владельца только
+    ключи соседних с ним участков кольца.
+    """
+
+    def __init__(self, nodes=(), replicas=64):
+        """Инициализация переменных."""
+        self.replicas = replicas
+        self.nodes = frozenset(nodes)
+        points = sorted(
+            (self._hash(f'{node}#{replica}'), node)
+            for node in self.nodes for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    @staticmethod
+    def _hash(value):
+        digest = hashlib.md5(value.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big')
+
+    def owner(self, key):
+        """Узел, которому принадлежит ключ; None для пустого кольца."""
+        if not self._hashes:
+            return None
+        index = bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+class LeaseStore(SqliteStore):
+    """Живые процессы и аренды подписок в общем sqlite-файле.
+
+    Все изменения идут транзакциями BEGIN IMMEDIATE: sqlite
+    блокирует файл на запись, поэтому два процесса не могут
+    одновременно взять одну аренду. Время — time.time() процессов,
+    часы машин должны быть синхронизированы.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS shard_workers ('
+        ' worker_id TEXT PRIMARY KEY,'
+        ' heartbeat REAL NOT NULL'
+        ') WITHOUT ROWID',
+        'CREATE TABLE IF NOT EXISTS shard_leases ('
+        ' key TEXT PRIMARY KEY,'
+        ' worker_id TEXT NOT NULL,'
+        ' expires REAL NOT NULL'
+        ') WITHOUT ROWID',
+    )
+
+    def heartbeat(self, worker_id, now, ttl):
+        """Отмечаемся живыми и возвращаем всех живых процессов."""
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                connection.execute(
+                    'INSERT OR REPLACE INTO shard_workers '
+                    '(worker_id, heartbeat) VALUES (?, ?)',
+                    (worker_id, now)
+                )
+                connection.execute(
+                    'DELETE FROM shard_workers WHERE heartbeat < ?',
+                    (now - ttl,)
+                )
+                workers = [row[0] for row in connection.execute(
+                    'SELECT worker_id FROM shard_workers'
+                )]
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        return workers
+
+    def sync(self, worker_id, wanted, now, ttl):
+        """Продлеваем и берём аренды ключей wanted, отдаём остальные.
+
+        Чужая аренда берётся, только если она истекла.
+        Возвращаем ключи, которые после этого арендованы нами.
+        """
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                held = {row[0] for row in connection.execute(
+                    'SELECT key FROM shard_leases WHERE worker_id = ?',
+                    (worker_id,)
+                )}
+                connection.executemany(
+                    'DELETE FROM shard_leases '
+                    'WHERE key = ? AND worker_id = ?',
+                    [(key, worker_id) for key in held - wanted]
+                )
+                connection.executemany(
+                    'INSERT INTO shard_leases (key, worker_id, expires) '
+                    'VALUES (?, ?, ?) '
+                    'ON CONFLICT (key) DO UPDATE '
+                    'SET worker_id = excluded.worker_id, '
+                    'expires = excluded.expires '
+                    'WHERE shard_leases.worker_id = excluded.worker_id '
+                    'OR shard_leases.expires < ?',
+                    [(key, worker_id, now + ttl, now) for key in wanted]
+                )
+                leased = {row[0] for row in connection.execute(
+                    'SELECT key FROM shard_leases WHERE worker_id = ?',
+                    (worker_id,)
+                )}
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        return leased
+
+    def leave(self, worker_id):
+        """Снимаем все аренды процесса и убираем его из кольца."""
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'DELETE FROM shard_leases WHERE worker_id = ?', (worker_id,)
+            )
+            connection.execute(
+                'DELETE FROM shard_workers WHERE worker_id = ?', (worker_id,)
+            )
+            connection.execute('COMMIT')
+
+
+class ShardCoordinator:
+    """Решаем, какие подписки реестра опрашивает этот процесс.
+
+    Владелец подписки определяется кольцом консистентного хеширования
+    по живым процессам, а опрашивать её можно, только держа аренду
+    в LeaseStore. Раз в lease_ttl / 3 секунд процесс отмечается живым,
+    продлевает свои аренды и берёт свободные или истёкшие аренды
+    своих по кольцу подписок. Упавший процесс выпадает из кольца
+    через lease_ttl, и его аренды истекают.
+
+    Подписку, которая по кольцу стала чужой, процесс сразу перестаёт
+    опрашивать, а аренду отдаёт только в следующем цикле: за это время
+    успевают закончиться начатые опросы. Перед тем как отдать аренду,
+    вызывается on_release(keys), после получения новых — on_acquire(keys);
+    оба вызова идут в потоке refresh().
+
+    holds() отвечает «да», только пока до конца аренды остаётся больше
+    guard секунд, поэтому процесс, который не смог продлить аренду,
+    перестаёт опрашивать раньше, чем её сможет взять другой.
+    """
+
+    def __init__(self, store, registry, worker_id=None, lease_ttl=90,
+                 replicas=64, on_acquire=None, on_release=None,
+                 clock=time.time):
+        """Инициализация переменных."""
+        self.store = store
+        self.registry = registry
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_ttl = lease_ttl
+        self.guard = lease_ttl / 3
+        self.replicas = replicas
+        self.on_acquire = on_acquire
+        self.on_release = on_release
+        self.clock = clock
+        self.ring = HashRing(replicas=replicas)
+        self.leased = frozenset()
+        self.expires = 0.0
+        # уже не опрашиваем, но аренду ещё держим
+        self._draining = frozenset()
+        self._left = False
+        self._lock = threading.Lock()
+
+    def holds(self, key):
+        """Можно ли сейчас опрашивать подписку с ключом key."""
+        return key in self.leased and (
+            self.expires - self.clock() > self.guard
+        )
+
+    def refresh(self):
+        """Один цикл: отмечаемся, пересобираем кольцо, синхронизируем аренды.
+
+        Возвращаем (полученные ключи, отданные ключи).
+        """
+        with self._lock:
+            if self._left:
+                return frozenset(), frozenset()
+            return self._refresh()
+
+    def _refresh(self):
+        # срок аренды считаем от времени до записи: так он не позже
+        # того, что увидят другие процессы
+        now = self.clock()
+        workers = self.store.heartbeat(self.worker_id, now, self.lease_ttl)
+        if frozenset(workers) != self.ring.nodes:
+            logger.info('Процессы в кольце: %s', sorted(workers))
+            self.ring = HashRing(workers, self.replicas)
+        wanted = frozenset(
+            subscription.key for subscription in self.registry
+            if self.ring.owner(subscription.key) == self.worker_id
+        )
+
+        released = self._draining - wanted
+        self._draining = self.leased - wanted
+        self.leased &= wanted
+        if released and self.on_release is not None:
+            self.on_release(released)
+        leased = wanted & frozenset(self.store.sync(
+            self.worker_id, wanted | self._draining, now, self.lease_ttl
+        ))
+        acquired = leased - self.leased
+        if acquired and self.on_acquire is not None:
+            self.on_acquire(acquired)
+        self.leased = leased
+        self.expires = now + self.lease_ttl
+
+        SHARD_LEASES.set(len(leased))
+        SHARD_WORKERS.set(len(workers))
+        if acquired or released:
+            logger.info(
+                'Аренды: взяли %s, отдали %s, держим %s',
+                len(acquired), len(released), len(leased)
+            )
+        return acquired, released
+
+    async def run(self):
+        """Обновляем аренды, пока задачу не отменят."""
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.refresh)
+            except Exception:
+                logger.error('Не смогли обновить аренды', exc_info=True)
+            await asyncio.sleep(self.lease_ttl / 3)
+
+    def leave(self):
+        """Отдаём все аренды сразу; вызывается после остановки опроса."""
+        with self._lock:
+            self._left = True
+            released = self.leased | self._draining
+            self.leased = self._draining = frozenset()
+            if released and self.on_release is not None:
+                self.on_release(released)
+            self.store.leave(self.worker_id)
+        SHARD_LEASES.set(0)
+        logger.info('Отдали %s аренд', len(released))
+
+
+class ShardView:
+    """Подписки реестра, аренду которых держит этот процесс.
+
+    Передаётся в PollingEngine вместо реестра: движок запускает
+    задачи только для своих подписок и снимает задачи отданных.
+    """
+
+    def __init__(self, registry, coordinator):
+        """Инициализация переменных."""
+        self.registry = registry
+        self.coordinator = coordinator
+
+    def __iter__(self):
+        return (
+            subscription for subscription in self.registry
+            if self.coordinator.holds(subscription.key)
+        )
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, key):
+        return key in self.registry and self.coordinator.holds(key)
@@ -0,0 +1,47 @@
+import asyncio
+
+import metrics
+
+
+SINGLE_FLIGHT = metrics.registry.counter(
+    'bot_single_flight_total',
+    'Вызовы через single-flight: выполненные и присоединившиеся к идущим',
+    ('name', 'result')
+)
+
+
+class SingleFlight:
+    """Склеиваем одновременные вызовы с одинаковым ключом.
+
+    Пока вызов с ключом key выполняется, остальные do(key, ...) не
+    запускают свой, а ждут результат (или исключение) уже идущего.
+    Результат не кэшируется: следующий вызов после завершения
+    выполняется заново.
+    """
+
+    def __init__(self, name):
+        """Инициализация переменных."""
+        self.name = name
+        self._calls = {}
+
+    async def do(self, key, func):
+        """Результат корутины func() — своей или уже идущей для key."""
+        task = self._calls.get(key)
+        if task is None:
+            SINGLE_FLIGHT.inc(name=self.name, result='executed')
+            task = self._calls[key] = asyncio.ensure_future(
+                self._run(key, func)
+            )
+        else:
+            SINGLE_FLIGHT.inc(name=self.name, result='shared')
+        # отмена одного ожидающего не должна отменять общий вызов
+        return await asyncio.shield(task)
+
+    async def _run(self, key, func):
+        try:
+            return await func()
+        finally:
+            del self._calls[key]
+
+    def __contains__(self, key):
+        return key in self._calls
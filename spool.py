@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class MessageSpool:
+    """Журнал неотправленных сообщений на диске.
+
+    Файл только дописывается: строка {"id", "chat_id", "text"} добавляет
+    сообщение (с необязательным "kind" — видом сообщения), строка
+    {"ack": [id, ...]} подтверждает доставку.
+    При открытии журнал перечитывается, недописанная при падении
+    последняя строка пропускается. compact() переписывает файл,
+    оставляя только неподтверждённые сообщения.
+    """
+
+    def __init__(self, path, fsync=True, compact_every=1000):
+        """Инициализация переменных."""
+        self.path = path
+        self.fsync = fsync
+        self.compact_every = compact_every
+        self._pending = {}
+        self._next_id = 1
+        self._acked_since_compact = 0
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._terminate_torn_line()
+
+    def append(self, chat_id, text, kind=None):
+        """Записываем сообщение и возвращаем его id."""
+        return self.extend([chat_id], text, kind)[0]
+
+    def extend(self, chat_ids, text, kind=None):
+        """Записываем сообщение для нескольких чатов одним fsync.
+
+        Возвращаем id сообщений в порядке chat_ids.
+        """
+        with self._lock:
+            spool_ids = list(
+                range(self._next_id, self._next_id + len(chat_ids))
+            )
+            self._next_id += len(chat_ids)
+            self._write(*(
+                self._record(spool_id, chat_id, text, kind)
+                for spool_id, chat_id in zip(spool_ids, chat_ids)
+            ))
+            for spool_id, chat_id in zip(spool_ids, chat_ids):
+                self._pending[spool_id] = (chat_id, text, kind)
+        return spool_ids
+
+    def ack(self, spool_ids):
+        """Подтверждаем доставку сообщений."""
+        spool_ids = [
+            spool_id for spool_id in spool_ids if spool_id in self._pending
+        ]
+        if not spool_ids:
+            return
+        with self._lock:
+            self._write({'ack': spool_ids})
+            for spool_id in spool_ids:
+                self._pending.pop(spool_id, None)
+            self._acked_since_compact += len(spool_ids)
+
+    def pending(self):
+        """Неподтверждённые сообщения [(id, chat_id, text)] по порядку."""
+        with self._lock:
+            return [
+                (spool_id, chat_id, text)
+                for spool_id, (chat_id, text, _) in self._pending.items()
+            ]
+
+    def kind(self, spool_id):
+        """Вид неподтверждённого сообщения; None — обычное."""
+        with self._lock:
+            return self._pending[spool_id][2]
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def needs_compaction(self):
+        """Подтверждений накопилось достаточно, чтобы переписать файл."""
+        return self._acked_since_compact >= self.compact_every
+
+    def compact(self):
+        """Переписываем журнал, оставляя только неподтверждённые сообщения."""
+        with self._lock:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as tmp:
+                for spool_id, message in self._pending.items():
+                    tmp.write(self._dumps(self._record(spool_id, *message)))
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            self._file.close()
+            os.replace(tmp_path, self.path)
+            self._file = open(self.path, 'a', encoding='utf-8')
+            logger.info(
+                'Сжали журнал отправки: подтверждено %s, осталось %s',
+                self._acked_since_compact, len(self._pending)
+            )
+            self._acked_since_compact = 0
+
+    def close(self):
+        """Закрываем файл журнала."""
+        with self._lock:
+            self._file.close()
+
+    @staticmethod
+    def _record(spool_id, chat_id, text, kind):
+        record = {'id': spool_id, 'chat_id': chat_id, 'text': text}
+        if kind is not None:
+            record['kind'] = kind
+        return record
+
+    @staticmethod
+    def _dumps(record):
+        return json.dumps(record, ensure_ascii=False) + '\n'
+
+    def _write(self, *records):
+        self._file.write(''.join(self._dumps(record) for record in records))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _terminate_torn_line(self):
+        # после падения посреди записи файл может заканчиваться
+        # недописанной строкой: следующая запись должна начаться с новой
+        with open(self.path, 'rb') as file:
+            file.seek(0, os.SEEK_END)
+            if file.tell() == 0:
+                return
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) != b'\n':
+                self._file.write('\n')
+                self._file.flush()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding='utf-8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning('Пропустили повреждённую строку журнала')
+                    continue
+                if 'ack' in record:
+                    for spool_id in record['ack']:
+                        self._pending.pop(spool_id, None)
+                else:
+                    self._pending[record['id']] = (
+                        record['chat_id'], record['text'], record.get('kind')
+                    )
+                    self._next_id = max(self._next_id, record['id'] + 1)
+        if self._pending:
+            logger.info(
+                'В журнале отправки %s неотправленных сообщений',
+                len(self._pending)
+            )
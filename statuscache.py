@@ -0,0 +1,91 @@
+import time
+
+import metrics
+from records import HomeworkRecord
+from singleflight import SingleFlight
+
+
+STATUS_CACHE = metrics.registry.counter(
+    'bot_status_cache_total', 'Обращения к кэшу статусов', ('result',)
+)
+
+
+def homework_id(homework):
+    """Ключ работы: id, а если его нет — имя."""
+    return str(homework.get('id', homework.get('homework_name')))
+
+
+class StatusCache:
+    """Последние известные работы пользователей.
+
+    Полный список работ загружается один раз через get(), дальше
+    обычные опросы вливают в него изменившиеся работы через update()
+    и тем самым продлевают запись. Запись старше ttl секунд считается
+    устаревшей, и get() загружает список заново; одновременные get()
+    одного ключа ждут одну и ту же загрузку.
+
+    Работы хранятся как HomeworkRecord: кэш живёт весь срок процесса,
+    и полные dict из api-ответов были бы основной частью его памяти.
+    """
+
+    def __init__(self, ttl, clock=time.monotonic):
+        """Инициализация переменных."""
+        self.ttl = ttl
+        self.clock = clock
+        # ключ -> [{id работы: работа}, время обновления]
+        self._entries = {}
+        self._flight = SingleFlight('status_cache')
+
+    def update(self, key, homeworks):
+        """Вливаем работы из ответа опроса.
+
+        Пустой ответ тоже продлевает запись: с прошлого опроса
+        ничего не изменилось. Для ключа без полной загрузки
+        запись не создаётся.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return
+        for homework in homeworks:
+            entry[0][homework_id(homework)] = HomeworkRecord.from_api(
+                homework
+            )
+        entry[1] = self.clock()
+
+    def replace(self, key, homeworks):
+        """Записываем полный список работ."""
+        self._entries[key] = [
+            {
+                homework_id(homework): HomeworkRecord.from_api(homework)
+                for homework in homeworks
+            },
+            self.clock()
+        ]
+
+    def fresh(self, key):
+        """Работы ключа, если запись не устарела, иначе None."""
+        entry = self._entries.get(key)
+        if entry is None or self.clock() - entry[1] > self.ttl:
+            return None
+        return list(entry[0].values())
+
+    def forget(self, key):
+        """Удаляем запись ключа."""
+        self._entries.pop(key, None)
+
+    async def get(self, key, fetch):
+        """Работы ключа; устаревшую запись загружаем корутиной fetch()."""
+        homeworks = self.fresh(key)
+        if homeworks is not None:
+            STATUS_CACHE.inc(result='hit')
+            return homeworks
+
+        STATUS_CACHE.inc(result='miss')
+        return await self._flight.do(key, lambda: self._load(key, fetch))
+
+    async def _load(self, key, fetch):
+        self.replace(key, await fetch())
+        return list(self._entries[key][0].values())
+
+    def __len__(self):
+        return len(self._entries)
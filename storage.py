@@ -0,0 +1,252 @@
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+def _intern(value):
+    # статусов несколько, а строк с ними — по одной на работу
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def snapshot(path):
+    """Копия базы во временном файле; если базы нет — пустой файл.
+
+    Копия делается через backup api sqlite,
+    поэтому в неё попадает и содержимое WAL.
+    """
+    descriptor, target = tempfile.mkstemp(suffix='.sqlite3')
+    os.close(descriptor)
+    if os.path.exists(path):
+        source = sqlite3.connect(path)
+        copy = sqlite3.connect(target)
+        try:
+            source.backup(copy)
+        finally:
+            copy.close()
+            source.close()
+    return target
+
+
+def remove_snapshot(path):
+    """Удаляем копию базы вместе с файлами WAL."""
+    for suffix in ('', '-wal', '-shm'):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+class SqliteStore:
+    """Базовый класс хранилищ в одном sqlite-файле.
+
+    Соединение открывается лениво при первом обращении и разделяется
+    потоками опроса под общей блокировкой.
+    """
+
+    schema = ()
+
+    def __init__(self, path):
+        """Инициализация переменных."""
+        self.path = path
+        self._connection = None
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self):
+        """Открытое соединение с базой."""
+        if self._connection is None:
+            connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            # WAL переживает падение процесса посреди записи
+            # и не блокирует чтение во время коммита
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in self.schema:
+                connection.execute(statement)
+            self._connection = connection
+            logger.debug('Открыли хранилище %s', self.path)
+        return self._connection
+
+    def close(self):
+        """Закрываем соединение."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class CursorStore(SqliteStore):
+    """Курсоры from_date пользователей.
+
+    Курсор только растёт: значение меньше сохранённого игнорируется.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS cursors ('
+        ' tenant_key TEXT PRIMARY KEY,'
+        ' from_date INTEGER NOT NULL'
+        ') WITHOUT ROWID',
+    )
+
+    def get(self, tenant_key):
+        """Сохранённый курсор пользователя или None."""
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT from_date FROM cursors WHERE tenant_key = ?',
+                (tenant_key,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def advance(self, tenant_key, from_date):
+        """Сдвигаем курсор вперёд."""
+        with self._lock:
+            self.connection.execute(
+                'INSERT INTO cursors (tenant_key, from_date) VALUES (?, ?) '
+                'ON CONFLICT (tenant_key) DO UPDATE '
+                'SET from_date = excluded.from_date '
+                'WHERE excluded.from_date > cursors.from_date',
+                (tenant_key, from_date)
+            )
+
+
+class StateStore(SqliteStore):
+    """Последний известный статус каждой домашней работы пользователя.
+
+    Чтение и запись идут через словарь в памяти, куда при первом
+    обращении загружаются строки пользователя. Изменения копятся и
+    записываются одной транзакцией, когда их набирается batch_size
+    или с прошлой записи прошло flush_interval секунд.
+    """
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS homework_state ('
+        ' tenant_key TEXT NOT NULL,'
+        ' homework_id TEXT NOT NULL,'
+        ' status TEXT,'
+        ' date_updated TEXT,'
+        ' PRIMARY KEY (tenant_key, homework_id)'
+        ') WITHOUT ROWID',
+    )
+
+    def __init__(self, path, batch_size=100, flush_interval=5):
+        """Инициализация переменных."""
+        super().__init__(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._cache = {}
+        self._loaded_tenants = set()
+        # None в значении — запись нужно удалить
+        self._dirty = {}
+        self._last_flush = time.monotonic()
+
+    def get(self, tenant_key, homework_id):
+        """Сохранённые (status, date_updated) работы или None."""
+        with self._lock:
+            self._load(tenant_key)
+            self._flush_if_due()
+            return self._cache.get((tenant_key, homework_id))
+
+    def put(self, tenant_key, homework_id, status, date_updated=None):
+        """Запоминаем статус работы."""
+        key = (tenant_key, homework_id)
+        status = _intern(status)
+        with self._lock:
+            self._load(tenant_key)
+            self._cache[key] = (status, date_updated)
+            self._dirty[key] = (status, date_updated)
+            self._flush_if_due()
+
+    def discard(self, tenant_key, homework_id):
+        """Забываем статус работы."""
+        key = (tenant_key, homework_id)
+        with self._lock:
+            self._load(tenant_key)
+            if self._cache.pop(key, None) is not None:
+                self._dirty[key] = None
+                self._flush_if_due()
+
+    def flush(self):
+        """Записываем накопленные изменения одной транзакцией."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._dirty:
+                return
+
+            upserts = [
+                (tenant_key, homework_id, *value)
+                for (tenant_key, homework_id), value in self._dirty.items()
+                if value is not None
+            ]
+            deletes = [
+                key for key, value in self._dirty.items() if value is None
+            ]
+            connection = self.connection
+            connection.execute('BEGIN')
+            try:
+                connection.executemany(
+                    'INSERT OR REPLACE INTO homework_state '
+                    '(tenant_key, homework_id, status, date_updated) '
+                    'VALUES (?, ?, ?, ?)',
+                    upserts
+                )
+                connection.executemany(
+                    'DELETE FROM homework_state '
+                    'WHERE tenant_key = ? AND homework_id = ?',
+                    deletes
+                )
+            except sqlite3.Error:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+            logger.debug('Записали %s изменений состояния', len(self._dirty))
+            self._dirty.clear()
+
+    def evict(self, tenant_keys):
+        """Записываем изменения и выгружаем строки пользователей из памяти.
+
+        Следующее обращение заново прочитает их из базы, в которую
+        тем временем мог писать другой процесс.
+        """
+        tenant_keys = set(tenant_keys)
+        with self._lock:
+            self.flush()
+            for key in [
+                key for key in self._cache if key[0] in tenant_keys
+            ]:
+                del self._cache[key]
+            self._loaded_tenants -= tenant_keys
+
+    def close(self):
+        """Записываем изменения и закрываем соединение."""
+        with self._lock:
+            if self._connection is not None or self._dirty:
+                self.flush()
+            super().close()
+
+    def _load(self, tenant_key):
+        if tenant_key in self._loaded_tenants:
+            return
+        rows = self.connection.execute(
+            'SELECT homework_id, status, date_updated FROM homework_state '
+            'WHERE tenant_key = ?',
+            (tenant_key,)
+        )
+        for homework_id, status, date_updated in rows:
+            self._cache[(tenant_key, homework_id)] = (
+                _intern(status), date_updated
+            )
+        self._loaded_tenants.add(tenant_key)
+
+    def _flush_if_due(self):
+        if len(self._dirty) >= self.batch_size or (
+            time.monotonic() - self._last_flush >= self.flush_interval
+        ):
+            self.flush()
@@ -0,0 +1,100 @@
+"""Память кэша статусов в байтах на пользователя.
+
+Файл не собирается обычным запуском pytest (python_files = test_*.py).
+Проверка, что записи HomeworkRecord заметно компактнее dict из api:
+
+    python -m pytest tests/bench_memory.py
+
+Таблица замеров:
+
+    python tests/bench_memory.py
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+
+from records import Status  # noqa: E402
+from statuscache import StatusCache, homework_id  # noqa: E402
+
+TENANTS = 1000
+HOMEWORKS = (1, 10, 30)
+# записи должны занимать не больше этой доли от dict из api
+MAX_RATIO = 0.6
+
+
+def api_payload(tenant, size):
+    """Тело api-ответа на size работ, как отдаёт Практикум."""
+    return json.dumps({'homeworks': [
+        {
+            'id': tenant * 100 + index,
+            'status': str(list(Status)[index % len(Status)]),
+            'homework_name': f'student{tenant}__hw{index:02}.zip',
+            'reviewer_comment': 'Всё хорошо, но есть пара замечаний.',
+            'date_updated': time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(2_000_000_000 - index * 60)
+            ),
+            'lesson_name': 'Итоговый проект',
+        }
+        for index in range(size)
+    ], 'current_date': 2_000_000_000})
+
+
+def measure(build, size):
+    """Байты на пользователя, которые держит результат build()."""
+    payloads = [api_payload(tenant, size) for tenant in range(TENANTS)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    kept = build(payloads)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del kept
+    return used / TENANTS
+
+
+def raw_dicts(payloads):
+    """Как раньше: кэш хранит dict из api-ответа целиком."""
+    return {
+        tenant: {
+            homework_id(homework): homework
+            for homework in json.loads(payload)['homeworks']
+        }
+        for tenant, payload in enumerate(payloads)
+    }
+
+
+def records(payloads):
+    """Кэш статусов с записями HomeworkRecord."""
+    cache = StatusCache(ttl=60)
+    for tenant, payload in enumerate(payloads):
+        cache.replace(tenant, json.loads(payload)['homeworks'])
+    return cache
+
+
+def run():
+    """Замеры {число работ: (dict, записи)} в байтах на пользователя."""
+    return {
+        size: (measure(raw_dicts, size), measure(records, size))
+        for size in HOMEWORKS
+    }
+
+
+class TestMemory:
+
+    def test_records_are_compact(self):
+        for size, (raw, compact) in run().items():
+            assert compact <= raw * MAX_RATIO, (
+                f'{size} работ: записи занимают {compact:.0f} байт '
+                f'на пользователя против {raw:.0f} у dict'
+            )
+
+
+if __name__ == '__main__':
+    print(f'{"работ":>6} {"dict, Б":>10} {"записи, Б":>10} {"доля":>6}')
+    for size, (raw, compact) in run().items():
+        print(f'{size:>6} {raw:>10.0f} {compact:>10.0f} {compact / raw:>6.2f}')
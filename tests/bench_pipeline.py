@@ -0,0 +1,248 @@
+"""Микробенчмарки чистых функций конвейера опроса.
+
+Файл не собирается обычным запуском pytest (python_files = test_*.py).
+Проверка регрессий против сохранённых базовых значений:
+
+    python -m pytest tests/bench_pipeline.py
+
+Таблица замеров и обновление базовых значений:
+
+    python tests/bench_pipeline.py
+    python tests/bench_pipeline.py --update-baseline
+
+Время каждого замера делится на время эталонной нагрузки на той же
+машине, поэтому базовые значения переносимы между машинами. Эталон
+мерится вперемешку с замером в BENCH_ROUNDS раундах, в зачёт идёт
+медиана отношений: так частота процессора и соседние процессы меньше
+сдвигают результат. Замер падает, если стал медленнее базового больше
+чем в BENCH_THRESHOLD раз; для замеров в микросекунды, где заметнее
+шум таймера, порог BENCH_FAST_THRESHOLD.
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import timeit
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.append(ROOT_DIR)
+# на DEBUG замер мерил бы логирование, а не конвейер
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from engine import Tenant  # noqa: E402
+import homework  # noqa: E402
+import logconfig  # noqa: E402
+import storage  # noqa: E402
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'fixtures', 'bench_baseline.json'
+)
+THRESHOLD = float(os.getenv('BENCH_THRESHOLD', 1.5))
+FAST_THRESHOLD = float(os.getenv('BENCH_FAST_THRESHOLD', 2.0))
+# замеры короче этой доли эталона считаются быстрыми
+FAST_RATIO = 0.1
+ROUNDS = int(os.getenv('BENCH_ROUNDS', 7))
+SIZES = (1, 100, 10000)
+TENANT = Tenant('bench-token', 1)
+TENANT_KEY = TENANT.key
+STATUSES = tuple(homework.HOMEWORK_STATUSES)
+
+
+def make_homeworks(size):
+    """Api-ответ на size работ, от новых к старым, как отдаёт Практикум."""
+    return [
+        {
+            'id': size - index,
+            'status': STATUSES[index % len(STATUSES)],
+            'homework_name': f'student__hw{size - index:05}.zip',
+            'reviewer_comment': 'Всё хорошо, но есть пара замечаний.',
+            'date_updated': time.strftime(
+                '%Y-%m-%dT%H:%M:%SZ', time.gmtime(2_000_000_000 - index * 60)
+            ),
+            'lesson_name': 'Итоговый проект',
+        }
+        for index in range(size)
+    ]
+
+
+def warm_state(homeworks, stack):
+    """Хранилище, где уже лежит текущее состояние всех работ.
+
+    На время замера хранилище подменяет homework.state_store; stack
+    возвращает прежнее и удаляет временную базу.
+    """
+    directory = stack.enter_context(
+        tempfile.TemporaryDirectory(prefix='bench-')
+    )
+    state_store = storage.StateStore(
+        os.path.join(directory, 'state.sqlite3'), batch_size=10 ** 6
+    )
+    stack.callback(state_store.close)
+    for hw in homeworks:
+        state_store.put(
+            TENANT_KEY, str(hw['id']), hw['status'], hw['date_updated']
+        )
+    state_store.flush()
+    stack.callback(setattr, homework, 'state_store', homework.state_store)
+    homework.state_store = state_store
+    return state_store
+
+
+def bench_check_response(size, stack):
+    response = {'homeworks': make_homeworks(size), 'current_date': 1}
+    return lambda: homework.check_response(response)
+
+
+def bench_parse_status(size, stack):
+    homeworks = make_homeworks(size)
+    return lambda: [homework.parse_status(hw) for hw in homeworks]
+
+
+def bench_state_lookup(size, stack):
+    homeworks = make_homeworks(size)
+    state_store = warm_state(homeworks, stack)
+    keys = [str(hw['id']) for hw in homeworks]
+    return lambda: [state_store.get(TENANT_KEY, key) for key in keys]
+
+
+def bench_comparing(size, stack):
+    homeworks = make_homeworks(size)
+    warm_state(homeworks, stack)
+    compares = [
+        homework.CompareMessages('', TENANT_KEY, hw) for hw in homeworks
+    ]
+    return lambda: [compare.comparing() for compare in compares]
+
+
+def bench_diff_homeworks(size, stack):
+    # установившийся режим: статусы не менялись, сообщений нет
+    homeworks = make_homeworks(size)
+    warm_state(homeworks, stack)
+    return lambda: list(homework.diff_homeworks([TENANT], homeworks))
+
+
+BENCHMARKS = {
+    'check_response': bench_check_response,
+    'parse_status': bench_parse_status,
+    'state_lookup': bench_state_lookup,
+    'comparing': bench_comparing,
+    'diff_homeworks': bench_diff_homeworks,
+}
+
+
+def calibration():
+    """Эталонная нагрузка на чистом python: мерило скорости машины."""
+    data = [{'key': str(index), 'value': index} for index in range(1000)]
+    return lambda: sorted(
+        (f'{item["key"]}:{item["value"]}' for item in data), reverse=True
+    )
+
+
+class Timer:
+    """Время одного вызова func в серии на ~0.05 секунды."""
+
+    def __init__(self, func):
+        """Инициализация переменных."""
+        self.timer = timeit.Timer(func)
+        # autorange подбирает серию не короче 0.2 секунды
+        self.number = max(self.timer.autorange()[0] // 4, 1)
+
+    def __call__(self):
+        return self.timer.timeit(self.number) / self.number
+
+
+def measure(func, reference, rounds=ROUNDS):
+    """Медиана отношения времени func к эталону за rounds раундов.
+
+    В каждом раунде эталон мерится прямо перед func, лучшая из двух
+    серий func сглаживает случайные паузы.
+    """
+    timer = Timer(func)
+    ratios = [
+        min(timer(), timer()) / reference() for _ in range(rounds)
+    ]
+    return statistics.median(ratios)
+
+
+def run_all():
+    """Замеры всех бенчмарков: {имя[размер]: время / эталон}."""
+    logconfig.set_log_level('WARNING')
+    reference = Timer(calibration())
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        for size in SIZES:
+            with contextlib.ExitStack() as stack:
+                results[f'{name}[{size}]'] = measure(
+                    setup(size, stack), reference
+                )
+    return reference(), results
+
+
+def load_baseline():
+    """Сохранённые базовые значения или None."""
+    if not os.path.exists(BASELINE_PATH):
+        return None
+    with open(BASELINE_PATH, encoding='utf-8') as file:
+        return json.load(file)['results']
+
+
+@pytest.fixture(scope='module')
+def bench_results():
+    return run_all()[1]
+
+
+class TestBenchPipeline:
+
+    @pytest.mark.parametrize('case', [
+        f'{name}[{size}]' for name in BENCHMARKS for size in SIZES
+    ])
+    def test_no_regression(self, bench_results, case):
+        baseline = load_baseline()
+        if baseline is None or case not in baseline:
+            pytest.skip('Нет базового значения: запустите --update-baseline')
+        ratio = bench_results[case] / baseline[case]
+        threshold = (
+            FAST_THRESHOLD if baseline[case] < FAST_RATIO else THRESHOLD
+        )
+        assert ratio <= threshold, (
+            f'{case} стал медленнее базового в {ratio:.2f} раза '
+            f'(порог {threshold})'
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--update-baseline', action='store_true',
+        help='записать текущие замеры как базовые значения'
+    )
+    args = parser.parse_args()
+
+    reference, results = run_all()
+    baseline = load_baseline() or {}
+    print(f'эталон: {reference * 1e6:.1f} мкс')
+    print(f'{"замер":<24}{"мкс":>12}{"эталонов":>12}{"к базе":>10}')
+    for case, ratio in results.items():
+        against = (
+            f'{ratio / baseline[case]:.2f}' if case in baseline else '-'
+        )
+        print(f'{case:<24}{ratio * reference * 1e6:>12.1f}'
+              f'{ratio:>12.3f}{against:>10}')
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as file:
+            json.dump({'results': results}, file, indent=2, sort_keys=True)
+            file.write('\n')
+        print(f'Базовые значения записаны в {BASELINE_PATH}')
+
+
+if __name__ == '__main__':
+    main()
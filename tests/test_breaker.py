@@ -0,0 +1,52 @@
+from breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from utils import FakeClock
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_failures_and_probes_once(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            'test', failure_threshold=3, recovery_timeout=60, clock=clock
+        )
+        for _ in range(3):
+            assert breaker.allow()
+            breaker.record_failure()
+        assert breaker.state == OPEN
+        assert not breaker.allow(), (
+            'Разомкнутый предохранитель не должен пропускать запросы'
+        )
+
+        clock.now = 60
+        assert breaker.allow() and breaker.state == HALF_OPEN
+        assert not breaker.allow(), (
+            'Пока идёт пробный запрос, остальные должны отклоняться'
+        )
+        breaker.record_success()
+        assert breaker.state == CLOSED and breaker.allow()
+
+    def test_failed_probe_reopens(self):
+        clock = FakeClock()
+        breaker = CircuitBreaker(
+            'test', failure_threshold=1, recovery_timeout=60, clock=clock
+        )
+        breaker.record_failure()
+        clock.now = 60
+        assert breaker.allow()
+        breaker.record_failure()
+
+        clock.now = 100
+        assert not breaker.allow(), (
+            'Неудачная проба должна размыкать предохранитель заново'
+        )
+        clock.now = 120
+        assert breaker.allow()
+
+    def test_success_resets_failure_count(self):
+        breaker = CircuitBreaker('test', failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CLOSED, (
+            'Размыкать должны только неудачи подряд'
+        )
@@ -0,0 +1,63 @@
+import json
+
+from capture import CaptureRecorder, read_capture, replay
+from utils import FakeClock
+
+
+def exchange(ts, status=200, body='{}'):
+    return {'ts': ts, 'ms': 10.0, 'tenant': 't', 'params': {},
+            'status': status, 'body': body, 'error': None}
+
+
+class TestCapture:
+
+    def test_recorder_redacts_and_appends(self, tmp_path):
+        path = tmp_path / 'api.capture'
+        recorder = CaptureRecorder(str(path), secrets=('s3cret',))
+        recorder.record(
+            'tenant', {'from_date': 1}, 100.0, 0.25, status=200,
+            body='{"comment": "токен s3cret, OAuth abc"}'
+        )
+        recorder.close()
+        CaptureRecorder(str(path)).record('tenant', {}, 101.0, 0.5,
+                                          error='ConnectTimeout')
+        with open(path, 'a', encoding='utf-8') as capture:
+            capture.write('{"ts": 102')
+
+        text = path.read_text(encoding='utf-8')
+        assert 's3cret' not in text and 'abc' not in text, (
+            'Токены не должны попадать в файл захвата'
+        )
+        exchanges = list(read_capture(str(path)))
+        assert [item['ts'] for item in exchanges] == [100.0, 101.0], (
+            'Файл захвата дописывается, недописанная строка пропускается'
+        )
+        assert exchanges[0]['ms'] == 250.0
+        assert json.loads(exchanges[0]['body'])['comment'] == (
+            'токен ***, OAuth ***'
+        )
+        assert exchanges[1]['status'] is None
+
+    def test_replay_counts_errors_and_keeps_pace(self):
+        clock = FakeClock()
+        handled = []
+
+        def handle(item):
+            handled.append((item['ts'], clock.now))
+            if item['status'] != 200:
+                raise ValueError(item['status'])
+
+        exchanges = [exchange(100), exchange(110, 500), exchange(130)]
+        report = replay(exchanges, handle, speed=10,
+                        clock=clock, sleep=clock.sleep)
+        assert [at for _, at in handled] == [0, 1, 3], (
+            'Паузы между обменами должны сокращаться в speed раз'
+        )
+        assert report['exchanges'] == 3
+        assert report['errors'] == {'ValueError': 1}, (
+            'Ошибка обработки не должна останавливать прогон'
+        )
+
+        clock.now = 0
+        replay(exchanges, handle, clock=clock, sleep=clock.sleep)
+        assert clock.now == 0, 'Без speed прогон идёт без пауз'
@@ -0,0 +1,186 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from engine import token_digest
+import loadsim
+import storage
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKENS = ['cli-0', 'cli-1', 'cli-2']
+
+
+@pytest.fixture
+def servers():
+    practicum = loadsim.FakePracticum(
+        TOKENS, change_interval=3600, faults=loadsim.FaultProfile()
+    )
+    practicum.phases = {token: 0 for token in TOKENS}
+    telegram_api = loadsim.FakeTelegram(loadsim.FaultProfile())
+    practicum.start()
+    telegram_api.start()
+    yield practicum, telegram_api
+    practicum.stop()
+    telegram_api.stop()
+
+
+def cli_env(servers, tmp_path, unset=()):
+    practicum, telegram_api = servers
+    env = {
+        **os.environ,
+        'PRACTICUM_TOKEN': TOKENS[0],
+        'TELEGRAM_TOKEN': loadsim.SIM_TELEGRAM_TOKEN,
+        'TELEGRAM_CHAT_ID': '100',
+        'PRACTICUM_ENDPOINT': practicum.url + '/api/',
+        'TELEGRAM_BASE_URL': telegram_api.url + '/bot',
+        'STATE_DB_PATH': str(tmp_path / 'state.sqlite3'),
+        'SPOOL_PATH': str(tmp_path / 'outbox.spool'),
+        'LOG_LEVEL': 'WARNING',
+    }
+    for name in unset:
+        env.pop(name, None)
+    return env
+
+
+def run_cli(servers, tmp_path, *args, unset=()):
+    return subprocess.run(
+        [sys.executable, 'homework.py', *args],
+        cwd=ROOT_DIR, env=cli_env(servers, tmp_path, unset),
+        capture_output=True, text=True, timeout=60
+    )
+
+
+class TestCli:
+
+    def test_once_polls_tenants_file_and_exits(self, servers, tmp_path):
+        practicum, telegram_api = servers
+        tenants_file = tmp_path / 'tenants.json'
+        tenants_file.write_text(json.dumps([
+            {'practicum_token': token, 'chat_id': 200 + index}
+            for index, token in enumerate(TOKENS[1:])
+        ]))
+        cursors = storage.CursorStore(str(tmp_path / 'state.sqlite3'))
+        for token in TOKENS:
+            cursors.advance(token_digest(token), int(practicum.started) - 1)
+        cursors.close()
+
+        dry_run = run_cli(
+            servers, tmp_path, '--once', '--dry-run',
+            '--tenants', str(tenants_file)
+        )
+        assert dry_run.returncode == 0, dry_run.stderr
+        assert practicum.requests == 3 and not telegram_api.received, (
+            '--dry-run должен опросить api, но ничего не отправлять'
+        )
+
+        result = run_cli(
+            servers, tmp_path, '--once', '--tenants', str(tenants_file)
+        )
+        assert result.returncode == 0, result.stderr
+        assert sorted(chat for chat, _, _ in telegram_api.received) == [
+            100, 200, 201
+        ], (
+            '--once должен за один проход опросить все подписки '
+            'и отправить изменения, которые --dry-run не сохранил'
+        )
+
+        run_cli(servers, tmp_path, '--once', '--tenants', str(tenants_file))
+        assert len(telegram_api.received) == 3, (
+            'Состояние после --once должно сохраняться между запусками'
+        )
+
+    def test_tenants_file_without_env_tenant(self, servers, tmp_path):
+        practicum, telegram_api = servers
+        tenants_file = tmp_path / 'tenants.json'
+        tenants_file.write_text(json.dumps([
+            {'practicum_token': TOKENS[1], 'chat_id': 200}
+        ]))
+        cursors = storage.CursorStore(str(tmp_path / 'state.sqlite3'))
+        cursors.advance(token_digest(TOKENS[1]), int(practicum.started) - 1)
+        cursors.close()
+
+        result = run_cli(
+            servers, tmp_path, '--once', '--tenants', str(tenants_file),
+            unset=('PRACTICUM_TOKEN', 'TELEGRAM_CHAT_ID')
+        )
+        assert result.returncode == 0, (
+            'С файлом подписок PRACTICUM_TOKEN и TELEGRAM_CHAT_ID '
+            'не обязательны: ' + result.stderr
+        )
+        assert practicum.requests == 1 and [
+            chat for chat, _, _ in telegram_api.received
+        ] == [200], 'Опрашиваться должны только подписки из файла'
+
+        result = run_cli(
+            servers, tmp_path, '--once', '--tenants', str(tenants_file),
+            unset=('TELEGRAM_TOKEN',)
+        )
+        assert result.returncode == 1, 'TELEGRAM_TOKEN обязателен всегда'
+
+    def test_resident_dry_run_keeps_polling(self, servers, tmp_path):
+        practicum, telegram_api = servers
+        tenants_file = tmp_path / 'tenants.json'
+        tenants_file.write_text(json.dumps([
+            {'practicum_token': token, 'chat_id': 200 + index}
+            for index, token in enumerate(TOKENS[1:])
+        ]))
+        process = subprocess.Popen(
+            [sys.executable, 'homework.py', '--dry-run',
+             '--tenants', str(tenants_file)],
+            cwd=ROOT_DIR,
+            # первые опросы разносятся по RETRY_TIME
+            env={**cli_env(servers, tmp_path), 'RETRY_TIME': '3'},
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        try:
+            deadline = time.monotonic() + 30
+            while practicum.requests < 3 and time.monotonic() < deadline:
+                time.sleep(0.1)
+            time.sleep(1)
+            assert process.poll() is None, (
+                'Без --once --dry-run должен работать до сигнала'
+            )
+            assert practicum.requests >= 3, (
+                'Должны быть опрошены все подписки'
+            )
+            process.send_signal(signal.SIGTERM)
+            _, stderr = process.communicate(timeout=30)
+        finally:
+            process.kill()
+        assert process.returncode == 0, stderr
+        assert not telegram_api.received, '--dry-run ничего не отправляет'
+
+    def test_sharded_workers_get_own_files(self, servers, tmp_path):
+        env = {
+            **cli_env(servers, tmp_path, unset=('SPOOL_PATH',)),
+            'SHARD_DB_PATH': str(tmp_path / 'shards.sqlite3'),
+        }
+        result = subprocess.run(
+            [sys.executable, 'homework.py'],
+            cwd=ROOT_DIR, env=env, capture_output=True, text=True, timeout=60
+        )
+        assert result.returncode == 1, (
+            'С SHARD_DB_PATH без WORKER_ID бот не должен запускаться'
+        )
+
+        settings = subprocess.run(
+            [sys.executable, '-c', (
+                'import homework; print(homework.SPOOL_PATH, '
+                'homework.PROFILE_PATH, homework.TELEGRAM_COMMANDS)'
+            )],
+            cwd=ROOT_DIR, env={**env, 'WORKER_ID': 'w1'},
+            capture_output=True, text=True, timeout=60
+        )
+        spool_path, profile_path, commands = settings.stdout.split()
+        assert spool_path.endswith('homework.py.w1.spool') and (
+            profile_path.endswith('homework.py.w1.profile')
+        ), 'У воркера шардирования должны быть свои файлы'
+        assert commands == 'False', (
+            'С шардированием команды по умолчанию выключены'
+        )
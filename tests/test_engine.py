@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import engine
+
+
+class TestEngine:
+
+    def test_registry_add_is_idempotent(self):
+        registry = engine.TenantRegistry()
+        first = registry.add('token', 1)
+        second = registry.add('token', 1)
+        registry.add('token', 2)
+
+        assert first is second, (
+            'Повторное добавление пользователя должно возвращать '
+            'уже зарегистрированный объект'
+        )
+        assert len(registry) == 1, (
+            'Чаты одного токена должны попадать в одну подписку'
+        )
+        subscription = registry.get(engine.token_digest('token'))
+        assert sorted(subscription.chat_ids) == [1, 2]
+        assert 'token' not in first.key, (
+            'Ключ пользователя не должен содержать токен в открытом виде'
+        )
+
+    def test_registry_normalizes_chat_ids(self):
+        registry = engine.TenantRegistry()
+        registry.add('token', '100')
+        registry.add('token', 100)
+        registry.add('token', '@channel')
+
+        subscription = registry.get(engine.token_digest('token'))
+        assert sorted(map(str, subscription.chat_ids)) == [
+            '100', '@channel'
+        ]
+        assert 100 in subscription.chat_ids, (
+            'Числовой id чата из переменной окружения должен стать int'
+        )
+
+    def test_registry_load(self, tmp_path):
+        path = tmp_path / 'tenants.json'
+        path.write_text(json.dumps([
+            {'practicum_token': 'a', 'chat_id': 1},
+            {'practicum_token': 'b', 'chat_id': 2},
+        ]))
+
+        registry = engine.TenantRegistry()
+        registry.load(path)
+
+        assert len(registry) == 2, (
+            'Проверьте загрузку пользователей из json-файла'
+        )
+
+    def test_engine_polls_all_tenants_with_bounded_concurrency(self):
+        registry = engine.TenantRegistry()
+        for index in range(20):
+            registry.add(f'token-{index}', index)
+
+        polled = set()
+        running = 0
+        max_running = 0
+
+        async def handler(tenant):
+            nonlocal running, max_running
+            running += 1
+            max_running = max(max_running, running)
+            await asyncio.sleep(0.01)
+            polled.update(tenant.chat_ids)
+            running -= 1
+
+        polling = engine.PollingEngine(
+            registry, handler, interval=0.05, concurrency=5
+        )
+
+        async def run_for_a_while():
+            task = asyncio.create_task(polling.run())
+            await asyncio.sleep(0.2)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        asyncio.run(run_for_a_while())
+
+        assert polled == set(range(20)), (
+            'Движок должен опросить всех пользователей реестра'
+        )
+        assert max_running <= 5, (
+            'Движок не должен превышать ограничение конкурентности'
+        )
+
+    def test_registry_remove_chat(self):
+        registry = engine.TenantRegistry()
+        first = registry.add('token', 1)
+        second = registry.add('token', 2)
+
+        registry.remove(first.key)
+        assert len(registry) == 1, (
+            'Подписка с оставшимися чатами не должна удаляться'
+        )
+        registry.remove(second.key)
+        assert len(registry) == 0, (
+            'Подписка без чатов должна удаляться из реестра'
+        )
+
+    def test_engine_survives_handler_error(self):
+        registry = engine.TenantRegistry()
+        registry.add('token', 1)
+        tenant = registry.get(engine.token_digest('token'))
+
+        async def handler(tenant):
+            raise RuntimeError('boom')
+
+        polling = engine.PollingEngine(registry, handler, interval=1)
+        asyncio.run(polling.poll_once(tenant))
+
+    def test_stop_lets_running_polls_finish(self):
+        registry = engine.TenantRegistry()
+        for index in range(3):
+            registry.add(f'token-{index}', index)
+        finished = []
+
+        async def handler(subscription):
+            await asyncio.sleep(0.1)
+            finished.append(subscription.key)
+
+        polling = engine.PollingEngine(
+            registry, handler, interval=10, concurrency=1
+        )
+
+        async def run_and_stop():
+            task = asyncio.create_task(polling.run())
+            await asyncio.sleep(0.05)
+            started = asyncio.get_running_loop().time()
+            polling.stop()
+            await asyncio.wait_for(task, 1)
+            return asyncio.get_running_loop().time() - started
+
+        elapsed = asyncio.run(run_and_stop())
+        assert len(finished) == 1, (
+            'Идущий опрос должен доработать, а ждущие — не начинаться'
+        )
+        assert elapsed < 0.5, (
+            'После stop() движок не должен ждать следующих интервалов'
+        )
@@ -0,0 +1,63 @@
+from errordigest import ErrorDigest
+from utils import FakeClock
+
+
+class TestErrorDigest:
+
+    def test_window_collects_errors_until_closed(self):
+        clock = FakeClock(1000.0)
+        digest = ErrorDigest(window=600, clock=clock)
+        digest.add('a', 'Ответ api не dict', ['chat'])
+        clock.now += 100
+        digest.add('a', 'Ответ api не dict', ['chat'])
+        digest.add('a', 'Нет ключа homeworks', ['chat'])
+        assert digest.take('a') is None, (
+            'Сводка не должна уходить, пока окно не закрылось'
+        )
+
+        clock.now += 500
+        error_window = digest.take('a')
+        assert error_window is not None and error_window.count == 3
+        assert error_window.errors['Ответ api не dict'] == [2, 1000, 1100], (
+            'Для каждой ошибки нужны число повторов и время первой '
+            'и последней'
+        )
+        assert digest.take('a') is None and not len(digest), (
+            'Окно отдаётся один раз'
+        )
+
+    def test_one_digest_per_window(self):
+        clock = FakeClock(1000.0)
+        digest = ErrorDigest(window=60, clock=clock)
+        taken = []
+        for second in range(180):
+            clock.now = 1000 + second
+            digest.add('a', f'Ошибка {second % 7}', ['chat'])
+            error_window = digest.take('a')
+            if error_window is not None:
+                taken.append(error_window)
+        assert len(taken) == 2, (
+            'За каждое окно должна уходить одна сводка, '
+            'сколько бы разных ошибок ни было'
+        )
+        assert [error_window.count for error_window in taken] == [61, 61]
+        assert len(digest.take_all()) == 1, (
+            'При остановке отдаются и незакрытые окна'
+        )
+
+    def test_format_and_signature(self):
+        clock = FakeClock(1000.0)
+        digest = ErrorDigest(window=0, clock=clock)
+        digest.add('a', 'Нет ключа homeworks', ['chat'])
+        digest.add('a', 'Ответ api не dict', ['chat'])
+        clock.now += 5
+        digest.add('a', 'Ответ api не dict', ['chat'])
+        error_window = digest.take('a')
+
+        text = error_window.format()
+        assert text.startswith('Ошибки при проверке статусов: 3')
+        assert '• Ответ api не dict — 2 раз, с ' in text
+        assert '• Нет ключа homeworks — в ' in text
+        assert error_window.signature == (
+            'Нет ключа homeworks\nОтвет api не dict'
+        ), 'Подпись сводки не должна зависеть от числа повторов и времени'
@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+
+import loadsim
+
+
+class TestFakePracticum:
+
+    def test_answer_contains_only_fresh_changes(self):
+        practicum = loadsim.FakePracticum(
+            ['sim-0'], change_interval=10, faults=loadsim.FaultProfile()
+        )
+        practicum.phases['sim-0'] = 0
+        started = practicum.started
+
+        answer = practicum.answer('sim-0', int(started), started + 15)
+        assert answer['current_date'] == int(started + 15), (
+            'current_date должен быть текущим временем сервера'
+        )
+        assert [hw['status'] for hw in answer['homeworks']] == ['rejected'], (
+            'Фальшивый api должен отдать последний статус работы'
+        )
+        assert practicum.answer(
+            'sim-0', int(started) + 12, started + 15
+        )['homeworks'] == [], (
+            'Смены статуса раньше from_date не должны попадать в ответ'
+        )
+
+
+class TestSimulation:
+
+    def test_short_run_delivers_notifications(self):
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run(
+            [sys.executable, 'loadsim.py', '--tenants', '5',
+             '--duration', '4', '--poll-interval', '1',
+             '--change-interval', '2'],
+            cwd=root_dir, capture_output=True, text=True, timeout=60
+        )
+        assert result.returncode == 0, result.stderr
+        report = json.loads(result.stdout)
+        assert report['notifications_delivered'] > 0, (
+            'Симуляция должна доставить уведомления в фальшивый Telegram'
+        )
+        # статус меняется реже опроса, поэтому бот видит каждую смену
+        assert report['notifications_missed'] == 0, (
+            'Без ошибок серверов ни одна смена статуса не должна потеряться'
+        )
@@ -0,0 +1,60 @@
+import logging
+import queue
+
+import logconfig
+
+
+class TestLogConfig:
+
+    def test_secrets_are_redacted(self):
+        redact = logconfig.RedactSecretsFilter(secrets=['supersecret'])
+        record = logging.LogRecord(
+            'homework', logging.DEBUG, __file__, 1,
+            'HEADERS = %s, url = %s, token = %s',
+            ({'Authorization': 'OAuth y0_AgAAAA'},
+             'https://api.telegram.org/bot123:ABC-def/sendMessage',
+             'supersecret'),
+            None
+        )
+
+        redact.filter(record)
+        message = record.getMessage()
+
+        assert 'y0_AgAAAA' not in message and 'ABC-def' not in message, (
+            'Токены должны вырезаться из сообщений лога'
+        )
+        assert 'supersecret' not in message
+        assert "'OAuth ***'" in message
+
+    def test_queue_handler_does_not_format(self):
+        class Explosive:
+            def __str__(self):
+                raise AssertionError(
+                    'Сообщение не должно форматироваться в вызывающем потоке'
+                )
+
+        log_queue = queue.SimpleQueue()
+        handler = logconfig.LazyQueueHandler(log_queue)
+        logger = logging.getLogger('test_lazy')
+        logger.propagate = False
+        logger.addHandler(handler)
+        try:
+            logger.warning('value %s', Explosive())
+        finally:
+            logger.removeHandler(handler)
+
+        assert log_queue.get_nowait().args, (
+            'Запись должна попадать в очередь неотформатированной'
+        )
+
+    def test_set_log_level(self):
+        root = logging.getLogger()
+        level = root.level
+        try:
+            logconfig.set_log_level('DEBUG')
+            assert root.level == logging.DEBUG
+            assert logging.getLogger('urllib3').level == logging.INFO, (
+                'Библиотеки не должны писать DEBUG-сообщения'
+            )
+        finally:
+            logconfig.set_log_level(level)
@@ -0,0 +1,63 @@
+import json
+import urllib.request
+
+import pytest
+
+from exceptions import GetApiAnswerError
+import metrics
+
+
+class TestMetrics:
+
+    def test_render_prometheus_text(self):
+        registry = metrics.MetricsRegistry()
+        counter = registry.counter('requests_total', 'Запросы', ('code',))
+        histogram = registry.histogram(
+            'latency_seconds', 'Время', buckets=(0.1, 1)
+        )
+        counter.inc(code=200)
+        counter.inc(code=200)
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+
+        text = registry.render()
+
+        assert '# TYPE requests_total counter' in text
+        assert 'requests_total{code="200"} 2' in text
+        assert 'latency_seconds_bucket{le="0.1"} 1' in text
+        assert 'latency_seconds_bucket{le="+Inf"} 2' in text, (
+            'Корзины гистограммы должны быть накопительными'
+        )
+        assert 'latency_seconds_count 2' in text
+
+    def test_timed_counts_errors_by_class(self):
+        @metrics.timed('test_func')
+        def failing(value):
+            raise GetApiAnswerError(value)
+
+        calls = metrics.CALL_SECONDS.count(func='test_func')
+        with pytest.raises(GetApiAnswerError):
+            failing('boom')
+
+        assert metrics.CALL_SECONDS.count(func='test_func') == calls + 1
+        assert metrics.CALL_ERRORS.value(
+            func='test_func', error='GetApiAnswerError'
+        ) >= 1, 'Исключения должны считаться по классам'
+
+    def test_http_endpoint_and_snapshot(self, tmp_path):
+        registry = metrics.MetricsRegistry()
+        registry.counter('polls_total', 'Опросы').inc()
+
+        server = metrics.start_http_server(0, metrics_registry=registry)
+        try:
+            url = f'http://127.0.0.1:{server.server_port}/metrics'
+            body = urllib.request.urlopen(url).read().decode()
+        finally:
+            server.shutdown()
+            server.server_close()
+        assert 'polls_total 1' in body
+
+        path = str(tmp_path / 'metrics.json')
+        metrics.write_snapshot(path, registry)
+        with open(path) as file:
+            assert json.load(file)['metrics']['polls_total'] == {'': 1}
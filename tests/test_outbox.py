@@ -0,0 +1,189 @@
+import asyncio
+
+from telegram.error import RetryAfter
+
+from outbox import OutboundQueue, TokenBucket
+from utils import FakeClock
+
+
+async def run_queue(queue, action):
+    worker = asyncio.create_task(queue.run())
+    try:
+        return await action()
+    finally:
+        worker.cancel()
+        await asyncio.gather(worker, return_exceptions=True)
+
+
+class TestTokenBucket:
+
+    def test_rate_and_block(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=1, clock=clock)
+
+        assert bucket.delay() == 0
+        bucket.consume()
+        assert bucket.delay() == 0.5, (
+            'Следующий токен должен появиться через 1 / rate секунд'
+        )
+        clock.now = 0.5
+        assert bucket.delay() == 0
+
+        bucket.block(10)
+        assert bucket.delay() == 10, (
+            'После RetryAfter токены не должны выдаваться'
+        )
+
+
+class TestOutboundQueue:
+
+    def test_pending_messages_for_chat_are_coalesced(self):
+        sent = []
+        started = None
+
+        async def send(chat_id, text):
+            sent.append((chat_id, text))
+            await started.wait()
+            return True
+
+        queue = OutboundQueue(send, chat_rate=1000, global_rate=1000)
+
+        async def action():
+            nonlocal started
+            started = asyncio.Event()
+            first = queue.put(1, 'a')
+            await asyncio.sleep(0.01)
+            # пока первое сообщение в пути, для чата копятся новые
+            rest = [queue.put(1, 'b'), queue.put(1, 'c'), queue.put(2, 'd')]
+            started.set()
+            return await asyncio.gather(first, *rest)
+
+        results = asyncio.run(run_queue(queue, action))
+
+        assert results == [True] * 4
+        assert sorted(sent) == [(1, 'a'), (1, 'b\n\nc'), (2, 'd')], (
+            'Накопившиеся сообщения одного чата должны склеиваться в одно'
+        )
+        assert queue.coalesced == 1
+
+    def test_str_and_int_chat_ids_share_one_queue(self):
+        sent = []
+        started = None
+
+        async def send(chat_id, text):
+            sent.append((chat_id, text))
+            await started.wait()
+            return True
+
+        queue = OutboundQueue(send, chat_rate=1000, global_rate=1000)
+
+        async def action():
+            nonlocal started
+            started = asyncio.Event()
+            first = queue.put('1', 'a')
+            await asyncio.sleep(0.01)
+            rest = [queue.put(1, 'b'), queue.put('1', 'c')]
+            started.set()
+            return await asyncio.gather(first, *rest)
+
+        asyncio.run(run_queue(queue, action))
+
+        assert sent == [(1, 'a'), (1, 'b\n\nc')], (
+            'Id чата из TELEGRAM_CHAT_ID и из Telegram — один и тот же чат'
+        )
+
+    def test_messages_of_different_kinds_are_not_coalesced(self):
+        sent = []
+        started = None
+
+        async def send(chat_id, text):
+            sent.append(text)
+            await started.wait()
+            return True
+
+        queue = OutboundQueue(send, chat_rate=1000, global_rate=1000)
+
+        async def action():
+            nonlocal started
+            started = asyncio.Event()
+            first = queue.put(1, 'a')
+            await asyncio.sleep(0.01)
+            rest = [
+                queue.put(1, 'b'),
+                queue.put(1, 'сводка', kind='digest'),
+                queue.put(1, 'c'),
+            ]
+            started.set()
+            await asyncio.gather(first, *rest)
+
+        asyncio.run(run_queue(queue, action))
+
+        assert sent == ['a', 'b', 'сводка', 'c'], (
+            'Сообщения разных видов не должны склеиваться в одно'
+        )
+
+    def test_chat_rate_limit(self):
+        sent_at = []
+
+        async def send(chat_id, text):
+            sent_at.append(asyncio.get_running_loop().time())
+            return True
+
+        queue = OutboundQueue(send, chat_rate=20, global_rate=1000)
+
+        async def action():
+            for index in range(3):
+                await queue.put(1, str(index))
+
+        asyncio.run(run_queue(queue, action))
+
+        gaps = [b - a for a, b in zip(sent_at, sent_at[1:])]
+        assert all(gap >= 0.04 for gap in gaps), (
+            'Сообщения в один чат должны отправляться не чаще chat_rate'
+        )
+
+    def test_retry_after_is_honoured(self):
+        attempts = []
+
+        async def send(chat_id, text):
+            attempts.append(asyncio.get_running_loop().time())
+            if len(attempts) == 1:
+                raise RetryAfter(0.1)
+            return True
+
+        queue = OutboundQueue(send, chat_rate=1000, global_rate=1000)
+
+        async def action():
+            return await queue.put(1, 'text')
+
+        assert asyncio.run(run_queue(queue, action)) is True, (
+            'После RetryAfter сообщение должно быть отправлено повторно'
+        )
+        assert attempts[1] - attempts[0] >= 0.09, (
+            'Повторная отправка должна ждать время из RetryAfter'
+        )
+
+    def test_broadcast_sends_to_chats_concurrently(self):
+        async def send(chat_id, text):
+            await asyncio.sleep(0.1)
+            return chat_id != 'blocked'
+
+        queue = OutboundQueue(
+            send, chat_rate=1000, global_rate=1000, concurrency=20
+        )
+        chat_ids = list(range(10)) + ['blocked']
+
+        async def action():
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            results = await queue.broadcast(chat_ids, 'статус изменился')
+            return results, loop.time() - started
+
+        results, elapsed = asyncio.run(run_queue(queue, action))
+        assert elapsed < 0.5, (
+            'Рассылка должна длиться как самая долгая отправка, '
+            'а не как их сумма'
+        )
+        assert results == {
+            **{chat_id: True for chat_id in range(10)}, 'blocked': False
+        }, 'Рассылка должна вернуть результат для каждого чата'
@@ -0,0 +1,596 @@
+import asyncio
+import functools
+import json
+import time
+
+import pytest
+import requests
+import telegram
+
+from breaker import CircuitBreaker
+from capture import CaptureRecorder, read_capture, replay
+import engine
+from errordigest import ErrorDigest, ErrorWindow
+from outbox import OutboundQueue
+from statuscache import StatusCache
+import storage
+import transport
+from utils import FakeClock
+
+
+class MockResponse:
+
+    status_code = 200
+
+    def __init__(self, data, headers=None):
+        self.data = data
+        self.content = json.dumps(data).encode()
+        self.headers = headers or {}
+
+    def json(self):
+        return self.data
+
+
+class MockOutbox:
+
+    def __init__(self):
+        self.sent = []
+
+    def put(self, chat_id, text, kind=None):
+        self.sent.append((chat_id, text))
+
+    def broadcast(self, chat_ids, text, kind=None):
+        for chat_id in chat_ids:
+            self.put(chat_id, text)
+
+
+@pytest.fixture
+def homework_module(monkeypatch, tmp_path):
+    import homework
+
+    monkeypatch.setattr(
+        homework, 'cursor_store',
+        storage.CursorStore(str(tmp_path / 'state.sqlite3'))
+    )
+    monkeypatch.setattr(
+        homework, 'state_store',
+        storage.StateStore(str(tmp_path / 'state.sqlite3'))
+    )
+    monkeypatch.setattr(
+        homework, 'response_cache',
+        transport.ResponseCache(ignore=homework.CURRENT_DATE)
+    )
+    monkeypatch.setattr(homework, 'status_cache', StatusCache(ttl=60))
+    monkeypatch.setattr(
+        homework, 'api_breaker', CircuitBreaker('test', failure_threshold=2)
+    )
+    monkeypatch.setattr(homework, 'error_digest', ErrorDigest(window=0))
+    return homework
+
+
+def subscribe(token, *chat_ids):
+    subscription = engine.Subscription(token)
+    for chat_id in chat_ids:
+        subscription.subscribe(chat_id)
+    return subscription
+
+
+def poll(homework_module, outbox, subscription):
+    return asyncio.run(
+        homework_module.poll_subscription(outbox, subscription)
+    )
+
+
+def serve(monkeypatch, responses, requested):
+    def mock_get(url, params=None, **kwargs):
+        requested.append(params['from_date'])
+        return MockResponse(responses.pop(0))
+
+    monkeypatch.setattr(requests.Session, 'get', staticmethod(mock_get))
+
+
+class TestPipeline:
+
+    def test_outage_stops_requests_until_probe(self, monkeypatch,
+                                               homework_module):
+        requested = []
+
+        def mock_get(url, params=None, **kwargs):
+            requested.append(params['from_date'])
+            response = MockResponse({})
+            response.status_code = 503
+            return response
+
+        monkeypatch.setattr(requests.Session, 'get', staticmethod(mock_get))
+        outbox = MockOutbox()
+        subscriptions = [subscribe(f'token-{i}', i) for i in range(5)]
+        outcomes = [
+            poll(homework_module, outbox, subscription)
+            for subscription in subscriptions
+        ]
+
+        assert len(requested) == 2, (
+            'Разомкнутый предохранитель не должен пропускать запросы к api'
+        )
+        assert all(outcome.error for outcome in outcomes), (
+            'Отклонённый запрос должен считаться ошибкой для планировщика'
+        )
+
+        homework_module.api_breaker.opened_at -= 60
+        poll(homework_module, outbox, subscriptions[0])
+        poll(homework_module, outbox, subscriptions[1])
+        assert len(requested) == 3, (
+            'После паузы к api должен уйти один пробный запрос'
+        )
+
+    def test_errors_are_sent_as_one_digest(self, monkeypatch,
+                                           homework_module):
+        requested = []
+        serve(monkeypatch, [
+            {'current_date': 2000},
+            {'homeworks': [{'id': 1, 'homework_name': 'hw',
+                            'status': 'unknown'}], 'current_date': 2000},
+            {'current_date': 2000},
+            {'current_date': 2000},
+        ], requested)
+        digest = ErrorDigest(window=600)
+        monkeypatch.setattr(homework_module, 'error_digest', digest)
+        outbox = MockOutbox()
+        subscription = subscribe('token', 1, 2)
+
+        for _ in range(4):
+            poll(homework_module, outbox, subscription)
+        assert not outbox.sent, (
+            'Ошибки внутри окна не должны отправляться по одной'
+        )
+
+        digest.window = 0
+        serve(monkeypatch, [{'current_date': 2000}], requested)
+        poll(homework_module, outbox, subscription)
+        assert [chat_id for chat_id, _ in outbox.sent] == [1, 2], (
+            'После закрытия окна каждому чату уходит одна сводка'
+        )
+        assert outbox.sent[0][1].startswith(
+            'Ошибки при проверке статусов: 5'
+        )
+
+    def test_digest_and_error_do_not_suppress_each_other(
+            self, homework_module):
+        outbox = MockOutbox()
+        tenants = list(subscribe('token', 1))
+        homework_module.notify_error(outbox, tenants, 'сбой')
+        error_window = ErrorWindow(0, tenants)
+        error_window.add('сбой', 0)
+        homework_module.send_error_digest(outbox, error_window)
+        homework_module.notify_error(outbox, tenants, 'сбой')
+
+        assert len(outbox.sent) == 2, (
+            'Сводка и текст ошибки должны сравниваться каждый со своим '
+            'прошлым значением'
+        )
+
+    def test_capture_replays_into_same_messages(self, monkeypatch,
+                                                homework_module, tmp_path):
+        homeworks = [{'id': 1, 'homework_name': 'hw', 'status': 'reviewing',
+                      'date_updated': '2022-01-01T10:00:00Z'}]
+        requested = []
+        serve(monkeypatch, [
+            {'homeworks': homeworks, 'current_date': 2000},
+            {'current_date': 3000},
+            {'homeworks': [{**homeworks[0], 'status': 'approved'}],
+             'current_date': 4000},
+        ], requested)
+        path = str(tmp_path / 'api.capture')
+        monkeypatch.setattr(
+            homework_module, 'api_capture', CaptureRecorder(path)
+        )
+        outbox = MockOutbox()
+        subscription = subscribe('secret-token', 1)
+        for _ in range(3):
+            poll(homework_module, outbox, subscription)
+        homework_module.api_capture.close()
+        assert 'secret-token' not in open(path, encoding='utf-8').read()
+
+        monkeypatch.setattr(
+            homework_module, 'state_store',
+            storage.StateStore(str(tmp_path / 'replay.sqlite3'))
+        )
+        sent = []
+        report = replay(
+            read_capture(path),
+            lambda exchange: homework_module.replay_exchange(
+                exchange, lambda chat_id, text: sent.append(text)
+            )
+        )
+        assert report['exchanges'] == 3 and report['errors'] == {
+            'KeyError': 1
+        }
+        assert sent == [
+            text for _, text in outbox.sent if text.startswith('Изменился')
+        ], (
+            'Прогон захвата должен дать те же уведомления, что и опрос'
+        )
+
+    def test_unknown_status_does_not_block_response(self, monkeypatch,
+                                                    homework_module):
+        homeworks = [
+            {'id': 2, 'homework_name': 'hw2', 'status': 'approved',
+             'date_updated': '2022-01-02T10:00:00Z'},
+            {'id': 1, 'homework_name': 'hw1', 'status': 'unknown_new',
+             'date_updated': '2022-01-01T10:00:00Z'},
+        ]
+        requested = []
+        serve(monkeypatch, [
+            {'homeworks': homeworks, 'current_date': 2000},
+            {'homeworks': [], 'current_date': 3000},
+        ], requested)
+        outbox = MockOutbox()
+        subscription = subscribe('token', 1)
+        subscription.current_timestamp = 1000
+
+        poll(homework_module, outbox, subscription)
+        poll(homework_module, outbox, subscription)
+
+        statuses = [text for _, text in outbox.sent if 'hw2' in text]
+        assert len(statuses) == 1, (
+            'Работа с неизвестным статусом не должна мешать отправке '
+            'остальных работ из ответа'
+        )
+        assert any('hw1' in text for _, text in outbox.sent), (
+            'Неразобранная работа должна попасть в сводку ошибок'
+        )
+        assert requested == [1000, 2000], (
+            'Курсор должен сдвигаться, даже если одну работу '
+            'не удалось разобрать'
+        )
+
+    def test_cursor_follows_current_date(self, monkeypatch, homework_module):
+        requested = []
+        serve(monkeypatch, [
+            {'homeworks': [{'homework_name': 'hw', 'status': 'reviewing'}],
+             'current_date': 2000},
+            {'homeworks': [], 'current_date': 3000},
+        ], requested)
+        outbox = MockOutbox()
+        subscription = subscribe('token', 1)
+        subscription.current_timestamp = 1000
+
+        poll(homework_module, outbox, subscription)
+        poll(homework_module, outbox, subscription)
+
+        assert requested == [1000, 2000], (
+            'Каждый опрос должен запрашивать изменения '
+            'с current_date предыдущего ответа'
+        )
+        assert len(outbox.sent) == 1, (
+            'Пустой ответ не должен превращаться в сообщение пользователю'
+        )
+        assert homework_module.cursor_store.get(subscription.key) == 3000
+
+        restored = engine.TenantRegistry()
+        restored.add('token', 1)
+        homework_module.restore_cursors(restored)
+        assert restored.get(subscription.key).current_timestamp == 3000, (
+            'После перезапуска опрос должен продолжаться '
+            'с сохранённого курсора'
+        )
+
+    def test_cursor_stays_on_error(self, monkeypatch, homework_module):
+        requested = []
+        serve(monkeypatch, [
+            {'current_date': 2000},
+            {'homeworks': [], 'current_date': 3000},
+        ], requested)
+        subscription = subscribe('token', 1)
+        subscription.current_timestamp = 1000
+
+        poll(homework_module, MockOutbox(), subscription)
+        poll(homework_module, MockOutbox(), subscription)
+
+        assert requested == [1000, 1000], (
+            'Курсор не должен сдвигаться после некорректного ответа'
+        )
+
+    def test_dedup_survives_restart(self, monkeypatch, homework_module,
+                                    tmp_path):
+        homeworks = [{'id': 1, 'homework_name': 'hw', 'status': 'reviewing',
+                      'date_updated': '2022-01-01T10:00:00Z'}]
+        requested = []
+        serve(monkeypatch, [
+            {'homeworks': homeworks, 'current_date': 2000},
+            {'homeworks': homeworks, 'current_date': 3000},
+        ], requested)
+        outbox = MockOutbox()
+
+        poll(homework_module, outbox, subscribe('a', 1))
+        homework_module.state_store.close()
+        monkeypatch.setattr(
+            homework_module, 'state_store',
+            storage.StateStore(str(tmp_path / 'state.sqlite3'))
+        )
+        poll(homework_module, outbox, subscribe('a', 1))
+
+        assert len(outbox.sent) == 1, (
+            'После перезапуска уже отправленный статус '
+            'не должен отправляться повторно'
+        )
+
+    def test_every_changed_homework_is_sent_in_date_order(
+            self, monkeypatch, homework_module):
+        homeworks = [
+            {'id': 3, 'homework_name': 'hw3', 'status': 'reviewing',
+             'date_updated': '2022-01-03T10:00:00Z'},
+            {'id': 2, 'homework_name': 'hw2', 'status': 'rejected',
+             'date_updated': '2022-01-02T10:00:00Z'},
+            {'id': 1, 'homework_name': 'hw1', 'status': 'approved',
+             'date_updated': '2022-01-01T10:00:00Z'},
+        ]
+        serve(monkeypatch, [
+            {'homeworks': homeworks, 'current_date': 2000},
+            {'homeworks': homeworks[:1], 'current_date': 3000},
+        ], [])
+        outbox = MockOutbox()
+        subscription = subscribe('token', 1)
+
+        outcome = poll(homework_module, outbox, subscription)
+        poll(homework_module, outbox, subscription)
+
+        assert [text.split('"')[1] for _, text in outbox.sent] == [
+            'hw1', 'hw2', 'hw3'
+        ], (
+            'Каждое изменение статуса должно отправляться '
+            'в порядке date_updated'
+        )
+        assert outcome.changed and outcome.status == 'reviewing', (
+            'Планировщик должен получать статус самой новой работы'
+        )
+
+    def test_unchanged_body_skips_decoding(self, monkeypatch,
+                                           homework_module):
+        requested = []
+        homeworks = [{'id': 1, 'homework_name': 'hw', 'status': 'reviewing'}]
+        serve(monkeypatch, [
+            {'homeworks': homeworks, 'current_date': 2000},
+            {'homeworks': homeworks, 'current_date': 3000},
+        ], requested)
+        outbox = MockOutbox()
+        subscription = subscribe('token', 1)
+        subscription.current_timestamp = 1000
+
+        poll(homework_module, outbox, subscription)
+        monkeypatch.setattr(MockResponse, 'json', None)
+        poll(homework_module, outbox, subscription)
+
+        assert homework_module.FAST_PATH.value(result='hit') >= 1, (
+            'Ответ, отличающийся только current_date, '
+            'должен пройти по быстрому пути'
+        )
+        assert subscription.current_timestamp == 3000, (
+            'Быстрый путь должен сдвигать курсор на current_date'
+        )
+        assert len(outbox.sent) == 1
+
+    def test_not_modified_uses_etag(self, monkeypatch, homework_module):
+        sent_headers = []
+        responses = [
+            MockResponse({'homeworks': [], 'current_date': 2000},
+                         headers={'ETag': '"v1"'}),
+            MockResponse({}),
+        ]
+        responses[1].status_code = 304
+        responses[1].content = b''
+
+        def mock_get(url, params=None, headers=None, **kwargs):
+            sent_headers.append(headers)
+            return responses.pop(0)
+
+        monkeypatch.setattr(requests.Session, 'get', staticmethod(mock_get))
+        subscription = subscribe('token', 1)
+        subscription.current_timestamp = 1000
+        for _ in range(2):
+            poll(homework_module, MockOutbox(), subscription)
+
+        assert sent_headers[1].get('If-None-Match') == '"v1"', (
+            'Повторный запрос должен отправлять If-None-Match с ETag'
+        )
+        assert subscription.current_timestamp == 2000
+
+    def test_status_command_is_served_from_cache(self, monkeypatch,
+                                                 homework_module):
+        requested = []
+        serve(monkeypatch, [
+            {'homeworks': [
+                {'id': 1, 'homework_name': 'old', 'status': 'approved',
+                 'date_updated': '2022-01-01T00:00:00Z'},
+                {'id': 2, 'homework_name': 'new', 'status': 'reviewing',
+                 'date_updated': '2022-02-01T00:00:00Z'},
+            ], 'current_date': 2000},
+            {'homeworks': [
+                {'id': 2, 'homework_name': 'new', 'status': 'rejected',
+                 'date_updated': '2022-02-02T00:00:00Z'},
+            ], 'current_date': 3000},
+        ], requested)
+        registry = engine.TenantRegistry()
+        registry.add('token', 1)
+        subscription = registry.get(engine.token_digest('token'))
+        outbox = MockOutbox()
+
+        async def session():
+            await homework_module.answer_command(
+                registry, outbox, 1, 'status'
+            )
+            await homework_module.poll_subscription(outbox, subscription)
+            await homework_module.answer_command(
+                registry, outbox, 1, 'status'
+            )
+            await homework_module.answer_command(
+                registry, outbox, 1, 'history'
+            )
+
+        asyncio.run(session())
+        assert len(requested) == 2, (
+            'Команды должны загрузить работы один раз, '
+            'а дальше отвечать из кэша, который продлевают опросы'
+        )
+        assert 'замечания' in outbox.sent[-2][1], (
+            '/status должен учитывать изменения из опросов'
+        )
+        assert outbox.sent[-1][1].index('new') < outbox.sent[-1][1].index(
+            'old'
+        ), '/history должен перечислять работы от новых к старым'
+
+    def test_stale_status_waits_for_running_poll(self, monkeypatch,
+                                                 homework_module):
+        requested = []
+        serve(monkeypatch, [
+            {'homeworks': [
+                {'id': 1, 'homework_name': 'hw', 'status': 'reviewing',
+                 'date_updated': '2022-01-01T00:00:00Z'},
+            ], 'current_date': 2000},
+            {'homeworks': [
+                {'id': 1, 'homework_name': 'hw', 'status': 'rejected',
+                 'date_updated': '2022-01-02T00:00:00Z'},
+            ], 'current_date': 3000},
+        ], requested)
+        clock = FakeClock()
+        monkeypatch.setattr(
+            homework_module, 'status_cache', StatusCache(ttl=60, clock=clock)
+        )
+        registry = engine.TenantRegistry()
+        registry.add('token', 1)
+        subscription = registry.get(engine.token_digest('token'))
+        outbox = MockOutbox()
+
+        async def session():
+            await homework_module.answer_command(
+                registry, outbox, 1, 'status'
+            )
+            clock.now += 120
+            polling = asyncio.create_task(homework_module.poll_tracked(
+                functools.partial(homework_module.poll_subscription, outbox),
+                subscription
+            ))
+            await asyncio.sleep(0)
+            await homework_module.answer_command(
+                registry, outbox, 1, 'status'
+            )
+            await polling
+
+        asyncio.run(session())
+        assert len(requested) == 2, (
+            'Устаревший /status должен дождаться идущего опроса, '
+            'а не запрашивать всю историю заново'
+        )
+        assert 'замечания' in outbox.sent[-1][1], (
+            '/status должен ответить по данным этого опроса'
+        )
+
+    def test_edited_command_is_answered(self, homework_module):
+        registry = engine.TenantRegistry()
+        outbox = MockOutbox()
+        updater = homework_module.build_updater(
+            telegram.Bot('123:token'), registry, outbox
+        )
+        (handler,) = updater.dispatcher.handlers[0]
+        # отредактированное сообщение: update.message пустой
+        update = telegram.Update(1, edited_message=telegram.Message(
+            1, None, telegram.Chat(5, 'private'), text='/status'
+        ))
+
+        async def session():
+            updater.dispatcher.bot_data['loop'] = asyncio.get_running_loop()
+            handler.callback(update, updater.dispatcher)
+            await asyncio.sleep(0.01)
+
+        asyncio.run(session())
+        assert outbox.sent == [
+            (5, 'Этот чат не подписан на уведомления.')
+        ], 'Команда из отредактированного сообщения не должна падать'
+
+    def test_one_request_fans_out_to_every_chat(self, monkeypatch,
+                                                homework_module):
+        requested = []
+        homeworks = [{'id': 1, 'homework_name': 'hw', 'status': 'approved'}]
+        serve(monkeypatch, [
+            {'homeworks': homeworks, 'current_date': 2000},
+        ], requested)
+        subscription = subscribe('token', 1, 2, 3)
+        # чат 2 уже знает этот статус
+        homework_module.state_store.put('2:' + subscription.key, '1',
+                                        'approved', None)
+        outbox = MockOutbox()
+
+        poll(homework_module, outbox, subscription)
+
+        assert len(requested) == 1, (
+            'Токен с несколькими чатами должен опрашиваться одним запросом'
+        )
+        assert sorted(chat_id for chat_id, _ in outbox.sent) == [1, 3], (
+            'Изменение должно уйти в каждый чат, '
+            'для которого оно новое'
+        )
+
+    def test_send_message_fans_out_to_every_chat(self, monkeypatch,
+                                                 homework_module):
+        class SlowBot:
+            def send_message(self, chat_id, text):
+                time.sleep(0.1)
+                if chat_id == '3':
+                    raise telegram.error.Unauthorized('bot was blocked')
+
+        monkeypatch.setattr(homework_module, 'TELEGRAM_CHAT_ID', '1, 2,3')
+        started = time.monotonic()
+        results = homework_module.send_message(SlowBot(), 'статус')
+
+        assert results == {'1': True, '2': True, '3': False}, (
+            'send_message должен отправлять во все чаты TELEGRAM_CHAT_ID '
+            'и возвращать результат по каждому'
+        )
+        assert time.monotonic() - started < 0.25, (
+            'Отправки в разные чаты должны идти параллельно'
+        )
+
+    def test_serve_drains_outbox_on_stop(self, homework_module):
+        delivered = []
+
+        async def send(chat_id, text):
+            await asyncio.sleep(0.2)
+            delivered.append(chat_id)
+            return True
+
+        outbox = OutboundQueue(send, chat_rate=1000, global_rate=1000)
+        registry = engine.TenantRegistry()
+        registry.add('token', 1)
+
+        async def handler(subscription):
+            outbox.put(1, 'статус изменился')
+
+        polling = engine.PollingEngine(registry, handler, interval=60)
+
+        async def session():
+            stopping = asyncio.Event()
+            asyncio.get_running_loop().call_later(0.05, stopping.set)
+            started = asyncio.get_running_loop().time()
+            await homework_module.serve(polling, outbox, stopping=stopping)
+            return asyncio.get_running_loop().time() - started
+
+        elapsed = asyncio.run(session())
+        assert delivered == [1], (
+            'Перед остановкой очередь отправки должна быть разобрана'
+        )
+        assert elapsed < 1, (
+            'Остановка не должна ждать следующего интервала опроса'
+        )
+
+    def test_iter_by_date(self, homework_module):
+        def dated(*days):
+            return [{'date_updated': f'2022-01-0{day}'} for day in days]
+
+        for homeworks in (dated(3, 2, 1), dated(1, 2, 3), dated(2, 3, 1)):
+            result = [
+                hw['date_updated']
+                for hw in homework_module.iter_by_date(homeworks)
+            ]
+            assert result == ['2022-01-01', '2022-01-02', '2022-01-03'], (
+                'Работы должны обходиться по возрастанию date_updated'
+            )
@@ -0,0 +1,87 @@
+import asyncio
+import os
+
+from profiling import CycleProfiler
+from utils import FakeClock
+
+
+kept = []
+
+
+async def busy_cycle():
+    kept.append([object() for _ in range(1000)])
+    return sum(range(1000))
+
+
+def run_cycles(profiler, keys, clock=None, step=0):
+    for key in keys:
+        if clock is not None:
+            clock.now += step
+        assert asyncio.run(profiler.run(key, busy_cycle)) == 499500
+
+
+class TestCycleProfiler:
+
+    def test_sampling_is_bounded(self, tmp_path):
+        clock = FakeClock()
+        profiler = CycleProfiler(
+            str(tmp_path / 'bot.profile'), every=3, min_interval=10,
+            report_every=100, enabled=True, clock=clock
+        )
+        run_cycles(profiler, ['a'] * 15, clock, step=1)
+        assert profiler.samples == 2, (
+            'Выборка — каждый every-й цикл, но не чаще min_interval'
+        )
+
+        only_b = CycleProfiler(
+            str(tmp_path / 'b.profile'), every=1, min_interval=0,
+            tenant='b', report_every=100, enabled=True
+        )
+        run_cycles(only_b, ['a', 'b', 'a', 'b'])
+        assert only_b.samples == 2, (
+            'С tenant снимаются только циклы этой подписки'
+        )
+
+        any_tenant = CycleProfiler(
+            str(tmp_path / 'any.profile'), every=1, min_interval=0,
+            tenant='', report_every=100, enabled=True
+        )
+        run_cycles(any_tenant, ['a', 'b'])
+        assert any_tenant.samples == 2, (
+            'Пустой tenant из .env не должен отключать выборку'
+        )
+
+    def test_reports_rotate(self, tmp_path):
+        path = str(tmp_path / 'bot.profile')
+        profiler = CycleProfiler(
+            path, every=1, min_interval=0, report_every=2, keep=3,
+            enabled=True
+        )
+        run_cycles(profiler, ['a'] * 8)
+
+        assert sorted(os.listdir(tmp_path)) == [
+            'bot.profile', 'bot.profile.1', 'bot.profile.2'
+        ], 'Хранятся только keep последних отчётов'
+        with open(path, encoding='utf-8') as report:
+            text = report.read()
+        assert text.startswith('Выборок: 2')
+        assert 'busy_cycle' in text, 'В отчёте должны быть горячие функции'
+        assert 'test_profiling.py' in text.split('== Память')[1], (
+            'В отчёте должны быть места, где выделялась память'
+        )
+
+    def test_signal_toggle_flushes(self, tmp_path):
+        path = tmp_path / 'bot.profile'
+        profiler = CycleProfiler(
+            str(path), every=1, min_interval=0, report_every=100
+        )
+        run_cycles(profiler, ['a'])
+        assert profiler.samples == 0, 'По умолчанию профилирование выключено'
+
+        profiler.toggle()
+        run_cycles(profiler, ['a', 'a'])
+        profiler.toggle()
+        run_cycles(profiler, ['a'])
+        assert path.exists() and profiler.samples == 0, (
+            'После выключения накопленное должно попасть в отчёт'
+        )
@@ -0,0 +1,42 @@
+from records import HomeworkRecord, Status
+
+
+class TestHomeworkRecord:
+
+    def test_from_api_keeps_used_fields(self):
+        homework = {
+            'id': 7, 'status': 'approved', 'homework_name': 'hw.zip',
+            'reviewer_comment': 'Отлично', 'lesson_name': 'Урок',
+            'date_updated': '2022-01-01T10:00:00Z',
+        }
+        record = HomeworkRecord.from_api(homework)
+
+        assert record.status is Status.APPROVED, (
+            'Известный статус должен храниться как элемент Status'
+        )
+        assert record['status'] == 'approved' and record['id'] == 7
+        assert record.get('reviewer_comment') is None, (
+            'Поля, которые бот не использует, не должны храниться'
+        )
+        assert HomeworkRecord.from_api(record) is record
+
+    def test_statuses_match_bot_messages(self):
+        import homework
+
+        assert {str(status) for status in Status} == set(
+            homework.HOMEWORK_STATUSES
+        ), 'Status должен покрывать все статусы из HOMEWORK_STATUSES'
+        record = HomeworkRecord.from_api(
+            {'homework_name': 'hw.zip', 'status': 'reviewing'}
+        )
+        assert homework.parse_status(record) == homework.parse_status(
+            {'homework_name': 'hw.zip', 'status': 'reviewing'}
+        ), 'Запись должна разбираться так же, как dict из api'
+
+    def test_unknown_status_is_interned(self):
+        first = HomeworkRecord.from_api({'status': ''.join(['on', 'hold'])})
+        second = HomeworkRecord.from_api({'status': ''.join(['on', 'hold'])})
+        assert first['status'] == 'onhold'
+        assert first.status is second.status, (
+            'Одинаковые неизвестные статусы должны храниться одной строкой'
+        )
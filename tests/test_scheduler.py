@@ -0,0 +1,62 @@
+from scheduler import AdaptiveScheduler, PollOutcome
+from utils import FakeClock
+
+
+def make_scheduler(clock):
+    return AdaptiveScheduler(
+        base_interval=600, reviewing_interval=120, max_interval=3600,
+        idle_after=1000, backoff_factor=2, jitter=0, clock=clock
+    )
+
+
+class TestAdaptiveScheduler:
+
+    def test_reviewing_is_polled_faster(self):
+        scheduler = make_scheduler(FakeClock())
+
+        assert scheduler.next_delay('t', PollOutcome()) == 600
+        delay = scheduler.next_delay(
+            't', PollOutcome(status='reviewing', changed=True)
+        )
+        assert delay == 120, (
+            'Пока работа на проверке, опрос должен идти чаще'
+        )
+        assert scheduler.next_delay('t', PollOutcome()) == 120, (
+            'Статус последней работы должен запоминаться между опросами'
+        )
+
+    def test_backoff_on_errors(self):
+        scheduler = make_scheduler(FakeClock())
+
+        delays = [
+            scheduler.next_delay('t', PollOutcome(error=True))
+            for _ in range(4)
+        ]
+        assert delays == [1200, 2400, 3600, 3600], (
+            'После ошибок api интервал должен расти экспоненциально '
+            'и не превышать max_interval'
+        )
+        assert scheduler.next_delay('t', None) == 3600
+        assert scheduler.next_delay('t', PollOutcome()) == 600, (
+            'После успешного опроса интервал должен вернуться к базовому'
+        )
+
+    def test_backoff_when_idle(self):
+        clock = FakeClock()
+        scheduler = make_scheduler(clock)
+
+        scheduler.next_delay('t', PollOutcome(status='approved', changed=True))
+        clock.now = 1500
+        assert scheduler.next_delay('t', PollOutcome()) == 1200, (
+            'Без изменений дольше idle_after интервал должен расти'
+        )
+
+    def test_jitter_and_stats(self):
+        scheduler = AdaptiveScheduler(base_interval=600, jitter=0.1)
+
+        delays = {scheduler.next_delay(str(i), PollOutcome())
+                  for i in range(20)}
+        assert len(delays) > 1 and all(540 <= d <= 660 for d in delays), (
+            'Интервал должен сдвигаться на случайную долю jitter'
+        )
+        assert scheduler.stats()['polls'] == 20
@@ -0,0 +1,111 @@
+from engine import TenantRegistry
+from sharding import HashRing, LeaseStore, ShardCoordinator, ShardView
+from utils import FakeClock
+
+
+def build_registry(size):
+    registry = TenantRegistry()
+    for index in range(size):
+        registry.add(f'token-{index}', index)
+    return registry
+
+
+def coordinator(path, registry, worker_id, clock, **kwargs):
+    return ShardCoordinator(
+        LeaseStore(path), registry, worker_id=worker_id,
+        lease_ttl=30, clock=clock, **kwargs
+    )
+
+
+class TestHashRing:
+
+    def test_join_moves_only_part_of_keys(self):
+        keys = [f'key-{index}' for index in range(1000)]
+        before = HashRing(['a', 'b', 'c'])
+        after = HashRing(['a', 'b', 'c', 'd'])
+        owners = {key: before.owner(key) for key in keys}
+        assert set(owners.values()) == {'a', 'b', 'c'}
+        moved = [key for key in keys if after.owner(key) != owners[key]]
+        assert all(after.owner(key) == 'd' for key in moved), (
+            'При добавлении узла ключи должны переходить только к нему'
+        )
+        assert 150 < len(moved) < 350, (
+            'Новый узел должен забрать примерно четверть ключей'
+        )
+
+
+class TestShardCoordinator:
+
+    def test_workers_split_subscriptions_without_overlap(self, tmp_path):
+        path = str(tmp_path / 'leases.sqlite3')
+        registry = build_registry(40)
+        clock = FakeClock(1000.0)
+        first = coordinator(path, registry, 'w1', clock)
+        second = coordinator(path, registry, 'w2', clock)
+
+        first.refresh()
+        assert len(first.leased) == 40, (
+            'Единственный процесс должен взять все подписки'
+        )
+        second.refresh()
+        assert not second.leased, (
+            'Чужие действующие аренды нельзя забирать'
+        )
+        first.refresh()
+        assert first.leased and len(first.leased) < 40, (
+            'Увидев второй процесс, первый перестаёт опрашивать его подписки'
+        )
+        first.refresh()
+        second.refresh()
+        assert not first.leased & second.leased, (
+            'Подписку не должны опрашивать два процесса сразу'
+        )
+        assert first.leased | second.leased == {
+            subscription.key for subscription in registry
+        }, 'После ребалансировки каждую подписку опрашивает один процесс'
+
+    def test_dead_worker_leases_are_taken_over(self, tmp_path):
+        path = str(tmp_path / 'leases.sqlite3')
+        registry = build_registry(20)
+        clock = FakeClock(1000.0)
+        first = coordinator(path, registry, 'w1', clock)
+        second = coordinator(path, registry, 'w2', clock)
+        first.refresh()
+        second.refresh()
+        first.refresh()
+        first.refresh()
+        second.refresh()
+        assert first.leased, 'У первого процесса должны быть подписки'
+
+        # первый процесс упал и больше не продлевает аренды
+        clock.now += 31
+        acquired, _ = second.refresh()
+        assert len(second.leased) == 20 and acquired == first.leased, (
+            'Подписки упавшего процесса должны перейти к живому'
+        )
+        assert not any(first.holds(key) for key in first.leased), (
+            'Процесс с истёкшей арендой не должен опрашивать'
+        )
+
+    def test_leave_flushes_and_releases_at_once(self, tmp_path):
+        path = str(tmp_path / 'leases.sqlite3')
+        registry = build_registry(10)
+        clock = FakeClock(1000.0)
+        released = []
+        first = coordinator(
+            path, registry, 'w1', clock, on_release=released.extend
+        )
+        second = coordinator(path, registry, 'w2', clock)
+        first.refresh()
+        view = ShardView(registry, first)
+        assert len(view) == 10 and 'missing' not in view
+
+        first.leave()
+        assert set(released) == {s.key for s in registry}, (
+            'Перед уходом процесс должен сбросить состояние подписок'
+        )
+        assert not len(view)
+        second.refresh()
+        assert len(second.leased) == 10, (
+            'Аренды остановленного процесса освобождаются сразу'
+        )
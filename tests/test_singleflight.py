@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class TestSingleFlight:
+
+    def test_concurrent_calls_share_one_execution(self):
+        flight = SingleFlight('test')
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        async def main():
+            shared = await asyncio.gather(
+                *(flight.do('token', fetch) for _ in range(10))
+            )
+            return shared, await flight.do('token', fetch)
+
+        shared, later = asyncio.run(main())
+        assert shared == [1] * 10, (
+            'Одновременные вызовы с одним ключом должны получить '
+            'результат одного выполнения'
+        )
+        assert later == 2, (
+            'Вызов после завершения должен выполняться заново'
+        )
+
+    def test_error_is_shared_and_not_remembered(self):
+        flight = SingleFlight('test')
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ConnectionError('api недоступен')
+
+        async def main():
+            return await asyncio.gather(
+                flight.do('token', fail), flight.do('token', fail),
+                return_exceptions=True
+            )
+
+        errors = asyncio.run(main())
+        assert all(isinstance(error, ConnectionError) for error in errors)
+        assert 'token' not in flight, (
+            'Завершившийся с ошибкой вызов не должен оставаться в полёте'
+        )
+        with pytest.raises(ConnectionError):
+            asyncio.run(flight.do('token', fail))
@@ -0,0 +1,127 @@
+import asyncio
+
+from telegram.error import NetworkError
+
+from outbox import OutboundQueue
+import spool as spool_module
+from spool import MessageSpool
+
+
+class TestMessageSpool:
+
+    def test_pending_survives_reopen(self, tmp_path):
+        path = str(tmp_path / 'spool')
+        spool = MessageSpool(path)
+        first = spool.append(1, 'a')
+        spool.append(2, 'b')
+        spool.ack([first])
+        spool.close()
+
+        reopened = MessageSpool(path)
+        assert reopened.pending() == [(2, 2, 'b')], (
+            'После перезапуска в журнале должны остаться '
+            'только неподтверждённые сообщения'
+        )
+        assert reopened.append(3, 'c') == 3
+
+    def test_kind_survives_reopen_and_compaction(self, tmp_path):
+        path = str(tmp_path / 'spool')
+        spool = MessageSpool(path, compact_every=1)
+        first = spool.append(1, 'a')
+        second = spool.append(1, 'сводка', kind='digest')
+        spool.ack([first])
+        spool.compact()
+        spool.close()
+
+        reopened = MessageSpool(path)
+        assert reopened.kind(second) == 'digest', (
+            'Вид сообщения должен сохраняться в журнале'
+        )
+
+    def test_torn_last_line_is_skipped(self, tmp_path):
+        path = tmp_path / 'spool'
+        path.write_text('{"id": 1, "chat_id": 1, "text": "a"}\n{"id": 2, "ch')
+
+        spool = MessageSpool(str(path))
+        spool.append(1, 'b')
+        spool.close()
+
+        assert [text for _, _, text in MessageSpool(str(path)).pending()] == [
+            'a', 'b'
+        ], 'Недописанная строка не должна портить журнал'
+
+    def test_compact(self, tmp_path):
+        path = tmp_path / 'spool'
+        spool = MessageSpool(str(path), compact_every=2)
+        ids = [spool.append(1, str(index)) for index in range(3)]
+        spool.ack(ids[:2])
+
+        assert spool.needs_compaction
+        spool.compact()
+        spool.close()
+
+        assert len(path.read_text().splitlines()) == 1, (
+            'После сжатия в журнале должны остаться '
+            'только неподтверждённые сообщения'
+        )
+        assert MessageSpool(str(path)).pending() == [(3, 1, '2')]
+
+
+class TestOutboxSpool:
+
+    def test_undelivered_message_is_retried_from_spool(self, tmp_path):
+        spool = MessageSpool(str(tmp_path / 'spool'))
+        attempts = []
+
+        async def send(chat_id, text):
+            attempts.append(text)
+            if len(attempts) == 1:
+                raise NetworkError('telegram is down')
+            return True
+
+        queue = OutboundQueue(
+            send, chat_rate=1000, global_rate=1000,
+            spool=spool, spool_retry_interval=0.05
+        )
+
+        async def action():
+            worker = asyncio.create_task(queue.run())
+            first = await queue.put(1, 'text')
+            await asyncio.sleep(0.2)
+            worker.cancel()
+            await asyncio.gather(worker, return_exceptions=True)
+            return first
+
+        assert asyncio.run(action()) is False
+        assert attempts == ['text', 'text'], (
+            'Недоставленное сообщение должно быть отправлено повторно '
+            'из журнала'
+        )
+        assert len(spool) == 0, (
+            'Доставленное сообщение должно быть подтверждено в журнале'
+        )
+
+    def test_broadcast_is_spooled_with_one_fsync(self, monkeypatch,
+                                                 tmp_path):
+        fsyncs = []
+        real_fsync = spool_module.os.fsync
+        monkeypatch.setattr(
+            spool_module.os, 'fsync',
+            lambda fd: fsyncs.append(fd) or real_fsync(fd)
+        )
+        spool = MessageSpool(str(tmp_path / 'spool'))
+        queue = OutboundQueue(
+            lambda chat_id, text: None, spool=spool
+        )
+
+        async def action():
+            queue.broadcast(range(50), 'статус изменился')
+
+        asyncio.run(action())
+        assert len(fsyncs) == 1, (
+            'Рассылка по нескольким чатам должна писаться в журнал '
+            'одним fsync'
+        )
+        assert [chat_id for _, chat_id, _ in spool.pending()] == list(
+            range(50)
+        )
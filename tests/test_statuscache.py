@@ -0,0 +1,63 @@
+import asyncio
+
+from statuscache import StatusCache
+from utils import FakeClock
+
+
+class TestStatusCache:
+
+    def test_concurrent_misses_share_one_fetch(self):
+        cache = StatusCache(ttl=60, clock=FakeClock())
+        calls = []
+
+        async def fetch():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return [{'id': 1, 'status': 'reviewing'}]
+
+        async def main():
+            return await asyncio.gather(
+                *(cache.get('t', fetch) for _ in range(5))
+            )
+
+        results = asyncio.run(main())
+        assert len(calls) == 1, (
+            'Одновременные запросы одного ключа должны ждать одну загрузку'
+        )
+        assert all(result == results[0] for result in results)
+        asyncio.run(cache.get('t', fetch))
+        assert len(calls) == 1, 'Свежая запись должна отдаваться из кэша'
+
+    def test_polls_extend_entry(self):
+        clock = FakeClock()
+        cache = StatusCache(ttl=60, clock=clock)
+        cache.update('t', [{'id': 1, 'status': 'reviewing'}])
+        assert cache.fresh('t') is None, (
+            'Опрос не должен создавать неполную запись'
+        )
+
+        cache.replace('t', [{'id': 1, 'status': 'reviewing'},
+                            {'id': 2, 'status': 'approved'}])
+        clock.now = 50
+        cache.update('t', [{'id': 1, 'status': 'approved'}])
+        clock.now = 100
+        statuses = {hw['id']: hw['status'] for hw in cache.fresh('t')}
+        assert statuses == {1: 'approved', 2: 'approved'}, (
+            'Опрос должен вливать изменения и продлевать запись'
+        )
+        clock.now = 200
+        assert cache.fresh('t') is None, 'Запись старше ttl устарела'
+
+    def test_failed_fetch_is_not_cached(self):
+        cache = StatusCache(ttl=60, clock=FakeClock())
+
+        async def fail():
+            raise ConnectionError('api недоступен')
+
+        try:
+            asyncio.run(cache.get('t', fail))
+        except ConnectionError:
+            pass
+        assert cache.fresh('t') is None and 't' not in cache._flight, (
+            'Ошибка загрузки не должна попадать в кэш'
+        )
@@ -0,0 +1,79 @@
+import storage
+
+
+class TestCursorStore:
+
+    def test_cursor_only_moves_forward(self, tmp_path):
+        store = storage.CursorStore(str(tmp_path / 'state.sqlite3'))
+
+        assert store.get('tenant') is None
+        store.advance('tenant', 100)
+        store.advance('tenant', 50)
+
+        assert store.get('tenant') == 100, (
+            'Курсор не должен сдвигаться назад'
+        )
+
+    def test_cursor_survives_reopen(self, tmp_path):
+        path = str(tmp_path / 'state.sqlite3')
+        store = storage.CursorStore(path)
+        store.advance('tenant', 100)
+        store.close()
+
+        assert storage.CursorStore(path).get('tenant') == 100, (
+            'Курсор должен сохраняться между перезапусками'
+        )
+
+
+class TestStateStore:
+
+    def test_put_get_and_batched_flush(self, tmp_path):
+        path = str(tmp_path / 'state.sqlite3')
+        store = storage.StateStore(path, batch_size=3, flush_interval=3600)
+
+        store.put('tenant', '1', 'reviewing', '2022-01-01')
+        store.put('other', '1', 'approved', '2022-01-02')
+
+        assert store.get('tenant', '1') == ('reviewing', '2022-01-01')
+        assert storage.StateStore(path).get('tenant', '1') is None, (
+            'Изменения должны копиться до заполнения пачки'
+        )
+
+        store.put('tenant', '2', 'rejected', '2022-01-03')
+        reopened = storage.StateStore(path)
+        assert reopened.get('tenant', '2') == ('rejected', '2022-01-03'), (
+            'Заполненная пачка должна записываться в базу'
+        )
+        assert reopened.get('other', '1') == ('approved', '2022-01-02'), (
+            'Состояния пользователей должны храниться раздельно'
+        )
+
+    def test_discard_and_close(self, tmp_path):
+        path = str(tmp_path / 'state.sqlite3')
+        store = storage.StateStore(path, flush_interval=3600)
+        store.put('tenant', '1', 'approved')
+        store.put('tenant', '2', 'approved')
+        store.discard('tenant', '1')
+        store.close()
+
+        reopened = storage.StateStore(path)
+        assert reopened.get('tenant', '1') is None
+        assert reopened.get('tenant', '2') == ('approved', None), (
+            'При закрытии хранилища изменения должны записываться'
+        )
+
+    def test_evict_rereads_rows_written_elsewhere(self, tmp_path):
+        path = str(tmp_path / 'state.sqlite3')
+        store = storage.StateStore(path, flush_interval=3600)
+        store.put('tenant', '1', 'reviewing')
+        store.evict(['tenant'])
+
+        other = storage.StateStore(path, flush_interval=3600)
+        assert other.get('tenant', '1') == ('reviewing', None), (
+            'Выгрузка должна записывать накопленные изменения'
+        )
+        other.put('tenant', '1', 'approved')
+        other.flush()
+        assert store.get('tenant', '1') == ('approved', None), (
+            'После выгрузки строки должны читаться из базы заново'
+        )
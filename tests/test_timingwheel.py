@@ -0,0 +1,110 @@
+import asyncio
+import time
+
+import engine
+from timingwheel import TimingWheel
+from utils import FakeClock
+
+
+def run_until(wheel, clock, until, step=1.0):
+    fired = {}
+    while clock.now < until:
+        clock.now += step
+        for key, _, _ in wheel.advance():
+            fired[key] = clock.now
+    return fired
+
+
+class TestTimingWheel:
+
+    def test_timers_fire_on_time_across_levels(self):
+        clock = FakeClock()
+        wheel = TimingWheel(tick=1, slots=4, levels=3, clock=clock)
+        delays = {
+            f'k{delay}': delay for delay in (1, 3, 4, 5, 15, 17, 63, 100)
+        }
+        for key, delay in delays.items():
+            wheel.schedule(key, delay, value=key)
+
+        fired = run_until(wheel, clock, 120)
+        assert fired == delays, (
+            'Таймер должен срабатывать в свой тик на любом уровне колеса'
+        )
+        assert not len(wheel)
+
+    def test_cancel_and_reschedule(self):
+        clock = FakeClock()
+        wheel = TimingWheel(tick=1, slots=4, levels=2, clock=clock)
+        wheel.schedule('a', 10)
+        wheel.schedule('b', 10)
+        assert wheel.cancel('a') and not wheel.cancel('a')
+        wheel.schedule('b', 2)
+
+        assert run_until(wheel, clock, 20) == {'b': 2}, (
+            'Отменённый таймер не должен срабатывать, '
+            'а повторный заменяет прежний'
+        )
+
+
+class TestWheelEngine:
+
+    def test_rate_limit_spreads_due_polls(self):
+        registry = engine.TenantRegistry()
+        for index in range(10):
+            registry.add(f'token-{index}', index)
+        started = []
+
+        async def handler(subscription):
+            started.append((time.monotonic(), subscription.key))
+
+        async def main():
+            # все сроки совпадают: опрос каждой подписки раз в 10 мс
+            polling = engine.PollingEngine(
+                registry, handler, interval=0.01, sync_interval=60,
+                wheel=TimingWheel(tick=0.01), max_rate=50
+            )
+            task = asyncio.create_task(polling.run())
+            await asyncio.sleep(0.4)
+            assert polling.stats()['backlog'] > 0, (
+                'Подписки сверх max_rate должны ждать в очереди'
+            )
+            polling.stop()
+            await task
+
+        asyncio.run(main())
+        assert {key for _, key in started} == {s.key for s in registry}, (
+            'Каждая подписка должна быть опрошена'
+        )
+        assert len(started) <= 0.4 * 50 + 1, (
+            'Опросов не должно быть больше max_rate в секунду'
+        )
+        gaps = [b - a for (a, _), (b, _) in zip(started, started[1:])]
+        assert min(gaps) >= 0.015, 'Опросы должны идти ровным потоком'
+
+    def test_no_polls_start_after_stop(self):
+        registry = engine.TenantRegistry()
+        for index in range(5):
+            registry.add(f'token-{index}', index)
+
+        started = []
+
+        async def handler(subscription):
+            started.append(subscription.key)
+
+        async def main():
+            polling = engine.PollingEngine(
+                registry, handler, interval=0,
+                wheel=TimingWheel(tick=0.05)
+            )
+            polling._sync_wheel()
+            dispatcher = asyncio.create_task(polling._dispatch())
+            # stop() приходит, пока диспетчер спит до следующего тика
+            await asyncio.sleep(0.01)
+            polling.stop()
+            await asyncio.wait_for(dispatcher, 1)
+            await asyncio.sleep(0.01)
+
+        asyncio.run(main())
+        assert not started, (
+            'После stop() диспетчер не должен начинать новые опросы'
+        )
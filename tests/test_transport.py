@@ -0,0 +1,103 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+import pytest
+import requests
+
+import transport
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # сколько запросов /stall-once ещё зависнет
+    stalls = 0
+
+    def do_GET(self):
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+        if self.path.startswith('/stall-once') and SlowHandler.stalls:
+            SlowHandler.stalls -= 1
+            time.sleep(1)
+        body = b'{"homeworks": [], "current_date": 1}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://localhost:{server.server_port}'
+    server.shutdown()
+    server.server_close()
+
+
+class TestTransport:
+
+    def test_keep_alive_reuses_connection(self, server_url):
+        http = transport.HttpTransport()
+        first = http.get(server_url + '/')
+        second = http.get(server_url + '/')
+
+        assert first.json() == second.json()
+        timings = list(http.stats._timings['localhost'])
+        assert not timings[0].reused, (
+            'Первый запрос должен открыть новое соединение'
+        )
+        assert timings[0].dns > 0 and timings[0].connect > 0, (
+            'Для нового соединения должны быть замерены dns и connect'
+        )
+        assert timings[1].reused, (
+            'Второй запрос должен уйти по keep-alive соединению'
+        )
+        summary = http.stats.summary()['localhost']
+        assert summary['count'] == 2 and summary['reused'] == 0.5
+
+    def test_read_timeout(self, server_url):
+        http = transport.HttpTransport(read_timeout=0.1)
+        with pytest.raises(requests.exceptions.ReadTimeout):
+            http.get(server_url + '/slow')
+
+        timing = http.stats._timings['localhost'][-1]
+        assert timing.status_code is None and timing.total < 0.5, (
+            'Зависший запрос должен прерываться по таймауту чтения'
+        )
+
+    def test_telegram_request_shares_timeouts(self):
+        http = transport.HttpTransport(connect_timeout=1, read_timeout=2)
+        request = http.telegram_request(con_pool_size=4)
+
+        assert request.con_pool_size == 4
+        assert request.stats is http.stats
+
+    def test_hedged_request_caps_tail_latency(self, server_url, monkeypatch):
+        http = transport.HttpTransport(hedge_min_samples=5)
+        assert http.hedged_get(server_url + '/').status_code == 200, (
+            'Без замеров запрос должен идти без дублей'
+        )
+        for _ in range(5):
+            http.get(server_url + '/')
+        monkeypatch.setattr(SlowHandler, 'stalls', 1)
+
+        started = time.perf_counter()
+        response = http.hedged_get(server_url + '/stall-once')
+        elapsed = time.perf_counter() - started
+
+        assert response.json()['current_date'] == 1
+        assert elapsed < 0.5, (
+            'Зависший запрос должен обгонять дубль после p95'
+        )
+        assert transport.HEDGED_REQUESTS.value(
+            host='localhost', result='won'
+        ) >= 1
+        # дожидаемся проигравшего запроса, он дочитывается в фоне
+        http._hedge_pool.shutdown(wait=True)
+        http.close()
@@ -0,0 +1,36 @@
+import logging
+import time
+
+from telegram.utils.request import Request
+
+from transport import RequestTiming
+
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramRequest(Request):
+    """Request python-telegram-bot, который пишет замеры в TimingStats.
+
+    У библиотеки свой пул urllib3, поэтому здесь известно
+    только полное время запроса.
+    """
+
+    __slots__ = ('stats',)
+
+    def __init__(self, stats, **kwargs):
+        """Инициализация переменных."""
+        super().__init__(**kwargs)
+        self.stats = stats
+
+    def _request_wrapper(self, method, url, *args, **kwargs):
+        # в url есть токен бота, поэтому в замер попадает только хост
+        timing = RequestTiming(method, url)
+        timing.detailed = False
+        started = time.perf_counter()
+        try:
+            return super()._request_wrapper(method, url, *args, **kwargs)
+        finally:
+            timing.finish(None, time.perf_counter() - started)
+            self.stats.add(timing)
+            logger.debug('%s', timing)
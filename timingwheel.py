@@ -0,0 +1,101 @@
+import math
+import time
+
+
+class TimingWheel:
+    """Иерархическое колесо таймеров.
+
+    Время делится на тики по tick секунд. Уровень 0 — slots корзин
+    по одному тику, каждый следующий уровень — slots корзин, каждая
+    из которых в slots раз шире корзины уровня ниже. Таймер кладётся
+    в корзину самого нижнего уровня, в диапазон которого попадает;
+    когда стрелка доходит до корзины верхнего уровня, её таймеры
+    раскладываются по нижним. Вставка и отмена — O(1), продвижение
+    на тик — O(1) плюс сработавшие и разложенные таймеры.
+
+    Таймеры дальше slots ** levels тиков кладутся на верхний уровень
+    и перекладываются, пока не подойдёт их время.
+    """
+
+    def __init__(self, tick=0.1, slots=256, levels=3, clock=time.monotonic):
+        """Инициализация переменных."""
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self._started = clock()
+        self._current = 0
+        # уровень -> корзина -> {ключ: (тик срабатывания, срок, значение)}
+        self._wheels = [[{} for _ in range(slots)] for _ in range(levels)]
+        # ключ -> корзина, в которой лежит его таймер
+        self._index = {}
+
+    def schedule(self, key, delay, value=None):
+        """Заводим таймер ключа через delay секунд.
+
+        Прежний таймер ключа отменяется. Таймер срабатывает не раньше
+        срока и не позже чем через тик после него.
+        """
+        self.cancel(key)
+        deadline = self.clock() + max(delay, 0)
+        target = math.ceil((deadline - self._started) / self.tick)
+        self._insert(key, max(target, self._current + 1), deadline, value)
+
+    def cancel(self, key):
+        """Отменяем таймер ключа; False, если его не было."""
+        bucket = self._index.pop(key, None)
+        if bucket is None:
+            return False
+        del bucket[key]
+        return True
+
+    def advance(self):
+        """Двигаем стрелку до текущего времени.
+
+        Возвращаем сработавшие таймеры [(ключ, срок, значение)]
+        в порядке срабатывания.
+        """
+        now = math.floor((self.clock() - self._started) / self.tick)
+        expired = []
+        while self._current < now:
+            self._current += 1
+            self._cascade()
+            bucket = self._wheels[0][self._current % self.slots]
+            for key, (_, deadline, value) in bucket.items():
+                del self._index[key]
+                expired.append((key, deadline, value))
+            bucket.clear()
+        return expired
+
+    def _insert(self, key, target, deadline, value):
+        distance = target - self._current
+        level = 0
+        while level < self.levels - 1 and distance >= self.slots ** (
+            level + 1
+        ):
+            level += 1
+        slot = (target // self.slots ** level) % self.slots
+        bucket = self._wheels[level][slot]
+        bucket[key] = (target, deadline, value)
+        self._index[key] = bucket
+
+    def _cascade(self):
+        """Раскладываем корзины верхних уровней, до которых дошла стрелка."""
+        for level in range(self.levels - 1, 0, -1):
+            span = self.slots ** level
+            if self._current % span:
+                continue
+            bucket = self._wheels[level][(self._current // span) % self.slots]
+            entries = list(bucket.items())
+            bucket.clear()
+            for key, (target, deadline, value) in entries:
+                del self._index[key]
+                self._insert(
+                    key, max(target, self._current), deadline, value
+                )
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
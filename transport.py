@@ -0,0 +1,406 @@
+from collections import defaultdict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+)
+import hashlib
+import logging
+import socket
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# замер текущего запроса; соединение дописывает в него dns и connect
+_local = threading.local()
+
+PHASES = ('dns', 'connect', 'ttfb', 'body', 'total')
+
+HTTP_RESPONSES = metrics.registry.counter(
+    'bot_http_responses_total', 'Ответы по хостам и http-кодам',
+    ('host', 'code')
+)
+HEDGED_REQUESTS = metrics.registry.counter(
+    'bot_hedged_requests_total',
+    'Дублирующие запросы: отправленные, выигравшие и пропущенные',
+    ('host', 'result')
+)
+
+
+class RequestTiming:
+    """Время фаз одного http-запроса в секундах.
+
+    dns и connect равны нулю, если запрос ушёл
+    по уже открытому keep-alive соединению.
+    """
+
+    def __init__(self, method, url):
+        """Инициализация переменных."""
+        self.method = method
+        self.host = urlsplit(url).hostname
+        self.status_code = None
+        self.dns = 0.0
+        self.connect = 0.0
+        self.ttfb = 0.0
+        self.body = 0.0
+        self.total = 0.0
+        self.detailed = True
+
+    @property
+    def reused(self):
+        """Запрос ушёл по переиспользованному соединению."""
+        if not self.detailed:
+            return None
+        return self.connect == 0.0
+
+    def finish(self, response, total):
+        """Заполняем оставшиеся фазы по готовому ответу."""
+        self.total = total
+        if response is None:
+            return
+
+        self.status_code = getattr(response, 'status_code', None)
+        elapsed = getattr(response, 'elapsed', None)
+        # requests считает elapsed до получения заголовков ответа,
+        # тело без stream=True дочитывается уже после
+        if elapsed is not None:
+            headers_received = elapsed.total_seconds()
+            self.ttfb = max(headers_received - self.dns - self.connect, 0.0)
+            self.body = max(total - headers_received, 0.0)
+
+    def __repr__(self):
+        phases = ', '.join(
+            f'{phase}={getattr(self, phase) * 1000:.1f}ms' for phase in PHASES
+        )
+        return (f'{self.method} {self.host} {self.status_code}: {phases}, '
+                f'reused={self.reused}')
+
+
+class TimingStats:
+    """Последние замеры запросов, сгруппированные по хостам."""
+
+    def __init__(self, size=1000):
+        """Инициализация переменных."""
+        self._timings = defaultdict(lambda: deque(maxlen=size))
+        self._lock = threading.Lock()
+
+    def add(self, timing):
+        """Сохраняем замер."""
+        with self._lock:
+            self._timings[timing.host].append(timing)
+
+    def percentile(self, host, phase, q, min_count=1):
+        """Перцентиль q (0..100) фазы phase по хосту.
+
+        None, если замеров меньше min_count.
+        """
+        with self._lock:
+            values = sorted(
+                getattr(timing, phase) for timing in self._timings[host]
+            )
+        if not values or len(values) < min_count:
+            return None
+        index = min(int(len(values) * q / 100), len(values) - 1)
+        return values[index]
+
+    def summary(self):
+        """Сводка p50/p95/p99 по фазам и доля переиспользованных соединений."""
+        result = {}
+        for host in list(self._timings):
+            with self._lock:
+                timings = list(self._timings[host])
+            if not timings:
+                continue
+            detailed = [t for t in timings if t.detailed]
+            host_summary = {'count': len(timings)}
+            if detailed:
+                host_summary['reused'] = (
+                    sum(t.reused for t in detailed) / len(detailed)
+                )
+            for phase in PHASES:
+                for q in (50, 95, 99):
+                    host_summary[f'{phase}_p{q}'] = self.percentile(
+                        host, phase, q
+                    )
+            result[host] = host_summary
+        return result
+
+
+class _TimedConnectionMixin:
+    """Замеряем dns и установку соединения (tcp + tls)."""
+
+    def _new_conn(self):
+        timing = getattr(_local, 'timing', None)
+        if timing is None:
+            return super()._new_conn()
+
+        started = time.perf_counter()
+        try:
+            addresses = socket.getaddrinfo(
+                self._dns_host, self.port, 0, socket.SOCK_STREAM
+            )
+        except socket.gaierror as error:
+            raise NewConnectionError(
+                self, f'Failed to establish a new connection: {error}'
+            )
+        timing.dns = time.perf_counter() - started
+
+        # подключаемся к уже разрешённым адресам, чтобы не делать
+        # dns-запрос второй раз внутри urllib3
+        host = self._dns_host
+        try:
+            for address in addresses:
+                self._dns_host = address[4][0]
+                try:
+                    return super()._new_conn()
+                except NewConnectionError as error:
+                    last_error = error
+            raise last_error
+        finally:
+            self._dns_host = host
+
+    def connect(self):
+        timing = getattr(_local, 'timing', None)
+        started = time.perf_counter()
+        super().connect()
+        if timing is not None:
+            timing.connect = time.perf_counter() - started - timing.dns
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """Адаптер requests, пулы которого замеряют соединения."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+class ResponseCache:
+    """Признаки последнего обработанного ответа по ключу.
+
+    Если сервер отдаёт ETag или Last-Modified, следующий запрос идёт
+    с If-None-Match или If-Modified-Since, и ответ 304 означает
+    «без изменений». Иначе сравнивается дайджест сырого тела;
+    ignore — регулярное выражение для частей тела, которые меняются
+    в каждом ответе и на смысл не влияют.
+
+    check() только сравнивает, а запоминает ответ confirm() —
+    после того как ответ обработан, иначе сбой обработки
+    спрятал бы следующий такой же ответ.
+    """
+
+    def __init__(self, ignore=None):
+        """Инициализация переменных."""
+        self.ignore = ignore
+        # ключ -> (etag, last_modified, дайджест тела)
+        self._entries = {}
+        self._candidates = {}
+        self._lock = threading.Lock()
+
+    def conditional_headers(self, key):
+        """Заголовки условного запроса для ключа."""
+        entry = self._entries.get(key)
+        headers = {}
+        if entry is not None:
+            if entry[0]:
+                headers['If-None-Match'] = entry[0]
+            if entry[1]:
+                headers['If-Modified-Since'] = entry[1]
+        return headers
+
+    def check(self, key, response):
+        """Ответ совпадает с последним подтверждённым для ключа."""
+        previous = self._entries.get(key)
+        if response.status_code == requests.codes.not_modified:
+            return previous is not None
+        body = response.content
+        if self.ignore is not None:
+            body = self.ignore.sub(b'', body)
+        entry = (
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified'),
+            hashlib.blake2b(body, digest_size=16).digest()
+        )
+        with self._lock:
+            self._candidates[key] = entry
+        return previous is not None and previous[2] == entry[2]
+
+    def confirm(self, key):
+        """Запоминаем ответ, который check() видел последним."""
+        with self._lock:
+            entry = self._candidates.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+
+    def forget(self, key):
+        """Забываем ответы ключа."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._candidates.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _first_success(*futures):
+    """Первый успешно завершившийся future, а если упали все — последний."""
+    pending = set(futures)
+    failed = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        # если готовы сразу несколько, берём тот, что раньше в futures
+        for future in futures:
+            if future in done:
+                if future.exception() is None:
+                    return future
+                failed = future
+    return failed
+
+
+class HttpTransport:
+    """Общий http-транспорт: пул keep-alive соединений и таймауты.
+
+    Один экземпляр разделяется всеми потоками опроса, поэтому
+    pool_maxsize стоит держать не меньше числа одновременных запросов.
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=10,
+                 pool_connections=10, pool_maxsize=10, stats_size=1000,
+                 hedge_ratio=0.1, hedge_min_samples=20):
+        """Инициализация переменных."""
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.stats = TimingStats(stats_size)
+        self.hedge_ratio = hedge_ratio
+        self.hedge_min_samples = hedge_min_samples
+        self._hedge_pool = None
+        self._hedge_counts = [0, 0]
+        self._hedge_lock = threading.Lock()
+        self._pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+
+        adapter = TimedHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=0
+        )
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @property
+    def timeout(self):
+        """Таймауты в формате requests: (connect, read)."""
+        return (self.connect_timeout, self.read_timeout)
+
+    def get(self, url, **kwargs):
+        """GET-запрос через общий пул с замером фаз."""
+        kwargs.setdefault('timeout', self.timeout)
+        timing = RequestTiming('GET', url)
+        response = None
+        _local.timing = timing
+        started = time.perf_counter()
+        try:
+            response = self.session.get(url, **kwargs)
+            return response
+        finally:
+            _local.timing = None
+            timing.finish(response, time.perf_counter() - started)
+            self.stats.add(timing)
+            HTTP_RESPONSES.inc(
+                host=timing.host, code=timing.status_code or 'error'
+            )
+            logger.debug('%s', timing)
+
+    def hedged_get(self, url, percentile=95, **kwargs):
+        """GET, который дублируется, если ответ задержался дольше перцентиля.
+
+        Пока ответа нет дольше percentile-перцентиля полного времени
+        запросов к хосту, отправляется второй такой же запрос, и
+        возвращается ответ, пришедший первым. Дублей не больше
+        hedge_ratio от всех запросов, чтобы медленный сервер не
+        получил удвоенную нагрузку; пока замеров меньше
+        hedge_min_samples, запрос идёт как обычный get().
+        Запрос, который проиграл, не прерывается, а дочитывается
+        в фоне, поэтому годится только для идемпотентных запросов.
+        """
+        host = urlsplit(url).hostname
+        hedge_after = self.stats.percentile(
+            host, 'total', percentile, self.hedge_min_samples
+        )
+        if hedge_after is None:
+            return self.get(url, **kwargs)
+
+        with self._hedge_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(
+                    max_workers=2 * self._pool_maxsize,
+                    thread_name_prefix='hedge'
+                )
+            self._hedge_counts[0] += 1
+        first = self._hedge_pool.submit(self.get, url, **kwargs)
+        try:
+            return first.result(timeout=hedge_after)
+        except FutureTimeout:
+            pass
+
+        with self._hedge_lock:
+            requests_sent, hedges_sent = self._hedge_counts
+            allowed = hedges_sent < self.hedge_ratio * requests_sent
+            if allowed:
+                self._hedge_counts[1] += 1
+        if not allowed:
+            HEDGED_REQUESTS.inc(host=host, result='skipped')
+            return first.result()
+
+        HEDGED_REQUESTS.inc(host=host, result='sent')
+        second = self._hedge_pool.submit(self.get, url, **kwargs)
+        winner = _first_success(first, second)
+        if winner is second:
+            HEDGED_REQUESTS.inc(host=host, result='won')
+        return winner.result()
+
+    def telegram_request(self, con_pool_size=1):
+        """Request для telegram.Bot с теми же таймаутами и замерами."""
+        # python-telegram-bot импортируется, только когда нужен бот
+        from tgrequest import TelegramRequest
+
+        return TelegramRequest(
+            self.stats,
+            con_pool_size=con_pool_size,
+            connect_timeout=self.connect_timeout,
+            read_timeout=self.read_timeout
+        )
+
+    def close(self):
+        """Закрываем соединения пула."""
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()